@@ -1,15 +1,32 @@
+from collections import namedtuple
 from collections.abc import Callable
 from configparser import ConfigParser
 from pathlib import Path
 from functools import partial
-from src.images.image import BaseImage, TiffImage, CziImage, stable_read
-from src.engine.images_queue import BaseQueue, LazyQueue, EagerQueue
+from hashlib import sha1
+from src.images.image import BaseImage, TiffImage, CziImage, MosaicImage, stable_read, memmap_read
+from src.images.tiles import open_czi_tiles, open_tiff_tiles
+from src.images.plane_cache import PlaneCache
+from src.engine.images_queue import LazyQueue, EagerQueue, PriorityQueue, MultiSourceQueue
 from src.images.bayesian import Trainer, Tester
 from src.processing.processor import Processor
+from src.processing.tiled import TiledProcessor, HALO
+from src.processing.result_cache import ResultCache
+from src.processing.background import annulus_correction, flat_field_correction, load_background
+from src.processing.pipeline import PipelineStage, STAGE_TYPES, compile_plan, default_stages, validate_stages
+from src.engine.profiling import SessionProfiler
+from src.engine.metrics import SessionMetrics, MetricsExporter
 import src.processing.processing_functions as pf
 from czifile import imread as cziread
 from tifffile import imread as tiffread
 
+def _record_read(metrics: SessionMetrics, wait_s: float, read_s: float, size: int) -> None:
+    metrics.observe('stable_read_wait_seconds', wait_s)
+    metrics.observe('stage_seconds', read_s, stage='read')
+    metrics.inc('bytes_read_total', size)
+
+Source = namedtuple('Source', ['name', 'directory', 'image_format', 'scaling', 'white_point'])
+
 class Config:
     def __init__(self):
         self._config = ConfigParser()
@@ -17,15 +34,51 @@ class Config:
             self._create_default()
         self._config.read('options.ini')
 
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Config':
+        config = cls.__new__(cls)
+        config._config = ConfigParser()
+        config._config.read_dict(data)
+        return config
+
+    def to_dict(self) -> dict:
+        return {section: {option: self._config.get(section, option, raw=True) for option in self._config.options(section)}
+                for section in self._config.sections()}
+
     @property
     def directory(self) -> Path:
         to_return = self._config.get('files', 'Directory', fallback='None')
         return Path(to_return) if to_return.lower() != 'none' else None
 
+    @property
+    def sources(self) -> list[Source]:
+        #[files] Directory is the default source; each [source:<name>] section adds one, falling back to [images]
+        sources = [Source(name='default', directory=self.directory, image_format=self.image_format,
+                          scaling=self.scaling, white_point=self.white_point)]
+        for section in self._config.sections():
+            if not section.lower().startswith('source:'):
+                continue
+            directory = self._config.get(section, 'Directory', fallback='None')
+            sources.append(Source(name=section.split(':', 1)[1].strip(),
+                                  directory=Path(directory) if directory.lower() != 'none' else None,
+                                  image_format=self._config.get(section, 'Image_Format', fallback=self.image_format),
+                                  scaling=self._config.getfloat(section, 'Scaling', fallback=self.scaling),
+                                  white_point=self._config.getint(section, 'White_Point', fallback=self.white_point)))
+        return sources
+
     @property
     def queue_type(self) -> str:
         return self._config.get('files', 'Queue_Type', fallback='File')
 
+    @property
+    def queue_order(self) -> str:
+        return self._config.get('files', 'Queue_Order', fallback='FIFO')
+
+    @property
+    def scan_index(self) -> Path:
+        to_return = self._config.get('files', 'Scan_Index', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
     @property
     def write_labels(self) -> bool:
         return self._config.getboolean('files', 'Write_Labels', fallback=True)
@@ -38,11 +91,74 @@ class Config:
     def write_roi(self) -> bool:
         return self._config.getboolean('files', 'Write_ROI', fallback=False)
 
+    @property
+    def resume_batch(self) -> bool:
+        return self._config.getboolean('files', 'Resume_Batch', fallback=False)
+
     @property
     def output_directory(self) -> Path:
         to_return =  self._config.get('files', 'Output_Directory', fallback='./output')
         return Path(to_return) if to_return.lower() != 'none' else None
 
+    @property
+    def server_host(self) -> str:
+        return self._config.get('server', 'Host', fallback='127.0.0.1')
+
+    @property
+    def server_port(self) -> int:
+        return self._config.getint('server', 'Port', fallback=8765)
+
+    @property
+    def server_socket(self) -> Path:
+        to_return = self._config.get('server', 'Socket', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def server_workers(self) -> int:
+        return self._config.getint('server', 'Workers', fallback=2)
+
+    @property
+    def server_batch_size(self) -> int:
+        return self._config.getint('server', 'Batch_Size', fallback=4)
+
+    @property
+    def metrics(self) -> bool:
+        return self._config.getboolean('metrics', 'Enabled', fallback=False)
+
+    @property
+    def metrics_host(self) -> str:
+        return self._config.get('metrics', 'Host', fallback='127.0.0.1')
+
+    @property
+    def metrics_port(self) -> int | None:
+        to_return = self._config.get('metrics', 'Port', fallback='9464')
+        return int(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def metrics_file(self) -> Path | None:
+        to_return = self._config.get('metrics', 'File', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def metrics_interval(self) -> float:
+        return self._config.getfloat('metrics', 'Interval', fallback=15.0)
+
+    @property
+    def profiling(self) -> bool:
+        return self._config.getboolean('profiling', 'Enabled', fallback=False)
+
+    @property
+    def profile_every(self) -> int:
+        return self._config.getint('profiling', 'Every', fallback=100)
+
+    @property
+    def profile_memory(self) -> bool:
+        return self._config.getboolean('profiling', 'Memory', fallback=False)
+
+    @property
+    def profile_top(self) -> int:
+        return self._config.getint('profiling', 'Top', fallback=25)
+
     @property
     def image_format(self) -> str:
         return self._config.get('images','Image_Format',fallback='CZI')
@@ -55,6 +171,19 @@ class Config:
     def scaling(self) -> float:
         return self._config.getfloat('images', 'Scaling', fallback=4.88)
 
+    @property
+    def memory_map(self) -> bool:
+        return self._config.getboolean('images', 'Memory_Map', fallback=False)
+
+    @property
+    def decode_cache(self) -> Path | None:
+        to_return = self._config.get('images', 'Decode_Cache', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def decode_cache_mb(self) -> int:
+        return self._config.getint('images', 'Decode_Cache_MB', fallback=8192)
+
     @property
     def max_radius(self) -> int:
         return self._config.getint('images', 'Max_Radius', fallback = 2500)
@@ -83,6 +212,11 @@ class Config:
     def radius_method(self) -> str:
         return self._config.get('processing', 'Radius_Method', fallback='Contour')
 
+    @property
+    def fit_method(self) -> str:
+        #The pipeline's fit stage type; with Max_ROIs above 1 the default pipeline fits Regions whatever Radius_Method says
+        return next(stage.type for stage in self.pipeline_stages if STAGE_TYPES[stage.type].kind == 'fit')
+
     @property
     def required_stable(self) -> int:
         return self._config.getint('processing', 'Required_Stable', fallback=3)
@@ -95,6 +229,107 @@ class Config:
     def max_checks(self) -> int:
         return self._config.getint('processing', 'Max_Checks', fallback=10)
 
+    @property
+    def tracking(self) -> bool:
+        return self._config.getboolean('processing', 'Tracking', fallback=False)
+
+    @property
+    def tracking_margin(self) -> float:
+        return self._config.getfloat('processing', 'Tracking_Margin', fallback=1.5)
+
+    @property
+    def tracking_min_confidence(self) -> float:
+        return self._config.getfloat('processing', 'Tracking_Min_Confidence', fallback=0.8)
+
+    @property
+    def max_rois(self) -> int:
+        return self._config.getint('processing', 'Max_ROIs', fallback=1)
+
+    @property
+    def min_roi_area(self) -> int:
+        return self._config.getint('processing', 'Min_ROI_Area', fallback=1000)
+
+    @property
+    def roi_statistics(self) -> tuple[str, ...]:
+        to_return = self._config.get('processing', 'ROI_Statistics', fallback='None')
+        names = (name.strip().lower() for name in to_return.split(','))
+        return tuple(name for name in names if name and name != 'none')
+
+    @property
+    def background(self) -> str:
+        return self._config.get('processing', 'Background', fallback='None')
+
+    @property
+    def background_inner(self) -> float:
+        return self._config.getfloat('processing', 'Background_Inner', fallback=1.2)
+
+    @property
+    def background_outer(self) -> float:
+        return self._config.getfloat('processing', 'Background_Outer', fallback=1.6)
+
+    @property
+    def background_model(self) -> Path:
+        to_return = self._config.get('processing', 'Background_Model', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def precision(self) -> str:
+        return self._config.get('processing', 'Precision', fallback='Float64')
+
+    @property
+    def supervised(self) -> bool:
+        return self._config.getboolean('processing', 'Supervised', fallback=False)
+
+    @property
+    def supervised_workers(self) -> int:
+        return self._config.getint('processing', 'Supervised_Workers', fallback=2)
+
+    @property
+    def image_timeout(self) -> float:
+        return self._config.getfloat('processing', 'Image_Timeout', fallback=60.0)
+
+    @property
+    def worker_memory_mb(self) -> int:
+        return self._config.getint('processing', 'Worker_Memory_MB', fallback=4096)
+
+    @property
+    def tiled(self) -> bool:
+        return self._config.getboolean('processing', 'Tiled', fallback=False)
+
+    @property
+    def pipeline_file(self) -> Path:
+        to_return = self._config.get('pipeline', 'File', fallback='None')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
+    @property
+    def pipeline_stages(self) -> list[PipelineStage]:
+        #[pipeline] Stages lists stage names in run order; each [stage:<name>] section sets its Type and options
+        parser = self._config
+        if self.pipeline_file is not None:
+            parser = ConfigParser()
+            if not parser.read(self.pipeline_file):
+                raise ValueError(f'Pipeline file {self.pipeline_file} could not be read.')
+        names = parser.get('pipeline', 'Stages', fallback='Default')
+        if names.strip().lower() in ('', 'default', 'none'):
+            return default_stages(self)
+        stages = []
+        for name in (name.strip() for name in names.split(',') if name.strip()):
+            options = dict(parser.items(f'stage:{name}')) if parser.has_section(f'stage:{name}') else {}
+            stages.append(PipelineStage(name=name, type=options.pop('type', name).lower(), options=options))
+        return stages
+
+    @property
+    def tile_size(self) -> int:
+        return self._config.getint('processing', 'Tile_Size', fallback=2048)
+
+    @property
+    def result_cache(self) -> bool:
+        return self._config.getboolean('processing', 'Result_Cache', fallback=False)
+
+    @property
+    def result_cache_hash(self) -> bool:
+        return self._config.getboolean('processing', 'Result_Cache_Hash', fallback=False)
+
     @property
     def training_directory_raw(self) -> Path:
         to_return = self._config.get('bayesian', 'Training_Directory_Raw', fallback='./training/raw')
@@ -123,18 +358,29 @@ class Config:
     def testing_method(self) -> str:
         return self._config.get('bayesian', 'Testing_Method', fallback='Circle')
 
+    @property
+    def model_file(self) -> Path:
+        to_return = self._config.get('bayesian', 'Model_File', fallback='./training/model.npz')
+        return Path(to_return) if to_return.lower() != 'none' else None
+
     def _create_default(self):
         with open('options.ini', 'w') as config_file:
             self._config['files'] = {'Directory': 'None',
                                      'Queue_Type': 'File',
+                                     'Queue_Order': 'FIFO',
+                                     'Scan_Index': 'None',
                                      'Enqueue_Existing': 'False',
                                      'Write_Labels': 'True',
                                      'Write_ROI': 'False',
+                                     'Resume_Batch': 'False',
                                      'Output_Directory': './output'}
             self._config['images'] = {'Image_Format': 'CZI',
                                         'White_Point': '4095',
                                         'Scaling': '4.88',
-                                        'Max_Radius': '2500'}
+                                        'Max_Radius': '2500',
+                                        'Memory_Map': 'False',
+                                        'Decode_Cache': 'None',
+                                        'Decode_Cache_MB': '8192'}
             self._config['processing'] = {'Masking_Method': 'Thresholding',
                                         'Normalization': 'True',
                                         'Normalization_Percentile': '99.5',
@@ -143,13 +389,49 @@ class Config:
                                         'Radius_Method': 'Contour',
                                         'Required_Stable': '3',
                                         'Check_Delay': '0.2',
-                                        'Max_Checks': '10'}
+                                        'Max_Checks': '10',
+                                        'Tracking': 'False',
+                                        'Tracking_Margin': '1.5',
+                                        'Tracking_Min_Confidence': '0.8',
+                                        'Max_ROIs': '1',
+                                        'Min_ROI_Area': '1000',
+                                        'ROI_Statistics': 'None',
+                                        'Background': 'None',
+                                        'Background_Inner': '1.2',
+                                        'Background_Outer': '1.6',
+                                        'Background_Model': 'None',
+                                        'Precision': 'Float64',
+                                        'Supervised': 'False',
+                                        'Supervised_Workers': '2',
+                                        'Image_Timeout': '60',
+                                        'Worker_Memory_MB': '4096',
+                                        'Tiled': 'False',
+                                        'Tile_Size': '2048',
+                                        'Result_Cache': 'False',
+                                        'Result_Cache_Hash': 'False'}
             self._config['bayesian'] = {'Training_Directory_Raw': './training/raw',
                                         'Training_Directory_Truth': './training/truth',
                                         'Testing_Directory_Raw': './testing/raw',
                                         'Testing_Directory_Truth': './testing/truth',
                                         'Truth_Intensity': '255',
-                                        'Testing_Method': 'Circle'}
+                                        'Testing_Method': 'Circle',
+                                        'Model_File': './training/model.npz'}
+            self._config['pipeline'] = {'Stages': 'Default',
+                                        'File': 'None'}
+            self._config['metrics'] = {'Enabled': 'False',
+                                       'Host': '127.0.0.1',
+                                       'Port': '9464',
+                                       'File': 'None',
+                                       'Interval': '15'}
+            self._config['profiling'] = {'Enabled': 'False',
+                                         'Every': '100',
+                                         'Memory': 'False',
+                                         'Top': '25'}
+            self._config['server'] = {'Host': '127.0.0.1',
+                                      'Port': '8765',
+                                      'Socket': 'None',
+                                      'Workers': '2',
+                                      'Batch_Size': '4'}
             self._config.write(config_file)
 
     def save(self) -> None:
@@ -171,6 +453,8 @@ class Config:
             raise ValueError('Image Scaling must be a numeric value.')
         if not self._config.get('images', 'Max_Radius').isdigit():
             raise ValueError('Maximum ROI Radius must be an integer value.')
+        if not self._config.get('images', 'Decode_Cache_MB', fallback='8192').isdigit() or self.decode_cache_mb < 1:
+            raise ValueError('Decode Cache size must be a positive integer value.')
         if not self._config.get('processing', 'Normalization_Percentile').replace('.','',1).isdigit():
             raise ValueError('Normalization Percentile must be a numeric value.')
         if not self._config.get('processing','Threshold_Level').isdigit():
@@ -181,39 +465,243 @@ class Config:
             raise ValueError('Delay Between Stability Checks must be a numeric value.')
         if not self._config.get('processing', 'Max_Checks').isdigit():
             raise ValueError('Maximum Stability Checks must be an integer value.')
+        if not self._config.get('processing', 'Tile_Size', fallback='2048').isdigit():
+            raise ValueError('Tile Size must be an integer value.')
+        if not self._config.get('processing', 'Tracking_Margin', fallback='1.5').replace('.','',1).isdigit():
+            raise ValueError('Tracking Margin must be a numeric value.')
+        if not self._config.get('processing', 'Tracking_Min_Confidence', fallback='0.8').replace('.','',1).isdigit():
+            raise ValueError('Tracking Minimum Confidence must be a numeric value.')
+        if not self._config.get('processing', 'Max_ROIs', fallback='1').isdigit() or \
+                self._config.getint('processing', 'Max_ROIs', fallback=1) < 1:
+            raise ValueError('Maximum ROIs must be a positive integer value.')
+        if not self._config.get('processing', 'Min_ROI_Area', fallback='1000').isdigit():
+            raise ValueError('Minimum ROI Area must be an integer value.')
+        unknown = [name for name in self.roi_statistics if not pf.is_roi_statistic(name)]
+        if unknown:
+            raise ValueError(f'Unknown ROI statistics: {", ".join(unknown)}.')
+        if not self._config.get('processing', 'Supervised_Workers', fallback='2').isdigit() or self.supervised_workers < 1:
+            raise ValueError('Supervised Workers must be a positive integer value.')
+        if not self._config.get('processing', 'Image_Timeout', fallback='60').replace('.','',1).isdigit():
+            raise ValueError('Image Timeout must be a numeric value.')
+        if not self._config.get('processing', 'Worker_Memory_MB', fallback='4096').isdigit():
+            raise ValueError('Worker Memory must be an integer value (0 for no limit).')
+        if self.supervised and self.queue_type == 'Image':
+            raise ValueError('Supervised processing requires the File queue type.')
+        if self.supervised and self.tracking and self.supervised_workers > 1:
+            raise ValueError('Tracking needs a single supervised worker so frames stay in order.')
+        if self.precision.lower() not in pf.PRECISIONS:
+            raise ValueError('Precision must be Float64, Float32 or Native.')
+        validate_stages(self.pipeline_stages)
+        background = self.background.lower()
+        if background not in ('none', 'annulus', 'flat-field'):
+            raise ValueError('Background must be None, Annulus or Flat-Field.')
+        if background != 'none' and self.tiled:
+            raise ValueError('Background correction is not available for tiled processing.')
+        if not self._config.get('processing', 'Background_Inner', fallback='1.2').replace('.','',1).isdigit() or \
+                not self._config.get('processing', 'Background_Outer', fallback='1.6').replace('.','',1).isdigit():
+            raise ValueError('Background annulus radii must be numeric values.')
+        if background == 'annulus' and not 1 <= self.background_inner < self.background_outer:
+            raise ValueError('Background annulus must satisfy 1 <= inner < outer.')
+        if background == 'flat-field' and (self.background_model is None or not self.background_model.exists()):
+            raise ValueError('Flat-Field background requires an existing Background Model file.')
+        if self.queue_order.lower() not in (order.lower() for order in PriorityQueue.ORDERS):
+            raise ValueError(f'Queue Order must be one of {", ".join(PriorityQueue.ORDERS)}.')
+        if self.queue_order.lower() != 'fifo' and self.queue_type == 'Image':
+            raise ValueError('Queue Order requires the File queue type.')
+        names = set()
+        for section in self._config.sections():
+            if not section.lower().startswith('source:'):
+                continue
+            name = section.split(':', 1)[1].strip()
+            if not name or '/' in name or name == 'default' or name in names:
+                raise ValueError(f'Source section [{section}] needs a unique name without "/".')
+            names.add(name)
+            if self._config.get(section, 'Image_Format', fallback='CZI') not in ('CZI', 'TIFF'):
+                raise ValueError(f'Image Format of [{section}] must be CZI or TIFF.')
+            if not self._config.get(section, 'White_Point', fallback='0').isdigit():
+                raise ValueError(f'White Point of [{section}] must be an integer value.')
+            if not self._config.get(section, 'Scaling', fallback='0').replace('.','',1).isdigit():
+                raise ValueError(f'Scaling of [{section}] must be a numeric value.')
+        for option, fallback in (('Port', '8765'), ('Workers', '2'), ('Batch_Size', '4')):
+            if not self._config.get('server', option, fallback=fallback).isdigit() or \
+                    int(self._config.get('server', option, fallback=fallback)) < 1:
+                raise ValueError(f'Server {option.replace("_", " ")} must be a positive integer value.')
+        metrics_port = self._config.get('metrics', 'Port', fallback='9464')
+        if metrics_port.lower() != 'none' and (not metrics_port.isdigit() or not 0 < int(metrics_port) < 65536):
+            raise ValueError('Metrics Port must be a port number or None.')
+        if not self._config.get('metrics', 'Interval', fallback='15').replace('.','',1).isdigit() or self.metrics_interval <= 0:
+            raise ValueError('Metrics Interval must be a positive numeric value.')
+        if self.metrics and self.metrics_port is None and self.metrics_file is None:
+            raise ValueError('Metrics need a Port or a File to export to.')
+        for option, fallback in (('Every', '100'), ('Top', '25')):
+            if not self._config.get('profiling', option, fallback=fallback).isdigit() or \
+                    int(self._config.get('profiling', option, fallback=fallback)) < 1:
+                raise ValueError(f'Profiling {option} must be a positive integer value.')
         if not self._config.get('bayesian', 'Truth_Intensity').isdigit():
             raise ValueError('Truth Intensity must be an integer value.')
 
-    def create_image(self, img_path: Path, reader: Callable) -> BaseImage:
-        if self.image_format == 'CZI':
-            return CziImage(img_path, reader=reader)
-        return TiffImage(img_path, scaling=self.scaling, white_point=self.white_point, reader=reader)
-
-    def create_queue(self, reader: Callable=None) -> BaseQueue:
-        if reader is None:
-            reader = self.stable_reader()
-        factory = partial(self.create_image, reader=reader)
-        queue_type = EagerQueue if self.queue_type == 'Image' else LazyQueue
-        return queue_type(self.directory, image_factory=factory, file_format=self.image_format, enqueue_existing=self.enqueue_existing)
-
-    def create_processor(self) -> Processor:
-        normalizer = None if self.normalization == False else partial(pf.normalize, percentile=self.normalization_percentile)
-        masker = partial(pf.threshold_image, threshold=self.threshold_level) if self.masking_method.lower() == 'thresholding' else pf.kmeans
-        fitter = partial(pf.circle_params_contour, max_radius=self.max_radius) if self.radius_method.lower() == 'contour' \
-            else partial(pf.circle_params_eigenvalue, max_radius=self.max_radius)
-        return Processor(normalizer=normalizer, masker=masker, fitter=fitter)
-
-    def stable_reader(self) -> Callable:
-        reader = cziread if self.image_format == 'CZI' else tiffread
-        return partial(stable_read, reader=reader, max_attempts=self.max_checks, delay_s=self.check_delay, required_stable=self.required_stable)
+    def create_image(self, img_path: Path, reader: Callable, source: Source=None, plane_cache: PlaneCache=None) -> BaseImage:
+        image_format = source.image_format if source is not None else self.image_format
+        scaling = source.scaling if source is not None else self.scaling
+        white_point = source.white_point if source is not None else self.white_point
+        if self.tiled:
+            if image_format == 'CZI':
+                return MosaicImage(img_path, reader=reader)
+            return MosaicImage(img_path, scaling=scaling, white_point=white_point, reader=reader)
+        metadata = None
+        if plane_cache is not None:
+            #Only the plane and a CZI's own metadata are cached; scaling and white point settings always come from here
+            cached = plane_cache.get(img_path)
+            if cached is None:
+                image = self.create_image(img_path, reader, source)
+                if image.array is not None:
+                    plane_cache.put(img_path, image.array, (image.scaling, image.white_point) if image_format == 'CZI' else None)
+                return image
+            plane, metadata = cached
+            reader = lambda _: plane
+        if image_format == 'CZI':
+            return CziImage(img_path, reader=reader, metadata=metadata)
+        return TiffImage(img_path, scaling=scaling, white_point=white_point, reader=reader)
+
+    def create_queue(self, reader: Callable=None, *, queue_type: str=None, enqueue_existing: bool=None,
+                     metrics: SessionMetrics=None, plane_cache: PlaneCache=None) -> MultiSourceQueue:
+        queue_type = queue_type or self.queue_type
+        if queue_type == 'Image':
+            queue_type = EagerQueue
+        elif self.queue_order.lower() != 'fifo':
+            queue_type = partial(PriorityQueue, order=self.queue_order)
+        else:
+            queue_type = LazyQueue
+        enqueue_existing = self.enqueue_existing if enqueue_existing is None else enqueue_existing
+        queues = {}
+        for source in self.sources:
+            source_reader = reader if reader is not None else self.stable_reader(source.image_format, metrics=metrics)
+            factory = partial(self.create_image, reader=source_reader, source=source, plane_cache=plane_cache)
+            index_path = self.scan_index / f'{source.name}.npz' if self.scan_index is not None else None
+            queues[source.name] = queue_type(source.directory, image_factory=factory, file_format=source.image_format,
+                                             enqueue_existing=enqueue_existing, index_path=index_path)
+        return MultiSourceQueue(queues)
+
+    def create_processor(self, metrics: SessionMetrics=None, tracking: bool=None) -> Processor:
+        #tracking=False overrides the setting where consecutive images are not one time series
+        tracking = self.tracking if tracking is None else tracking
+        observe = (lambda name, seconds: metrics.observe('stage_seconds', seconds, stage=name)) if metrics is not None else None
+        plan = compile_plan(self.pipeline_stages, self, observe=observe)
+        background = self.background.lower()
+        if background == 'annulus':
+            corrector = partial(annulus_correction, inner=self.background_inner, outer=self.background_outer)
+        elif background == 'flat-field':
+            corrector = partial(flat_field_correction, model=load_background(self.background_model))
+        else:
+            corrector = None
+        if self.tiled:
+            #Tiles run their own halo-aware morphology and moment fit, so only the normalize and mask stages apply
+            return TiledProcessor(normalizer=plan.normalizer, masker=plan.masker, max_radius=self.max_radius, tile_size=self.tile_size,
+                                  max_rois=self.max_rois, min_roi_area=self.min_roi_area if self.max_rois > 1 else 0,
+                                  statistics=self.roi_statistics)
+        return Processor(normalizer=plan.normalizer, masker=plan.masker, fitter=plan.fitter, shared_histogram=plan.histogram,
+                         tracking=tracking and self.max_rois == 1, tracking_margin=self.tracking_margin,
+                         min_confidence=self.tracking_min_confidence, statistics=self.roi_statistics,
+                         background=corrector, morphology=plan.morphology,
+                         normalized_dtype=plan.dtype if plan.dtype is not None else pf.PRECISIONS['float64'])
+
+    def processor_fingerprint(self) -> str:
+        settings = {'image_format': self.image_format,
+                    'white_point': self.white_point,
+                    'scaling': self.scaling,
+                    'max_radius': self.max_radius,
+                    'masking_method': self.masking_method,
+                    'normalization': self.normalization,
+                    'normalization_percentile': self.normalization_percentile,
+                    'threshold_level': self.threshold_level,
+                    'center_method': self.center_method,
+                    'radius_method': self.radius_method,
+                    'tracking': self.tracking,
+                    'tracking_margin': self.tracking_margin,
+                    'tracking_min_confidence': self.tracking_min_confidence,
+                    'tiled': self.tiled,
+                    'max_rois': self.max_rois,
+                    'min_roi_area': self.min_roi_area,
+                    'roi_statistics': self.roi_statistics,
+                    'background': self.background}
+        if self.precision.lower() != 'float64':
+            settings['precision'] = self.precision.lower()
+        if self.tiled:
+            settings['tiles'] = (self.tile_size, HALO)
+        stages = self.pipeline_stages
+        if stages != default_stages(self):
+            settings['pipeline'] = [(stage.name, stage.type, sorted(stage.options.items())) for stage in stages]
+        if self.background.lower() == 'annulus':
+            settings['background_annulus'] = (self.background_inner, self.background_outer)
+        if self.background.lower() == 'flat-field' and self.background_model is not None and self.background_model.exists():
+            settings['background_model'] = (str(self.background_model), self.background_model.stat().st_mtime_ns)
+        sources = self.sources[1:]
+        if sources:
+            settings['sources'] = [(source.name, source.image_format, source.scaling, source.white_point) for source in sources]
+        #Each Bayesian stage's model, including a [stage:*] Model_File override
+        models = [Path(stage.options['model_file']) if 'model_file' in stage.options else self.model_file
+                  for stage in stages if stage.type == 'bayesian']
+        models = [(str(model), model.stat().st_mtime_ns) for model in models if model is not None and model.exists()]
+        if models:
+            settings['models'] = models
+        return sha1(repr(sorted(settings.items())).encode()).hexdigest()
+
+    def override(self, section: str, **options) -> None:
+        #Settings for this run only, e.g. from the command line; they are written out if the config is saved
+        self._config.read_dict({section: {option: str(value) for option, value in options.items()}})
+
+    def create_metrics(self) -> SessionMetrics | None:
+        return SessionMetrics() if self.metrics else None
+
+    def create_metrics_exporter(self, metrics: SessionMetrics) -> MetricsExporter:
+        return MetricsExporter(metrics, host=self.metrics_host, port=self.metrics_port, path=self.metrics_file,
+                               interval_s=self.metrics_interval)
+
+    def create_profiler(self, name: str) -> SessionProfiler | None:
+        if not self.profiling:
+            return None
+        return SessionProfiler(self.output_directory, name, every=self.profile_every, memory=self.profile_memory,
+                               top=self.profile_top)
+
+    def create_result_cache(self) -> ResultCache | None:
+        #A tracked result depends on the previous frame, so a per-file cache hit would break the chain
+        if not self.result_cache or self.tracking:
+            return None
+        return ResultCache(self.output_directory / 'result_cache.sqlite', fingerprint=self.processor_fingerprint(),
+                           fast_hash=self.result_cache_hash)
+
+    def create_plane_cache(self) -> PlaneCache | None:
+        #Decoded planes depend only on the files, so one cache serves every session and setting
+        if self.decode_cache is None:
+            return None
+        return PlaneCache(self.decode_cache, max_bytes=self.decode_cache_mb * 2 ** 20)
+
+    def stable_reader(self, image_format: str=None, metrics: SessionMetrics=None) -> Callable:
+        image_format = image_format or self.image_format
+        if self.tiled:
+            reader = open_czi_tiles if image_format == 'CZI' else open_tiff_tiles
+        elif image_format == 'CZI':
+            reader = cziread
+        else:
+            reader = memmap_read if self.memory_map else tiffread
+        on_read = partial(_record_read, metrics) if metrics is not None else None
+        return partial(stable_read, reader=reader, max_attempts=self.max_checks, delay_s=self.check_delay,
+                       required_stable=self.required_stable, on_read=on_read)
 
     def create_trainer(self) -> Trainer:
         preprocessing = partial(pf.normalize, percentile=self.normalization_percentile) if self.normalization else None
-        return Trainer(raw_dir=self.training_directory_raw, truth_dir=self.training_directory_truth,
-                       truth_intensity=self.truth_intensity, preprocessing=preprocessing)
+        return Trainer(truth_intensity=self.truth_intensity, preprocessing=preprocessing)
 
-    def create_tester(self) -> Tester:
-        temp_processor = self.create_processor()
+    def create_tester(self, plane_cache: PlaneCache=None) -> Tester:
+        temp_processor = self.create_processor(tracking=False)
         pipeline = temp_processor.circular_roi if self.testing_method.lower() == 'circle' else temp_processor.binary_mask
+        if plane_cache is not None and not self.tiled:
+            #The queue has usually just decoded the same file, so this is a cache hit
+            source = Source(name='testing', directory=self.testing_directory_raw, image_format='CZI',
+                            scaling=self.scaling, white_point=self.white_point)
+            factory = partial(self.create_image, reader=self.stable_reader('CZI'), source=source, plane_cache=plane_cache)
+            raw_reader = lambda img_path: factory(img_path).array
+        else:
+            raw_reader = cziread
         return Tester(raw_dir=self.testing_directory_raw, truth_dir=self.testing_directory_truth,
-                      truth_intensity=self.truth_intensity, pipeline=pipeline)
\ No newline at end of file
+                      truth_intensity=self.truth_intensity, raw_reader=raw_reader, pipeline=pipeline)
\ No newline at end of file
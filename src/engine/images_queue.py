@@ -1,5 +1,10 @@
+import heapq
+import os
+import time
+import numpy as np
 from typing import Callable
 from collections import deque
+from itertools import count
 from abc import ABC, abstractmethod
 from src.images.image import BaseImage
 from pathlib import Path
@@ -14,20 +19,91 @@ class Node:
 
 '''
 
+class ScanIndex:
+    #Directory entries already handled, keyed by name (and inode on POSIX, where scandir reports it for free).
+    #A saved index replaces the startup listing, so files that arrived while the app was closed are picked up.
+    #There is no portable way to list only entries newer than a cursor (an mtime costs a stat per entry on POSIX),
+    #so instead of an mtime cursor the folder is only relisted when its own mtime changes, each listing does one set
+    #lookup per entry, and the known set is pruned to the entries still present so it never outgrows the folder
+    SETTLE_S = 2.0
+    RELIST_S = 30.0
+
+    def __init__(self, directory: Path, file_format: str, path: Path = None):
+        self._directory = directory
+        self._suffix = f'.{file_format}'.lower()
+        self._path = path
+        self._known = set()
+        self._pending = {}
+        self._directory_mtime = None
+        self._changed_at = 0.0
+        self._listed_at = 0.0
+
+    def skip_existing(self) -> None:
+        if self._path is not None and self._path.exists():
+            with np.load(self._path) as index:
+                if str(index['directory']) == str(self._directory):
+                    self._known.update(index['keys'].tolist())
+                    return
+        #One listing of names only, so nothing present at startup is enqueued however recently it was written
+        with os.scandir(self._directory) as entries:
+            self._known.update(self._key(entry) for entry in entries)
+
+    def scan(self) -> list[tuple[str, Path]]:
+        #Directory mtime only changes when entries are added or removed; keep listing briefly after a change
+        #to cover coarse mtime resolution, then skip the listing until it changes again. Network shares do not
+        #always update it, so the folder is still relisted every RELIST_S
+        now = time.monotonic()
+        directory_mtime = os.stat(self._directory).st_mtime_ns
+        if directory_mtime != self._directory_mtime:
+            self._directory_mtime = directory_mtime
+            self._changed_at = now
+        elif now - self._changed_at > self.SETTLE_S and now - self._listed_at < self.RELIST_S:
+            return list(self._pending.items())
+        self._listed_at = now
+        present = set()
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                key = self._key(entry)
+                present.add(key)
+                if key in self._known or key in self._pending:
+                    continue
+                name = entry.name.lower()
+                if not name.endswith(self._suffix) or 'live' in name or 'preview' in name or not entry.is_file():
+                    self._known.add(key)
+                    continue
+                self._pending[key] = Path(entry.path)
+        #Forget deleted and moved files; one that reappears under the same key is a new arrival
+        self._known &= present
+        self._pending = {key: path for key, path in self._pending.items() if key in present}
+        return list(self._pending.items())
+
+    def accept(self, key: str) -> None:
+        self._pending.pop(key, None)
+        self._known.add(key)
+
+    def save(self) -> None:
+        if self._path is None:
+            return
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez(self._path, directory=str(self._directory), keys=np.array(sorted(self._known), dtype=str))
+
+    @staticmethod
+    def _key(entry: os.DirEntry) -> str:
+        #DirEntry.inode() costs a stat per entry on Windows, so there the name alone is the key
+        return entry.name if os.name == 'nt' else f'{entry.name}/{entry.inode()}'
+
 class BaseQueue(ABC):
-    def __init__(self, directory: Path, image_factory: Callable, file_format:str = 'CZI', enqueue_existing: bool = False):
+    def __init__(self, directory: Path, image_factory: Callable, file_format:str = 'CZI', enqueue_existing: bool = False,
+                 index_path: Path = None):
         self._directory = directory
         self._deque = deque()
         self._factory = image_factory
         self._format = file_format
-        self._seen = set()
-        for val in self._directory.iterdir():
-            if val.is_file() and val.suffix.lower() == f'.{self._format}'.lower() and 'live' not in val.name.lower()\
-                    and 'preview' not in val.name.lower():
-                if enqueue_existing:
-                    self.enqueue(val)
-                else:
-                    self._seen.add(val)
+        self._index = ScanIndex(directory, file_format, index_path if not enqueue_existing else None)
+        if enqueue_existing:
+            self.update()
+        else:
+            self._index.skip_existing()
 
     def is_empty(self) -> bool:
         return not self._deque
@@ -37,16 +113,18 @@ class BaseQueue(ABC):
             self._deque.popleft()
 
     def update(self) -> None:
-        for val in self._directory.iterdir():
-            if val.is_file() and val.suffix.lower() == f'.{self._format}'.lower() and 'live' not in val.name.lower()\
-                    and 'preview' not in val.name.lower():
-                self.enqueue(val)
+        for key, val in self._index.scan():
+            if self.enqueue(val):
+                self._index.accept(key)
+
+    def close(self) -> None:
+        self._index.save()
 
     def __len__(self):
         return len(self._deque)
 
     @abstractmethod
-    def enqueue(self, val: str) -> None:
+    def enqueue(self, val: Path) -> bool:
         pass
 
     @abstractmethod
@@ -54,11 +132,9 @@ class BaseQueue(ABC):
         pass
 
 class LazyQueue(BaseQueue):
-    def enqueue(self, val: str) -> None:
-        if val in self._seen:
-            return
+    def enqueue(self, val: Path) -> bool:
         self._deque.append(val)
-        self._seen.add(val)
+        return True
 
     def front(self) -> BaseImage | None:
         while not self.is_empty():
@@ -70,17 +146,134 @@ class LazyQueue(BaseQueue):
             self.dequeue()
         return None
 
+    def front_path(self) -> Path | None:
+        return self._directory / self._deque[0] if not self.is_empty() else None
+
+    def discard(self, names: set[str]) -> None:
+        self._deque = deque(val for val in self._deque if Path(val).name not in names)
+
+class PriorityQueue(BaseQueue):
+    #Lazy queue ordered by a heap: FIFO (discovery order), Newest (latest mtime first) or Mtime (oldest mtime first)
+    ORDERS = ('FIFO', 'Newest', 'Mtime')
+
+    def __init__(self, directory: Path, image_factory: Callable, file_format: str = 'CZI', enqueue_existing: bool = False,
+                 index_path: Path = None, order: str = 'Mtime'):
+        self._order = order.lower()
+        self._heap = []
+        self._counter = count()
+        super().__init__(directory, image_factory, file_format, enqueue_existing, index_path)
+
+    def is_empty(self) -> bool:
+        return not self._heap
+
+    def dequeue(self) -> None:
+        if not self.is_empty():
+            heapq.heappop(self._heap)
+
+    def __len__(self):
+        return len(self._heap)
+
+    def enqueue(self, val: Path) -> bool:
+        heapq.heappush(self._heap, (self._key(val), next(self._counter), val))
+        return True
+
+    def front(self) -> BaseImage | None:
+        while not self.is_empty():
+            imgpath = self._directory / self._heap[0][2]
+            if imgpath.exists():
+                image = self._factory(imgpath)
+                if image.array is not None:
+                    return image
+            self.dequeue()
+        return None
+
+    def front_path(self) -> Path | None:
+        return self._directory / self._heap[0][2] if not self.is_empty() else None
+
+    def discard(self, names: set[str]) -> None:
+        self._heap = [entry for entry in self._heap if Path(entry[2]).name not in names]
+        heapq.heapify(self._heap)
+
+    def _key(self, val: str) -> int:
+        if self._order == 'fifo':
+            return 0
+        try:
+            mtime = (self._directory / val).stat().st_mtime_ns
+        except OSError:
+            mtime = 0
+        return -mtime if self._order == 'newest' else mtime
+
 class EagerQueue(BaseQueue):
-    def enqueue(self, val: str) -> None:
-        if val in self._seen:
-            return
+    def enqueue(self, val: Path) -> bool:
+        #Unreadable files stay pending in the scan index and are retried; vanished files are dropped
         imgpath = self._directory / val
-        if imgpath.exists():
-            image = self._factory(imgpath)
-            if image.array is not None:
-                self._deque.append(image)
-                self._seen.add(val)
+        if not imgpath.exists():
+            return True
+        image = self._factory(imgpath)
+        if image.array is None:
+            return False
+        self._deque.append(image)
+        return True
 
     def front(self) -> BaseImage | None:
         return self._deque[0] if not self.is_empty() else None
 
+
+class MultiSourceQueue:
+    #Round-robin over one queue per source so a busy directory cannot starve the others
+    def __init__(self, queues: dict[str, BaseQueue]):
+        self._queues = queues
+        self._names = list(queues)
+        self._cursor = 0
+
+    @property
+    def source(self) -> str:
+        return self._names[self._cursor]
+
+    def is_empty(self) -> bool:
+        return all(queue.is_empty() for queue in self._queues.values())
+
+    def update(self) -> None:
+        for queue in self._queues.values():
+            queue.update()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    def front(self) -> BaseImage | None:
+        for _ in range(len(self._names)):
+            image = self._queues[self.source].front()
+            if image is not None:
+                return image
+            self._advance()
+        return None
+
+    def front_path(self) -> Path | None:
+        for _ in range(len(self._names)):
+            queue = self._queues[self.source]
+            if not queue.is_empty():
+                return queue.front_path()
+            self._advance()
+        return None
+
+    def dequeue(self) -> None:
+        self._queues[self.source].dequeue()
+        self._advance()
+
+    def close(self) -> None:
+        for queue in self._queues.values():
+            queue.close()
+
+    def key(self, source: str, path: Path) -> str:
+        #Entries of the first source keep their bare file names, so single-source manifests stay valid
+        return path.name if source == self._names[0] else f'{source}/{path.name}'
+
+    def discard(self, keys: set[str]) -> None:
+        for name, queue in self._queues.items():
+            if name == self._names[0]:
+                queue.discard({key for key in keys if '/' not in key})
+            else:
+                queue.discard({key.split('/', 1)[1] for key in keys if key.startswith(f'{name}/')})
+
+    def _advance(self) -> None:
+        self._cursor = (self._cursor + 1) % len(self._names)
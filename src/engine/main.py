@@ -1,16 +1,25 @@
+import argparse
+import multiprocessing
+import os
 import sys
-from time import time
+from time import time, perf_counter
 from typing import Iterable
 from functools import partial
 from PyQt5.QtWidgets import QApplication, QMainWindow, QMessageBox, QFileDialog, QLineEdit
-from PyQt5.QtCore import pyqtSignal, QObject, QThread, QEventLoop, pyqtSlot
-from PyQt5.QtGui import QTextCursor
+from PyQt5.QtCore import pyqtSignal, QObject, QThread, Qt, pyqtSlot
 from src.gui.main_menu import Ui_MainWindow
 from src.gui.config_ui import Ui_ConfigWindow
 from src.gui.processing_ui import Ui_ProcessingWindow
+from src.gui.log_view import BufferedLog, StatsLabel
 from src.engine.config import Config
-from src.images.output_writer import CSVWriter, TiffWriter
+from src.images.output_writer import CSVWriter, TiffWriter, SessionManifest, DeadLetterLog
 from src.engine.images_queue import LazyQueue
+from src.engine.session_stats import SessionStats
+from src.engine.metrics import SessionMetrics
+from src.engine.supervisor import SupervisedPool
+from src.images.image import BaseImage, TiffImage
+from src.processing.processing_result import FluorescenceResult, RoiResult
+from src.processing.processor import Processor
 
 
 
@@ -18,7 +27,6 @@ class ProcessingWorker(QObject):
     output = pyqtSignal(str)
     error = pyqtSignal(str)
     finished = pyqtSignal()
-    get_label = pyqtSignal()
 
     def __init__(self, config: Config, *, live: bool=True):
         super().__init__()
@@ -26,90 +34,260 @@ class ProcessingWorker(QObject):
         self._live = live
         self._stopped = False
         self._img_writer = None
-        if self._config.write_labels:
-            self._previous_label = None
-            self._wait_loop = None
-        self._header = ['filename', 'fluorescence', 'label'] if self._config.write_labels else ['filename', 'fluorescence']
+        self._label = ''
+        self._metrics = self._config.create_metrics() if live else None
+        self.stats = SessionStats(metrics=self._metrics)
+        self._profiler = None
+        self._correcting = self._config.background.lower() != 'none'
+        sources = self._config.sources
+        self._multi_source = len(sources) > 1
+        self._default_source = sources[0].name
+        #Every source directory is part of a session's identity; a single source keeps the plain directory
+        self._session_source = str(sources[0].directory) + ''.join(f';{source.name}={source.directory}' for source in sources[1:])
+        self._header = (['source'] if self._multi_source else []) + ['filename'] + (['roi'] if self._config.max_rois > 1 else []) + ['fluorescence'] + \
+                       (['background'] if self._correcting else []) + list(self._config.roi_statistics) + \
+                       (['confidence'] if self._config.tracking else []) + \
+                       (['label'] if self._config.write_labels else [])
         if self._config.write_roi:
             self._img_writer = TiffWriter(self._config.output_directory)
 
     def run(self) -> None:
-        if self._live:
-            self._live_process()
-        else:
-            self._batch_process()
+        self._profiler = self._config.create_profiler('live' if self._live else 'batch')
+        if self._profiler is not None:
+            self._profiler.start()
+            self.output.emit(f'Profiling to {self._profiler.prefix}_*')
+        exporter = None
+        if self._config.max_rois > 1 and not self._config.tiled and self._config.fit_method != self._config.radius_method.lower():
+            self.output.emit(f'Max ROIs is {self._config.max_rois}: ROIs are fitted with the {self._config.fit_method} method, '
+                             f'not Radius Method {self._config.radius_method}')
+        if self._config.tiled and (self._config.fit_method != 'eigenvalue' or self._config.center_method.lower() != 'mean'):
+            self.output.emit(f'Tiled processing fits eyes from their moments (Eigenvalue radius, mean center), '
+                             f'not Radius Method {self._config.radius_method} with Center Method {self._config.center_method}')
+        try:
+            if self._metrics is not None:
+                #A busy port or unwritable metrics file costs the metrics, not the session
+                try:
+                    exporter = self._config.create_metrics_exporter(self._metrics)
+                except OSError as e:
+                    self.error.emit(f'Metrics are off: {str(e)}')
+            if exporter is not None and exporter.address is not None:
+                self.output.emit(f'Metrics at http://{exporter.address[0]}:{exporter.address[1]}/metrics')
+            if self._live:
+                self._live_process()
+            else:
+                self._batch_process()
+        finally:
+            if exporter is not None:
+                exporter.close()
+            if self._profiler is not None:
+                self._profiler.stop()
 
 
     def stop(self) -> None:
         self._stopped = True
 
     def _batch_process(self) -> None:
-        factory = partial(self._config.create_image, reader=self._config.stable_reader())
-        queue = LazyQueue(self._config.directory, image_factory=factory, file_format=self._config.image_format, enqueue_existing=True)
-        processor = self._config.create_processor()
+        plane_cache = self._config.create_plane_cache()
+        queue = self._config.create_queue(queue_type='File', enqueue_existing=True, plane_cache=plane_cache)
+        processors = self._create_processors()
+        session_name = None
+        if self._config.resume_batch:
+            previous = SessionManifest.latest(self._config.output_directory, self._session_source)
+            if previous is not None and CSVWriter.read_header(previous.with_suffix('.csv')) != self._header:
+                self.output.emit(f'Not resuming {previous.stem}: its columns differ from the current settings')
+                previous = None
+            session_name = previous.stem if previous is not None else None
+        writer = CSVWriter(self._config.output_directory, header=self._header, name=session_name, append=session_name is not None)
+        manifest = SessionManifest(self._config.output_directory / f'{writer.name}.manifest', self._session_source)
+        if manifest.completed:
+            #Rows are written before their manifest entry, so an interrupted image may have rows but no entry
+            completed = {os.path.splitext(key)[0] for key in manifest.completed}
+            dropped = writer.retain(lambda row: self._output_name(row.get('source', self._default_source), row['filename']) in completed)
+            if dropped > 0:
+                self.output.emit(f'Removed {dropped} rows of an interrupted image')
+            queue.discard(manifest.completed)
+            self.output.emit(f'Resuming {writer.name}: skipping {len(manifest.completed)} completed images')
         to_process = len(queue)
         if to_process <= 0:
             self.output.emit('No processable images detected')
             self.output.emit('Exiting...')
+            if plane_cache is not None:
+                plane_cache.close()
             return
-        with CSVWriter(self._config.output_directory, header = self._header) as writer:
+        cache = self._config.create_result_cache()
+        if self._config.result_cache and cache is None:
+            self.output.emit('Result cache is off while Tracking is on')
+        with writer, manifest:
             begin_time = time()
             count = 1
             while not queue.is_empty() and not self._stopped:
-                current_image = queue.front()
-                if current_image is not None:
-                    try:
-                        label = self._receive_combo_value() or ""
+                self.stats.set_queue_depth(len(queue))
+                img_path = queue.front_path()
+                source = queue.source
+                try:
+                    label = self._label
+                    results = cache.get(img_path) if cache is not None else None
+                    if results is not None and (self._img_writer is None or self._img_writer.exists(self._output_name(source, img_path.stem))):
                         queue.dequeue()
-                        results = processor.process(current_image)
-                        writer.write_row([str(current_image), f'{results.mean_fluorescence:.3f}'])
-                        self.output.emit(f'{count}/{to_process} - {current_image}: {results.mean_fluorescence:.3f}')
-                        if self._img_writer is not None:
-                            center_y, center_x = results.center
-                            self._img_writer.write_roi(results.writeable_img, current_image.name, current_image.white_point, center_y, center_x, results.radius)
-                    except Exception as e:
-                        self.error.emit(f'Error processing {current_image}: {str(e)}')
-                    finally:
-                        count += 1
+                        name = img_path.stem
+                    else:
+                        waiting = len(queue)
+                        current_image = queue.front()
+                        #front() drops files that vanished or cannot be read on its way to the next readable one
+                        skipped = waiting - len(queue)
+                        for _ in range(skipped):
+                            self.stats.record_error()
+                            if self._profiler is not None:
+                                self._profiler.tick(len(queue))
+                        if skipped > 0:
+                            self.error.emit(f'Error processing {img_path.stem}: Image could not be read.' +
+                                            (f' ({skipped - 1} more unreadable images skipped)' if skipped > 1 else ''))
+                            count += skipped
+                        if current_image is None:
+                            continue
+                        img_path, source = queue.front_path(), queue.source
+                        queue.dequeue()
+                        name = current_image.name
+                        results = processors[source].process(current_image)
+                        if cache is not None:
+                            cache.put(img_path, results)
+                        self._write_image(name, source, current_image.white_point, results)
+                    self._write_row(writer, name, results, label, source)
+                    manifest.add(queue.key(source, img_path))
+                    self.stats.record_result(results.mean_fluorescence)
+                    self.output.emit(f'{count}/{to_process} - {name}: {self._format_means(results)}')
+                except Exception as e:
+                    if not queue.is_empty() and queue.front_path() == img_path:
+                        queue.dequeue()
+                    self.stats.record_error()
+                    self.error.emit(f'Error processing {img_path.stem}: {str(e)}')
+                count += 1
+                if self._profiler is not None:
+                    self._profiler.tick(len(queue))
         completion_time = time()
+        if cache is not None:
+            self.output.emit(cache.report())
+            cache.close()
+        if plane_cache is not None:
+            self.output.emit(plane_cache.report())
+            plane_cache.close()
         if to_process > 0:
             self.output.emit(f'Total time: {completion_time - begin_time:.4f} sec')
             self.output.emit(f'Average time per image: {(completion_time - begin_time) / to_process:.4f} sec')
 
     def _live_process(self) -> None:
-        queue = self._config.create_queue()
-        processor = self._config.create_processor()
+        if self._config.supervised:
+            self._supervised_live_process()
+            return
+        queue = self._config.create_queue(metrics=self._metrics)
+        processors = self._create_processors(self._metrics)
         with CSVWriter(self._config.output_directory, header = self._header) as writer:
             while not self._stopped:
                 queue.update()
                 current_image = queue.front()
+                self.stats.set_queue_depth(len(queue))
                 if current_image is not None:
                     try:
-                        if self._config.write_labels:
-                            label = self._receive_combo_value()
+                        started = perf_counter()
+                        label = self._label
+                        source = queue.source
                         queue.dequeue()
-                        results = processor.process(current_image)
-                        writer.write_row([str(current_image), f'{results.mean_fluorescence:.3f}']+
-                                         ([label] if self._config.write_labels else []))
-                        self.output.emit(f'{current_image}: {results.mean_fluorescence:.3f}')
-                        if self._img_writer is not None:
-                            center_y, center_x = results.center
-                            self._img_writer.write_roi(results.writeable_img, current_image.name, current_image.white_point, center_y, center_x, results.radius)
+                        results = processors[source].process(current_image)
+                        self._write_row(writer, current_image.name, results, label, source)
+                        self._write_image(current_image.name, source, current_image.white_point, results)
+                        self.stats.record_result(results.mean_fluorescence, source, perf_counter() - started)
+                        self.output.emit(f'{current_image}: {self._format_means(results)}' +
+                                         (f' (confidence {results.confidence:.2f})' if self._config.tracking else ''))
                     except Exception as e:
+                        self.stats.record_error()
                         self.error.emit(f'Error processing {current_image}: {str(e)}')
+                    if self._profiler is not None:
+                        self._profiler.tick(len(queue))
+        queue.close()
         self.finished.emit()
 
-    @pyqtSlot(str)
-    def _on_label_receive(self, label: str) -> None:
-        self._previous_label = label
-        if self._wait_loop and self._wait_loop.isRunning():
-            self._wait_loop.quit()
+    def _supervised_live_process(self) -> None:
+        #Paths go to worker processes; a crash, hang or memory blow-up costs one image, not the session
+        queue = self._config.create_queue()
+        dead_letters = DeadLetterLog(self._config.output_directory)
+        labels = {}
+        pool = None
+        try:
+            pool = SupervisedPool(self._config, workers=self._config.supervised_workers,
+                                  timeout_s=self._config.image_timeout, memory_mb=self._config.worker_memory_mb)
+            with CSVWriter(self._config.output_directory, header=self._header) as writer:
+                while not self._stopped or pool.busy:
+                    if not self._stopped:
+                        queue.update()
+                    while not self._stopped and pool.idle and not queue.is_empty():
+                        img_path, source = queue.front_path(), queue.source
+                        if not pool.submit(img_path, source):
+                            break
+                        queue.dequeue()
+                        labels[img_path] = self._label
+                    self.stats.set_queue_depth(len(queue) + pool.busy)
+                    for outcome in pool.poll():
+                        label = labels.pop(outcome.path, self._label)
+                        if self._profiler is not None:
+                            self._profiler.tick(len(queue) + pool.busy)
+                        if outcome.error is not None:
+                            dead_letters.add(outcome.path, outcome.error)
+                            self.stats.record_error()
+                            self.error.emit(f'Error processing {outcome.name}: {outcome.error}')
+                            continue
+                        results = outcome.result
+                        self._write_row(writer, outcome.name, results, label, outcome.source)
+                        self._write_image(outcome.name, outcome.source, outcome.white_point, results)
+                        self.stats.record_result(results.mean_fluorescence, outcome.source, outcome.seconds)
+                        self.output.emit(f'{outcome.name}: {self._format_means(results)}' +
+                                         (f' (confidence {results.confidence:.2f})' if self._config.tracking else ''))
+        except (RuntimeError, ValueError) as e:
+            self.error.emit(f'Supervised processing stopped: {str(e)}')
+        finally:
+            if pool is not None:
+                pool.close()
+            queue.close()
+        self.finished.emit()
 
-    def _receive_combo_value(self) -> str:
-        self._wait_loop = QEventLoop()
-        self.get_label.emit()
-        self._wait_loop.exec_()
-        return self._previous_label
+    @pyqtSlot(str)
+    def set_label(self, label: str) -> None:
+        self._label = label
+
+    def _create_processors(self, metrics: SessionMetrics=None) -> dict[str, Processor]:
+        #Sources share settings, but each keeps its own processor so tracking state never crosses scopes.
+        #Only live captures are a time series; batch files may be in any order
+        tracking = self._config.tracking and self._live
+        if not tracking:
+            processor = self._config.create_processor(metrics, tracking=False)
+            return {source.name: processor for source in self._config.sources}
+        return {source.name: self._config.create_processor(metrics) for source in self._config.sources}
+
+    def _write_row(self, writer: CSVWriter, name: str, results: FluorescenceResult, label: str, source: str) -> None:
+        #One row per ROI; results built without ROI details describe a single region
+        rois = results.rois if results.rois else [RoiResult(results.center, results.radius, results.mean_fluorescence)]
+        for index, roi in enumerate(rois, start=1):
+            statistics = [roi.statistics.get(statistic, '') for statistic in self._config.roi_statistics]
+            writer.write_row(([source] if self._multi_source else []) + [name] +
+                             ([index] if self._config.max_rois > 1 else []) + [f'{roi.mean_fluorescence:.3f}'] +
+                             ([f'{roi.background:.3f}'] if self._correcting else []) +
+                             [f'{value:.3f}' if isinstance(value, float) else value for value in statistics] +
+                             ([f'{results.confidence:.3f}'] if self._config.tracking else []) +
+                             ([label] if self._config.write_labels else []))
+
+    def _write_image(self, name: str, source: str, white_point: int, results: FluorescenceResult) -> None:
+        if self._img_writer is not None and results.writeable_img is not None:
+            rois = [(roi.center, roi.radius) for roi in results.rois] if results.rois else [(results.center, results.radius)]
+            self._img_writer.write_rois(results.writeable_img, self._output_name(source, name), white_point, rois)
+
+    def _output_name(self, source: str, name: str) -> str:
+        #Namespaced like manifest keys: the default source keeps bare names, the others write under <source>/
+        return name if source == self._default_source else f'{source}/{name}'
+
+    @staticmethod
+    def _format_means(results: FluorescenceResult) -> str:
+        if len(results.rois) <= 1:
+            return f'{results.mean_fluorescence:.3f}'
+        return ', '.join(f'{roi.mean_fluorescence:.3f}' for roi in results.rois)
 
 class BayesianWorker(QObject):
     output = pyqtSignal(str)
@@ -121,19 +299,32 @@ class BayesianWorker(QObject):
         self._config = conf
         self._mode = mode
         self._stopped = False
-        factory = partial(self._config.create_image, reader=self._config.stable_reader())
+        self._plane_cache = self._config.create_plane_cache()
+        factory = partial(self._config.create_image, reader=self._config.stable_reader(), plane_cache=self._plane_cache)
         direc = self._config.training_directory_raw if self._mode.lower() == 'train' else self._config.testing_directory_raw
         self._queue = LazyQueue(direc, image_factory=factory, file_format=self._config.image_format,
                           enqueue_existing=True)
-        self._processor = self._config.create_processor()
+        self._processor = self._config.create_processor(tracking=False)
         self._max = len(self._queue)
         self._counter = 1
+        self._profiler = None
 
     def run(self):
-        if self._mode.lower() == 'train':
-            self._train()
-        elif self._mode.lower() == 'test':
-            self._test()
+        self._profiler = self._config.create_profiler(self._mode.lower())
+        if self._profiler is not None:
+            self._profiler.start()
+            self.output.emit(f'Profiling to {self._profiler.prefix}_*')
+        try:
+            if self._mode.lower() == 'train':
+                self._train()
+            elif self._mode.lower() == 'test':
+                self._test()
+        finally:
+            if self._profiler is not None:
+                self._profiler.stop()
+            if self._plane_cache is not None:
+                self.output.emit(self._plane_cache.report())
+                self._plane_cache.close()
 
     def _train(self):
         trainer = self._config.create_trainer()
@@ -142,18 +333,25 @@ class BayesianWorker(QObject):
             if raw_image is not None:
                 try:
                     self._queue.dequeue()
-                    trainer.update(raw_image=raw_image, truth_image=None)
+                    truth_image = TiffImage(self._config.training_directory_truth / f'{raw_image.name}.tif',
+                                            scaling=raw_image.scaling, white_point=self._config.truth_intensity)
+                    trainer.update(raw_image=raw_image, truth_image=truth_image, white_point=raw_image.white_point)
                     self.output.emit(f'Training {raw_image.name} Complete: {self._counter}/{self._max}')
                 except Exception as e:
                     self.error.emit(f'Error training with {raw_image.name}: {str(e)}')
                 finally:
                     self._counter += 1
+                    if self._profiler is not None:
+                        self._profiler.tick(len(self._queue))
         self.output.emit('Calculating...')
         self.output.emit(f'Suggested Threshold: {trainer.train():.4f}')
+        if self._config.model_file is not None:
+            trainer.save_model(self._config.model_file)
+            self.output.emit(f'Model saved to {self._config.model_file}')
         self.finished.emit()
 
     def _test(self):
-        tester = self._config.create_tester()
+        tester = self._config.create_tester(self._plane_cache)
         begin_time = time()
         while not self._queue.is_empty() and not self._stopped:
             current_image = self._queue.front()
@@ -167,6 +365,8 @@ class BayesianWorker(QObject):
                     self.error.emit(f'Error testing with {current_image}: {str(e)}')
                 finally:
                     self._counter += 1
+                    if self._profiler is not None:
+                        self._profiler.tick(len(self._queue))
         completion_time = time()
         self.output.emit(tester.report())
         self.output.emit(f'Total time: {completion_time - begin_time:.4f} sec')
@@ -177,10 +377,23 @@ class BayesianWorker(QObject):
         self._stopped = True
 
 class ConfigWindow(QMainWindow):
+    _MASKING_METHODS = {'Thresholding': 'Thresholding (Faster)',
+                        'K-Means': 'K-Means (Slower)',
+                        'Histogram K-Means': 'K-Means (Histogram)',
+                        'Otsu': 'Otsu (Adaptive)',
+                        'Bayesian': 'Bayesian Model (Adaptive)'}
+    _RADIUS_METHODS = {'Contour': 'Contour',
+                       'Eigenvalue': 'Eigenvalues',
+                       'Components': 'Connected Components'}
+
     def __init__(self, config: Config):
         super().__init__()
         self._ui = Ui_ConfigWindow()
         self._ui.setupUi(self)
+        for label in list(self._MASKING_METHODS.values())[self._ui.masking_dropdown.count():]:
+            self._ui.masking_dropdown.addItem(label)
+        for label in list(self._RADIUS_METHODS.values())[self._ui.extraction_dropdown.count():]:
+            self._ui.extraction_dropdown.addItem(label)
         self.setWindowTitle('Settings')
         self._config = config
         self._unsaved_changes = False
@@ -255,10 +468,14 @@ class ConfigWindow(QMainWindow):
 
         self._ui.normalization_checkbox.setChecked(True)
         self._ui.norm_percentile_line_edit.setText(str(self._config.normalization_percentile))
-        masking_index = 0 if self._config.masking_method.lower() == 'thresholding' else 1
+        masking_methods = [method.lower() for method in self._MASKING_METHODS]
+        masking_method = self._config.masking_method.lower()
+        masking_index = masking_methods.index(masking_method) if masking_method in masking_methods else 0
         self._ui.masking_dropdown.setCurrentIndex(masking_index)
         self._ui.thresh_intensity_line_edit.setText(str(self._config.threshold_level))
-        extraction_index = 0 if self._config.radius_method.lower() == 'contour' else 1
+        radius_methods = [method.lower() for method in self._RADIUS_METHODS]
+        radius_method = self._config.radius_method.lower()
+        extraction_index = radius_methods.index(radius_method) if radius_method in radius_methods else 1
         self._ui.extraction_dropdown.setCurrentIndex(extraction_index)
 
         self._ui.required_stable_line_edit.setText(str(self._config.required_stable))
@@ -321,11 +538,11 @@ class ConfigWindow(QMainWindow):
             self._config.set('processing', 'Normalization', self._ui.normalization_checkbox.isChecked())
             self._config.set('processing', 'Normalization_Percentile',
                             float(self._ui.norm_percentile_line_edit.text()))
-            masking_method = 'Thresholding' if self._ui.masking_dropdown.currentIndex() == 0 else 'K-Means'
+            masking_method = list(self._MASKING_METHODS)[self._ui.masking_dropdown.currentIndex()]
             self._config.set('processing', 'Masking_Method', masking_method)
             self._config.set('processing', 'Threshold_Level',
                             int(self._ui.thresh_intensity_line_edit.text()))
-            radius_method = 'Contour' if self._ui.extraction_dropdown.currentIndex() == 0 else 'Eigenvalue'
+            radius_method = list(self._RADIUS_METHODS)[self._ui.extraction_dropdown.currentIndex()]
             self._config.set('processing', 'Radius_Method', radius_method)
 
             self._config.set('processing', 'Required_Stable',
@@ -399,6 +616,8 @@ class ProcessingWindow(QMainWindow):
         self._ui = Ui_ProcessingWindow()
         self._ui.setupUi(self)
         self._ui.label_group_box.setEnabled(self._config.write_labels)
+        self._log = BufferedLog(self._ui.output_textbox, parent=self)
+        self._stats_label = None
         title = 'Live Processing' if live else 'Batch Processing'
         self.setWindowTitle(title)
         self._ui.exit_button.clicked.connect(self._exit)
@@ -411,14 +630,17 @@ class ProcessingWindow(QMainWindow):
         self._processing_thread = QThread()
         self._worker = ProcessingWorker(self._config, live=self._live)
         self._worker.moveToThread(self._processing_thread)
+        self._stats_label = StatsLabel(self._worker.stats.snapshot, parent=self)
+        self._ui.gridLayout.addWidget(self._stats_label, 2, 0, 1, 2)
         self._processing_thread.started.connect(self._worker.run)
         self._worker.finished.connect(self._processing_thread.quit)
         self._worker.output.connect(self._show_output)
         self._worker.error.connect(self._show_output)
         self._worker.window = self
         if self._config.write_labels:
-            self._worker.get_label.connect(self._send_label)
-            self.send_label.connect(self._worker._on_label_receive)
+            self.send_label.connect(self._worker.set_label, Qt.DirectConnection)
+            self._ui.label_combo_box.currentTextChanged.connect(self._send_label)
+            self._send_label()
         self._processing_thread.start()
 
     def _exit(self):
@@ -438,10 +660,7 @@ class ProcessingWindow(QMainWindow):
         event.accept()
 
     def _show_output(self, output: str) -> None:
-        self._ui.output_textbox.append(output)
-        cursor = self._ui.output_textbox.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self._ui.output_textbox.setTextCursor(cursor)
+        self._log.append(output)
 
     def _add_label_to_dropdown(self) -> None:
         new_label = self._ui.label_combo_box.currentText()
@@ -458,6 +677,7 @@ class BayesianWindow(QMainWindow):
         self._mode = mode
         self._ui = Ui_ProcessingWindow()
         self._ui.setupUi(self)
+        self._log = BufferedLog(self._ui.output_textbox, parent=self)
         title = 'Bayesian Training' if mode.lower() == 'training' else 'Bayesian Testing'
         self.setWindowTitle(title)
         self._bayesian_thread = None
@@ -494,20 +714,17 @@ class BayesianWindow(QMainWindow):
         event.accept()
 
     def _show_output(self, output: str) -> None:
-        self._ui.output_textbox.append(output)
-        cursor = self._ui.output_textbox.textCursor()
-        cursor.movePosition(QTextCursor.End)
-        self._ui.output_textbox.setTextCursor(cursor)
+        self._log.append(output)
 
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    def __init__(self, config: Config=None):
         super().__init__()
         self._ui = Ui_MainWindow()
         self._ui.setupUi(self)
         self.setWindowTitle('EyeSpy')
 
-        self._config = Config()
+        self._config = config if config is not None else Config()
         self.processing_window = None
         self.config_window = None
         self.bayesian_window = None
@@ -524,12 +741,12 @@ class MainWindow(QMainWindow):
                 QMessageBox.warning(self, 'Config Error', 'No director[y/ies] selected. Select directory in settings before testing.')
                 return False
             if not directory.exists():
-                QMessageBox.warning(self, 'Config Error', f'Selected directory {self._config.directory} does not appear to exist or cannot be accessed.')
+                QMessageBox.warning(self, 'Config Error', f'Selected directory {directory} does not appear to exist or cannot be accessed.')
                 return False
         return True
 
     def start_live_processing(self) -> None:
-        if not self._validate_directory([self._config.directory]):
+        if not self._validate_directory([source.directory for source in self._config.sources]):
             return
         if self.processing_window is None or not self.processing_window.isVisible():
             self.processing_window = ProcessingWindow(self._config)
@@ -538,7 +755,7 @@ class MainWindow(QMainWindow):
         self.processing_window.activateWindow()
 
     def start_batch_processing(self):
-        if not self._validate_directory([self._config.directory]):
+        if not self._validate_directory([source.directory for source in self._config.sources]):
             return
         if self.processing_window is None or not self.processing_window.isVisible():
             self.processing_window = ProcessingWindow(self._config, live=False)
@@ -572,11 +789,23 @@ class MainWindow(QMainWindow):
         self.config_window.activateWindow()
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
+    #Supervised workers are spawned; in a frozen EyeSpy.exe this keeps each worker from relaunching the GUI
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description='EyeSpy')
+    parser.add_argument('--profile', action='store_true', help='write cProfile statistics for each processing session')
+    parser.add_argument('--profile-every', type=int, help='images per profile file')
+    parser.add_argument('--profile-memory', action='store_true', help='also write tracemalloc snapshots')
+    args, qt_args = parser.parse_known_args()
+    app = QApplication(sys.argv[:1] + qt_args)
     app.setApplicationName('EyeSpy')
     app.setApplicationVersion('1.0.0')
 
-    main_window = MainWindow()
+    config = Config()
+    if args.profile or args.profile_memory:
+        config.override('profiling', Enabled=True, Memory=args.profile_memory or config.profile_memory)
+    if args.profile_every is not None:
+        config.override('profiling', Every=args.profile_every)
+    main_window = MainWindow(config)
     main_window.show()
 
     sys.exit(app.exec_())
\ No newline at end of file
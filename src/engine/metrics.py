@@ -0,0 +1,140 @@
+import os
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from threading import Lock
+
+#Latency buckets in seconds, from a fast in-memory stage up to a slow network read
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DESCRIPTIONS = {'images_processed_total': ('counter', 'Images processed successfully.'),
+                 'errors_total': ('counter', 'Images that failed to read or process.'),
+                 'bytes_read_total': ('counter', 'Bytes of image files read.'),
+                 'queue_depth': ('gauge', 'Images waiting to be processed.'),
+                 'stable_read_wait_seconds': ('histogram', 'Time spent waiting for a file size to settle.'),
+                 'image_seconds': ('histogram', 'Time from dequeue to result per image.'),
+                 'stage_seconds': ('histogram', 'Time per pipeline stage.')}
+
+class SessionMetrics:
+    #Counters, gauges and histograms, rendered in the Prometheus text format
+    def __init__(self, prefix: str='eyespy'):
+        self._prefix = prefix
+        self._lock = Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float=1.0, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._values[(name, tuple(sorted(labels.items())))] = float(value)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            histogram[0][bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+
+    def timer(self, name: str, **labels):
+        return lambda seconds: self.observe(name, seconds, **labels)
+
+    def render(self) -> str:
+        with self._lock:
+            values = sorted(self._values.items())
+            histograms = sorted((key, (list(counts), total)) for key, (counts, total) in self._histograms.items())
+        lines = []
+        described = set()
+        for (name, labels), value in values:
+            self._describe(lines, described, name)
+            lines.append(f'{self._prefix}_{name}{self._labels(labels)} {value:g}')
+        for (name, labels), (counts, total) in histograms:
+            self._describe(lines, described, name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'{self._prefix}_{name}_bucket{self._labels(labels + (("le", f"{bound}"),))} {cumulative}')
+            lines.append(f'{self._prefix}_{name}_sum{self._labels(labels)} {total:.6f}')
+            lines.append(f'{self._prefix}_{name}_count{self._labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def _describe(self, lines: list[str], described: set, name: str) -> None:
+        if name in described:
+            return
+        described.add(name)
+        kind, description = _DESCRIPTIONS.get(name, ('untyped', name))
+        lines.append(f'# HELP {self._prefix}_{name} {description}')
+        lines.append(f'# TYPE {self._prefix}_{name} {kind}')
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        data = self.server.metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+class MetricsExporter:
+    #Serves GET /metrics and/or rewrites a textfile-collector file every interval, each in its own daemon thread
+    def __init__(self, metrics: SessionMetrics, host: str=None, port: int=None, path: Path=None, interval_s: float=15.0):
+        self._metrics = metrics
+        self._path = path
+        self._interval_s = interval_s
+        self._stopped = threading.Event()
+        self._server = None
+        self._threads = []
+        if port is not None:
+            self._server = ThreadingHTTPServer((host or '127.0.0.1', port), _MetricsHandler)
+            self._server.daemon_threads = True
+            self._server.metrics = metrics
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._threads.append(threading.Thread(target=self._write_loop, daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def address(self) -> tuple[str, int] | None:
+        return self._server.server_address if self._server is not None else None
+
+    def close(self) -> None:
+        self._stopped.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        if self._path is not None:
+            self._write()
+
+    def _write_loop(self) -> None:
+        while not self._stopped.wait(self._interval_s):
+            self._write()
+
+    def _write(self) -> None:
+        #Replace atomically so a collector never reads a half-written file
+        temporary = self._path.with_name(f'{self._path.name}.tmp')
+        with open(temporary, 'w') as file:
+            file.write(self._metrics.render())
+        os.replace(temporary, self._path)
@@ -0,0 +1,85 @@
+import cProfile
+import csv
+import linecache
+import os
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from time import time
+
+class SessionProfiler:
+    #Every `every` images: a .prof file (pstats, snakeviz) and, with memory on, a .tracemalloc snapshot and top allocators
+    def __init__(self, direc: Path, name: str, every: int=100, memory: bool=False, top: int=25, frames: int=10):
+        self._direc = direc / 'profiles'
+        if not os.path.exists(self._direc):
+            os.makedirs(self._direc)
+        self._prefix = f'{name}_{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+        self._every = every
+        self._memory = memory
+        self._top = top
+        self._frames = frames
+        self._profile = None
+        self._previous = None
+        self._count = 0
+        self._first = 1
+        self._window = 0
+        self._started = 0.0
+        self._depth_file = None
+        self._depth_writer = None
+
+    @property
+    def prefix(self) -> Path:
+        return self._direc / self._prefix
+
+    def start(self) -> None:
+        #cProfile follows the calling thread, so start from inside the worker's run()
+        self._started = time()
+        self._depth_file = open(self._direc / f'{self._prefix}_queue.csv', 'w', newline='')
+        self._depth_writer = csv.writer(self._depth_file)
+        self._depth_writer.writerow(['image', 'elapsed_s', 'queue_depth'])
+        if self._memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def tick(self, queue_depth: int) -> None:
+        self._count += 1
+        self._depth_writer.writerow([self._count, f'{time() - self._started:.3f}', queue_depth])
+        if self._count % self._every == 0:
+            self._dump()
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+    def stop(self) -> None:
+        if self._profile is None:
+            return
+        if self._count >= self._first or self._count == 0:
+            self._dump()
+        else:
+            self._profile.disable()
+        self._profile = None
+        if self._memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self._depth_file.close()
+
+    def _dump(self) -> None:
+        self._profile.disable()
+        self._window += 1
+        base = self._direc / f'{self._prefix}_{self._window:04d}'
+        self._profile.dump_stats(f'{base}.prof')
+        self._depth_file.flush()
+        first, self._first = self._first, self._count + 1
+        if not self._memory:
+            return
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                               tracemalloc.Filter(False, linecache.__file__)))
+        snapshot.dump(f'{base}.tracemalloc')
+        with open(f'{base}_memory.txt', 'w') as file:
+            file.write(f'Images {first}-{self._count}\n\nTop allocators\n')
+            for stat in snapshot.statistics('lineno')[:self._top]:
+                file.write(f'{stat}\n')
+            if self._previous is not None:
+                file.write('\nGrowth since the previous window\n')
+                for stat in snapshot.compare_to(self._previous, 'lineno')[:self._top]:
+                    file.write(f'{stat}\n')
+        self._previous = snapshot
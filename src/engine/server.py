@@ -0,0 +1,242 @@
+import argparse
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+from pathlib import Path
+from typing import Callable
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from src.engine.config import Config, Source
+from src.images.image import BaseImage, TiffImage
+from src.processing.processing_result import FluorescenceResult
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    load: Callable[[], BaseImage]
+    reply: queue.Queue
+    result: FluorescenceResult = None
+    error: str = None
+    image: BaseImage = field(default=None, repr=False)
+
+class ProcessorPool:
+    #Warm worker threads, each with its own Processor; queued jobs from any client are batched together.
+    #Requests are unrelated images, so Tracking is never applied here
+    def __init__(self, config: Config, workers: int=2, batch_size: int=4):
+        self._jobs = queue.Queue()
+        self._batch_size = batch_size
+        self._ids = count(1)
+        self._threads = [threading.Thread(target=self._run, args=(config.create_processor(tracking=False),), daemon=True)
+                         for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name: str, load: Callable[[], BaseImage], reply: queue.Queue) -> Job:
+        job = Job(id=next(self._ids), name=name, load=load, reply=reply)
+        self._jobs.put(job)
+        return job
+
+    @property
+    def depth(self) -> int:
+        return self._jobs.qsize()
+
+    def close(self) -> None:
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self, processor) -> None:
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                return
+            batch = [job]
+            while len(batch) < self._batch_size:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    self._jobs.put(None)
+                    break
+                batch.append(job)
+            self._process(processor, batch)
+
+    @staticmethod
+    def _process(processor, batch: list[Job]) -> None:
+        loaded = []
+        for job in batch:
+            try:
+                job.image = job.load()
+                if job.image.array is None:
+                    raise ValueError('Image could not be read.')
+                loaded.append(job)
+            except Exception as e:
+                job.error = str(e)
+        try:
+            if hasattr(processor, 'process_batch') and len(loaded) > 1:
+                results = processor.process_batch([job.image for job in loaded])
+            else:
+                results = [processor.process(job.image) for job in loaded]
+            for job, result in zip(loaded, results):
+                job.result = result
+        except Exception:
+            #Isolate the failing image instead of failing the whole batch
+            for job in loaded:
+                try:
+                    job.result = processor.process(job.image)
+                except Exception as e:
+                    job.error = str(e)
+        for job in batch:
+            job.image = None
+            job.reply.put(job)
+
+def result_to_json(job: Job) -> dict:
+    if job.error is not None:
+        return {'id': job.id, 'name': job.name, 'error': job.error}
+    result = job.result
+    return {'id': job.id, 'name': job.name,
+            'mean_fluorescence': float(result.mean_fluorescence),
+            'center': [float(value) for value in result.center],
+            'radius': float(result.radius),
+            'confidence': float(result.confidence),
+            'rois': [{'center': [float(value) for value in roi.center],
+                      'radius': float(roi.radius),
+                      'mean_fluorescence': float(roi.mean_fluorescence),
+                      'background': float(roi.background),
+                      'statistics': {name: float(value) for name, value in roi.statistics.items()}}
+                     for roi in result.rois]}
+
+class RequestHandler(BaseHTTPRequestHandler):
+    #GET /health, POST /jobs {"paths": [...]} streams NDJSON, POST /arrays?name=&scaling=&white_point= takes .npy bytes
+    server_version = 'EyeSpy'
+
+    def do_GET(self) -> None:
+        if urlparse(self.path).path != '/health':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        self._send_json(200, {'status': 'ok', 'queued': self.server.pool.depth})
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        try:
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if url.path == '/jobs':
+                self._stream_paths(json.loads(body))
+            elif url.path == '/arrays':
+                self._process_array(body, parse_qs(url.query))
+            else:
+                self._send_json(404, {'error': 'Not found'})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+
+    def _stream_paths(self, request: dict) -> None:
+        if not isinstance(request, dict) or not isinstance(request.get('paths'), list) or \
+                not all(isinstance(path, str) for path in request['paths']):
+            raise ValueError('Expected a JSON object with a "paths" list of strings.')
+        config = self.server.config
+        reply = queue.Queue()
+        jobs = []
+        for path in request['paths']:
+            path = Path(path)
+            source = Source(name='server', directory=path.parent,
+                            image_format='CZI' if path.suffix.lower() == '.czi' else 'TIFF',
+                            scaling=float(request.get('scaling', config.scaling)),
+                            white_point=int(request.get('white_point', config.white_point)))
+            load = lambda path=path, source=source: config.create_image(path, config.stable_reader(source.image_format), source)
+            jobs.append(self.server.pool.submit(path.stem, load, reply))
+        #Results are written as they finish, one JSON object per line, until the connection closes
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for _ in jobs:
+            self.wfile.write(json.dumps(result_to_json(reply.get())).encode() + b'\n')
+            self.wfile.flush()
+
+    def _process_array(self, body: bytes, query: dict) -> None:
+        config = self.server.config
+        array = np.load(io.BytesIO(body), allow_pickle=False)
+        name = query.get('name', ['array'])[0]
+        scaling = float(query.get('scaling', [config.scaling])[0])
+        white_point = int(query.get('white_point', [config.white_point])[0])
+        load = lambda: TiffImage(Path(name), scaling=scaling, white_point=white_point, reader=lambda _: np.squeeze(array))
+        reply = queue.Queue()
+        self.server.pool.submit(name, load, reply)
+        job = reply.get()
+        self._send_json(200 if job.error is None else 422, result_to_json(job))
+
+    def _send_json(self, status: int, payload: dict) -> None:
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+class ProcessingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int] | str, config: Config, pool: ProcessorPool):
+        self.config = config
+        self.pool = pool
+        super().__init__(address, RequestHandler)
+
+    def close(self) -> None:
+        self.server_close()
+        self.pool.close()
+
+class UnixProcessingServer(ProcessingServer):
+    address_family = getattr(socket, 'AF_UNIX', None)
+
+    def __init__(self, path: str, config: Config, pool: ProcessorPool):
+        if os.path.exists(path):
+            os.remove(path)
+        super().__init__(path, config, pool)
+
+    def server_bind(self) -> None:
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+def create_server(config: Config, host: str=None, port: int=None, socket_path: str=None) -> ProcessingServer:
+    socket_path = socket_path or (str(config.server_socket) if config.server_socket is not None else None)
+    if socket_path is not None and UnixProcessingServer.address_family is None:
+        raise ValueError('Unix sockets are not supported on this platform.')
+    pool = ProcessorPool(config, workers=config.server_workers, batch_size=config.server_batch_size)
+    if socket_path is not None:
+        return UnixProcessingServer(socket_path, config, pool)
+    return ProcessingServer((host or config.server_host, port if port is not None else config.server_port), config, pool)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve EyeSpy processing over HTTP.')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--socket')
+    args = parser.parse_args()
+    config = Config()
+    config.validate()
+    if config.tracking:
+        print('Tracking is ignored by the server: each request is processed independently.')
+    server = create_server(config, host=args.host, port=args.port, socket_path=args.socket)
+    print(f'Serving on {server.server_address}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
@@ -0,0 +1,41 @@
+from collections import namedtuple
+from threading import Lock
+from time import time
+from src.engine.metrics import SessionMetrics
+
+StatsSnapshot = namedtuple('StatsSnapshot', ['processed', 'errors', 'queue_depth', 'latest', 'elapsed'])
+
+class SessionStats:
+    def __init__(self, metrics: SessionMetrics=None):
+        self._lock = Lock()
+        self._metrics = metrics
+        self._processed = 0
+        self._errors = 0
+        self._queue_depth = 0
+        self._latest = None
+        self._started = time()
+
+    def record_result(self, value: float, source: str=None, seconds: float=None) -> None:
+        with self._lock:
+            self._processed += 1
+            self._latest = value
+        if self._metrics is not None:
+            self._metrics.inc('images_processed_total', source=source or 'default')
+            if seconds is not None:
+                self._metrics.observe('image_seconds', seconds)
+
+    def record_error(self) -> None:
+        with self._lock:
+            self._errors += 1
+        if self._metrics is not None:
+            self._metrics.inc('errors_total')
+
+    def set_queue_depth(self, depth: int) -> None:
+        self._queue_depth = depth
+        if self._metrics is not None:
+            self._metrics.set('queue_depth', depth)
+
+    def snapshot(self) -> StatsSnapshot:
+        with self._lock:
+            return StatsSnapshot(processed=self._processed, errors=self._errors, queue_depth=self._queue_depth,
+                                 latest=self._latest, elapsed=time() - self._started)
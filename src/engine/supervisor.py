@@ -0,0 +1,220 @@
+import multiprocessing as mp
+import os
+import sys
+from dataclasses import dataclass, replace
+from multiprocessing.connection import wait
+from pathlib import Path
+from time import monotonic
+from src.engine.config import Config
+from src.processing.processing_result import FluorescenceResult
+try:
+    import resource
+except ImportError:
+    resource = None
+
+@dataclass
+class Outcome:
+    path: Path
+    source: str
+    name: str
+    white_point: int = None
+    result: FluorescenceResult = None
+    error: str = None
+    seconds: float = None
+
+class _Slot:
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.job = None
+        self.ready = False
+        self.started = 0.0
+        self.failures = 0
+        self.start_at = 0.0
+
+def resident_bytes(pid: int) -> int | None:
+    #Resident set size of a process without extra dependencies, or None where the platform has no cheap way to read it
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        class Counters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage',
+                                                             'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                                                             'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        kernel32.OpenProcess.restype = wintypes.HANDLE
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return None
+        try:
+            counters = Counters()
+            counters.cb = ctypes.sizeof(Counters)
+            if not kernel32.K32GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return None
+            return counters.WorkingSetSize
+        finally:
+            kernel32.CloseHandle(handle)
+    try:
+        with open(f'/proc/{pid}/statm') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def memory_limit_supported() -> bool:
+    #Worker_Memory_MB is enforced by polling resident memory (Windows, Linux) or by RLIMIT_AS in the worker (other POSIX)
+    return sys.platform == 'win32' or os.path.exists('/proc/self/statm') or resource is not None
+
+def _worker_main(connection, config_data: dict, memory_mb: int, keep_image: bool) -> None:
+    #Runs in the child: decode and process one path at a time, reporting back over its own pipe
+    if memory_mb > 0 and resource is not None:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    config = Config.from_dict(config_data)
+    sources = {source.name: source for source in config.sources}
+    processors = {}
+    connection.send(None)
+    while True:
+        message = connection.recv()
+        if message is None:
+            return
+        path, source_name = message
+        try:
+            source = sources[source_name]
+            image = config.create_image(path, config.stable_reader(source.image_format), source)
+            if image.array is None:
+                raise ValueError('Image could not be read.')
+            if source_name not in processors:
+                processors[source_name] = config.create_processor()
+            result = processors[source_name].process(image)
+            result = replace(result, binary_img=None, writeable_img=result.writeable_img if keep_image else None)
+            connection.send((image.name, image.white_point, result, None))
+        except MemoryError:
+            connection.send((path.stem, None, None, f'Exceeded the {memory_mb} MB worker memory limit'))
+        except Exception as e:
+            connection.send((path.stem, None, None, str(e)))
+
+class SupervisedPool:
+    #Worker processes with per-image timeouts, memory limits and automatic restart.
+    #A worker that dies before it is ready is restarted with exponential backoff, and the pool gives up after
+    #MAX_START_FAILURES in a row
+    BACKOFF_S = 0.5
+    MAX_BACKOFF_S = 30.0
+    MAX_START_FAILURES = 5
+
+    def __init__(self, config: Config, workers: int=2, timeout_s: float=60.0, memory_mb: int=4096):
+        if memory_mb > 0 and not memory_limit_supported():
+            raise ValueError('Worker Memory cannot be enforced on this platform; set it to 0.')
+        self._context = mp.get_context('spawn')
+        self._config_data = config.to_dict()
+        self._timeout_s = timeout_s
+        self._memory_mb = memory_mb
+        self._keep_image = config.write_roi
+        self._slots = [_Slot() for _ in range(workers)]
+        for slot in self._slots:
+            self._start(slot)
+
+    @property
+    def idle(self) -> int:
+        return sum(slot.ready and slot.job is None for slot in self._slots)
+
+    @property
+    def busy(self) -> int:
+        return sum(slot.job is not None for slot in self._slots)
+
+    def submit(self, path: Path, source: str) -> bool:
+        #False when no worker took the path, so the caller keeps it queued
+        for slot in self._slots:
+            if slot.ready and slot.job is None:
+                try:
+                    slot.connection.send((path, source))
+                except OSError:
+                    #The worker died while idle and poll has not noticed yet
+                    self._restart(slot)
+                    continue
+                slot.job = (path, source)
+                slot.started = monotonic()
+                return True
+        return False
+
+    def poll(self, timeout: float=0.05) -> list[Outcome]:
+        outcomes = []
+        for slot in self._slots:
+            if slot.process is None and monotonic() >= slot.start_at:
+                self._start(slot)
+            elif slot.process is not None and slot.ready and slot.job is None and not slot.process.is_alive():
+                self._restart(slot)
+        #Timeouts start once a job is sent, so a restarting worker's start-up is not charged to its next image
+        connections = {slot.connection: slot for slot in self._slots
+                       if slot.process is not None and (slot.job is not None or not slot.ready)}
+        for connection in wait(list(connections), timeout) if connections else []:
+            slot = connections[connection]
+            if not slot.ready:
+                try:
+                    slot.ready = connection.recv() is None
+                    slot.failures = 0
+                except (EOFError, OSError):
+                    self._restart(slot, failed_start=True)
+                continue
+            path, source = slot.job
+            try:
+                name, white_point, result, error = connection.recv()
+                outcomes.append(Outcome(path, source, name, white_point, result, error, monotonic() - slot.started))
+                slot.job = None
+            except (EOFError, OSError):
+                #The worker died mid-image, e.g. killed by the OS for memory
+                slot.process.join(timeout=1)
+                outcomes.append(Outcome(path, source, path.stem, error=f'Worker exited with code {slot.process.exitcode}'))
+                self._restart(slot)
+        for slot in self._slots:
+            if slot.job is None:
+                continue
+            path, source = slot.job
+            if not slot.process.is_alive():
+                outcomes.append(Outcome(path, source, path.stem, error=f'Worker exited with code {slot.process.exitcode}'))
+            elif monotonic() - slot.started > self._timeout_s:
+                outcomes.append(Outcome(path, source, path.stem, error=f'Timed out after {self._timeout_s:g} s'))
+            elif self._memory_mb > 0 and (resident_bytes(slot.process.pid) or 0) > self._memory_mb * 1024 * 1024:
+                outcomes.append(Outcome(path, source, path.stem, error=f'Exceeded the {self._memory_mb} MB worker memory limit'))
+            else:
+                continue
+            self._restart(slot)
+        return outcomes
+
+    def close(self) -> None:
+        slots = [slot for slot in self._slots if slot.process is not None]
+        for slot in slots:
+            try:
+                slot.connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for slot in slots:
+            slot.process.join(timeout=5)
+            if slot.process.is_alive():
+                slot.process.kill()
+            slot.connection.close()
+
+    def _start(self, slot: _Slot) -> None:
+        parent, child = self._context.Pipe()
+        slot.process = self._context.Process(target=_worker_main, args=(child, self._config_data, self._memory_mb, self._keep_image),
+                                             daemon=True)
+        slot.process.start()
+        child.close()
+        slot.connection = parent
+        slot.job = None
+        slot.ready = False
+
+    def _restart(self, slot: _Slot, failed_start: bool=False) -> None:
+        if slot.process.is_alive():
+            slot.process.kill()
+        slot.process.join()
+        slot.connection.close()
+        slot.failures = slot.failures + 1 if failed_start else 0
+        if slot.failures >= self.MAX_START_FAILURES:
+            raise RuntimeError(f'A worker process failed to start {slot.failures} times in a row.')
+        if slot.failures == 0:
+            self._start(slot)
+            return
+        slot.process = slot.connection = slot.job = None
+        slot.ready = False
+        slot.start_at = monotonic() + min(self.BACKOFF_S * 2 ** (slot.failures - 1), self.MAX_BACKOFF_S)
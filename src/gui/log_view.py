@@ -0,0 +1,49 @@
+from collections import deque
+from time import time
+from typing import Callable
+from PyQt5.QtCore import QObject, QTimer
+from PyQt5.QtWidgets import QTextBrowser, QLabel, QWidget
+from src.engine.session_stats import StatsSnapshot
+
+class BufferedLog(QObject):
+    def __init__(self, textbox: QTextBrowser, max_lines: int=5000, interval_ms: int=250, parent: QObject=None):
+        super().__init__(parent)
+        self._textbox = textbox
+        self._textbox.document().setMaximumBlockCount(max_lines)
+        self._pending = deque(maxlen=max_lines)
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.flush)
+        self._timer.start(interval_ms)
+
+    def append(self, line: str) -> None:
+        self._pending.append(line)
+
+    def flush(self) -> None:
+        if not self._pending:
+            return
+        text = '\n'.join(self._pending)
+        self._pending.clear()
+        self._textbox.append(text)
+        scrollbar = self._textbox.verticalScrollBar()
+        scrollbar.setValue(scrollbar.maximum())
+
+class StatsLabel(QLabel):
+    def __init__(self, source: Callable[[], StatsSnapshot], interval_ms: int=1000, parent: QWidget=None):
+        super().__init__(parent)
+        self._source = source
+        self._last_processed = 0
+        self._last_time = time()
+        self._timer = QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(interval_ms)
+        self.refresh()
+
+    def refresh(self) -> None:
+        snapshot = self._source()
+        now = time()
+        rate = (snapshot.processed - self._last_processed) / max(now - self._last_time, 1e-6)
+        self._last_processed = snapshot.processed
+        self._last_time = now
+        latest = f'{snapshot.latest:.3f}' if snapshot.latest is not None else '-'
+        self.setText(f'{rate:.1f} images/s | queue: {snapshot.queue_depth} | latest: {latest} | '
+                     f'processed: {snapshot.processed} | errors: {snapshot.errors}')
@@ -1,3 +1,4 @@
+from collections import namedtuple
 from pathlib import Path
 from typing import Callable
 from src.images.image import BaseImage
@@ -5,6 +6,13 @@ import numpy as np
 import tifffile as tf
 import czifile
 
+BayesianModel = namedtuple('BayesianModel', ['likelihood_true', 'likelihood_false', 'prior'])
+
+def load_model(path: Path) -> BayesianModel:
+    with np.load(path) as model:
+        return BayesianModel(likelihood_true=model['likelihood_true'], likelihood_false=model['likelihood_false'],
+                             prior=float(model['prior']))
+
 class Trainer:
     def __init__(self, raw_dir: Path, truth_dir: Path, truth_intensity:int=255, raw_reader: Callable=czifile.imread,
                  truth_reader:Callable = tf.imread, raw_extension: str='czi',
@@ -50,20 +58,30 @@ class Trainer:
         self._false = []
 
     def update(self, raw_image: BaseImage, truth_image: BaseImage, **kwargs):
-        raw_array = np.copy(raw_image.array)
+        raw_array = raw_image.array
         if self._preprocessing is not None:
             raw_array = self._preprocessing(raw_array, **kwargs)
         self._true.append(raw_array[truth_image.array==self._truth_intensity])
         self._false.append(raw_array[truth_image.array==0])
 
-    def train(self) -> int:
+    def model(self) -> BayesianModel:
         current_true = np.concatenate(self._true)
         current_false = np.concatenate(self._false)
         p_true = len(current_true) / (len(current_true) + len(current_false))
-        p_false = 1 - p_true
         hist_true, _ = np.histogram(current_true, bins=self._bins, range=(0, self._bins-1), density=True)
         hist_false, _ = np.histogram(current_false, bins=self._bins, range=(0, self._bins-1), density=True)
-        return np.argmin(np.abs((hist_true * p_true) - (hist_false * p_false)))
+        return BayesianModel(likelihood_true=hist_true, likelihood_false=hist_false, prior=p_true)
+
+    def train(self) -> int:
+        model = self.model()
+        return np.argmin(np.abs((model.likelihood_true * model.prior) - (model.likelihood_false * (1 - model.prior))))
+
+    def save_model(self, path: Path) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        model = self.model()
+        with open(path, 'wb') as file:
+            np.savez(file, likelihood_true=model.likelihood_true, likelihood_false=model.likelihood_false,
+                     prior=model.prior)
 
 
 class Tester:
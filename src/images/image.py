@@ -11,6 +11,8 @@ class BaseImage(ABC):
     def __init__(self, full_path: Path, reader: Callable):
         self._name = Path(full_path).stem
         self._array = reader(full_path)
+        if isinstance(self._array, np.ndarray):
+            self._array.flags.writeable = False
 
     def __repr__(self):
         return self.name
@@ -48,19 +50,13 @@ class TiffImage(BaseImage):
         return self._white_point
 
 class CziImage(BaseImage):
-    def __init__(self, full_path: Path, *, reader:Callable=czifile.imread):
+    def __init__(self, full_path: Path, *, reader:Callable=czifile.imread, metadata: tuple[float, int]=None):
+        #metadata is the (scaling, white point) already read from this file, e.g. by the decode cache
         super().__init__(full_path, reader)
-        img = czifile.CziFile(full_path)
+        self._scaling, self._white_point = metadata if metadata is not None else read_czi_metadata(full_path)
         try:
-            metadata = img.metadata()
-            root = ET.fromstring(metadata)
-            scaling = root.find(".//ImagePixelSize")
-            self._scaling = float(scaling.text[0:scaling.text.index(',')])
-            self._white_point = int(root.find(".//CameraPixelMaximum").text)
-        except:
-            raise FileNotFoundError(f'Metadata of {full_path} could not be parsed!')
-        try:
-            self._array = self._array[0, :, :, 0]
+            if metadata is None or self._array.ndim != 2:
+                self._array = self._array[0, :, :, 0]
         except:
             raise ValueError("File format was not CZI or could not be loaded as expected.")
 
@@ -72,9 +68,45 @@ class CziImage(BaseImage):
     def white_point(self) -> int:
         return self._white_point
 
-def stable_read(img_path: Path, reader: Callable, max_attempts: int, delay_s: float, required_stable: int) -> np.ndarray | None:
+class MosaicImage(BaseImage):
+    def __init__(self, full_path: Path, scaling: float=None, white_point: int=None, *, reader: Callable):
+        super().__init__(full_path, reader)
+        if scaling is None or white_point is None:
+            scaling, white_point = read_czi_metadata(full_path)
+        self._scaling = scaling
+        self._white_point = white_point
+
+    @property
+    def scaling(self) -> float:
+        return self._scaling
+
+    @property
+    def white_point(self) -> int:
+        return self._white_point
+
+def read_czi_metadata(full_path: Path) -> (float, int):
+    try:
+        with czifile.CziFile(full_path) as img:
+            metadata = img.metadata()
+        root = ET.fromstring(metadata)
+        scaling = root.find(".//ImagePixelSize")
+        return float(scaling.text[0:scaling.text.index(',')]), int(root.find(".//CameraPixelMaximum").text)
+    except:
+        raise FileNotFoundError(f'Metadata of {full_path} could not be parsed!')
+
+def memmap_read(full_path: Path) -> np.ndarray:
+    try:
+        return tf.memmap(full_path, mode='r')
+    except ValueError:
+        #Compressed, tiled or otherwise non-contiguous layouts have to be decoded
+        return tf.imread(full_path)
+
+def stable_read(img_path: Path, reader: Callable, max_attempts: int, delay_s: float, required_stable: int,
+                on_read: Callable=None) -> np.ndarray | None:
+    #on_read(wait_s, read_s, size) reports how long the size took to settle and how long the read took
     attempts = 0
     stable_count = 0
+    started = time.perf_counter()
     try:
         while attempts <= max_attempts:
             if not img_path.exists():
@@ -91,7 +123,12 @@ def stable_read(img_path: Path, reader: Callable, max_attempts: int, delay_s: fl
             attempts += 1
         if attempts > max_attempts:
             return None
-        return reader(img_path)
+        if on_read is None:
+            return reader(img_path)
+        settled = time.perf_counter()
+        array = reader(img_path)
+        on_read(settled - started, time.perf_counter() - settled, current_size)
+        return array
     except FileNotFoundError:
         print(f"Error accessing file: {img_path} no longer exists or cannot be accessed.")
     return None
\ No newline at end of file
@@ -4,22 +4,53 @@ from pathlib import Path
 import numpy as np
 import tifffile as tf
 import os
+from typing import Callable
 class CSVWriter:
-    def __init__(self, direc: Path, header: list[str]):
-        name = self._create_name()
+    def __init__(self, direc: Path, header: list[str], name: str=None, append: bool=False):
+        self._name = name if name is not None else self._create_name()
         self._header = header
         if not os.path.exists(direc):
             os.mkdir(direc)
-        self._filepath = direc / f'{name}.csv'
+        self._filepath = direc / f'{self._name}.csv'
+        self._append = append and self._filepath.exists()
+        if self._append and self.read_header(self._filepath) != header:
+            raise ValueError(f'{self._filepath.name} has different columns than the current settings.')
         self._file = None
         self._writer = None
 
+    @staticmethod
+    def read_header(filepath: Path) -> list[str] | None:
+        if not filepath.exists():
+            return None
+        with open(filepath, 'r', newline='') as file:
+            return next(csv.reader(file), None)
+
+    def retain(self, keep: Callable[[dict], bool]) -> int:
+        #Before appending: drop rows keep() rejects, e.g. rows of an image whose manifest entry was never written
+        if not self._append:
+            return 0
+        with open(self._filepath, 'r', newline='') as file:
+            rows = list(csv.reader(file))
+        kept = [row for row in rows[1:] if keep(dict(zip(rows[0], row)))]
+        dropped = len(rows) - 1 - len(kept)
+        if dropped > 0:
+            temporary = self._filepath.with_name(f'{self._filepath.name}.tmp')
+            with open(temporary, 'w', newline='') as file:
+                csv.writer(file).writerows([rows[0]] + kept)
+            os.replace(temporary, self._filepath)
+        return dropped
+
     def __enter__(self):
-        self._file = open(self._filepath, 'w', newline='')
+        self._file = open(self._filepath, 'a' if self._append else 'w', newline='')
         self._writer = csv.writer(self._file)
-        self._writer.writerow(self._header)
+        if not self._append:
+            self._writer.writerow(self._header)
         return self
 
+    @property
+    def name(self) -> str:
+        return self._name
+
     def write_row(self, data: list):
         self._writer.writerow(data)
         self._file.flush()
@@ -37,12 +68,88 @@ class TiffWriter:
         if not os.path.exists(self._direc):
             os.mkdir(self._direc)
 
+    def exists(self, filename: str) -> bool:
+        return self._path(filename).exists()
+
     def write_roi(self, img_array: np.ndarray, filename: str, white_point: int, center_y: int, center_x, radius: int) -> None:
+        self.write_rois(img_array, filename, white_point, [((center_y, center_x), radius)])
+
+    def write_rois(self, img_array: np.ndarray, filename: str, white_point: int, rois: list[tuple[tuple[int, int], int]]) -> None:
         img_array = np.copy(img_array)
         y_coords, x_coords = np.ogrid[:img_array.shape[0], :img_array.shape[1]]
-        dist_squared = (y_coords - center_y) ** 2 + (x_coords - center_x) ** 2
-        inner = dist_squared < radius ** 2
-        outline = dist_squared == radius ** 2
-        img_array[inner] = white_point
-        img_array[outline] = 0
-        tf.imwrite(self._direc / Path(filename + '.tiff'), img_array)
\ No newline at end of file
+        for (center_y, center_x), radius in rois:
+            dist_squared = (y_coords - center_y) ** 2 + (x_coords - center_x) ** 2
+            inner = dist_squared < radius ** 2
+            outline = dist_squared == radius ** 2
+            img_array[inner] = white_point
+            img_array[outline] = 0
+        path = self._path(filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tf.imwrite(path, img_array)
+
+    def _path(self, filename: str) -> Path:
+        #A '<source>/<name>' filename writes into that source's subdirectory
+        return self._direc / Path(filename + '.tiff')
+
+class DeadLetterLog:
+    def __init__(self, direc: Path):
+        if not os.path.exists(direc):
+            os.mkdir(direc)
+        self._filepath = direc / 'dead_letter.csv'
+        self._entries = []
+
+    @property
+    def entries(self) -> list[tuple[str, str]]:
+        return list(self._entries)
+
+    def add(self, path: Path, reason: str) -> None:
+        is_new = not self._filepath.exists()
+        with open(self._filepath, 'a', newline='') as file:
+            writer = csv.writer(file)
+            if is_new:
+                writer.writerow(['time', 'path', 'reason'])
+            writer.writerow([datetime.now().isoformat(timespec='seconds'), str(path), reason])
+        self._entries.append((str(path), reason))
+
+class SessionManifest:
+    #The first line identifies the session's source directories; a resume only continues a manifest with the same one
+    def __init__(self, filepath: Path, source: str):
+        self._filepath = filepath
+        self._source = str(source)
+        self._completed = set()
+        self._file = None
+        if self._filepath.exists():
+            with open(self._filepath, 'r') as file:
+                lines = file.read().splitlines()
+            self._completed.update(line for line in lines[1:] if line)
+
+    def __enter__(self):
+        is_new = not self._filepath.exists()
+        self._file = open(self._filepath, 'a')
+        if is_new:
+            self._file.write(f'{self._source}\n')
+            self._file.flush()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._file.close()
+
+    @property
+    def completed(self) -> set[str]:
+        return self._completed
+
+    def add(self, filename: str) -> None:
+        self._completed.add(filename)
+        self._file.write(f'{filename}\n')
+        self._file.flush()
+
+    @staticmethod
+    def latest(direc: Path, source: str) -> Path | None:
+        if not os.path.exists(direc):
+            return None
+        manifests = sorted(Path(direc).glob('*.manifest'), key=lambda path: path.stat().st_mtime, reverse=True)
+        for manifest in manifests:
+            with open(manifest, 'r') as file:
+                if file.readline().rstrip('\n') == str(source) and manifest.with_suffix('.csv').exists():
+                    return manifest
+        return None
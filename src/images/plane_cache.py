@@ -0,0 +1,188 @@
+import mmap
+from contextlib import contextmanager
+import sqlite3
+from pathlib import Path
+import numpy as np
+
+class PlaneCache:
+    #Decoded 2-D planes appended to segment files, indexed in sqlite and evicted least recently used.
+    #Hits are read-only views into a segment's map. Written bytes are never overwritten: evicting a plane only drops
+    #its row, sparse segments are compacted into the newest one, and a segment's file is deleted once nothing uses it.
+    #Every lookup and store runs in an immediate transaction, so sessions sharing a directory take turns
+    ALIGNMENT = 64
+    SEGMENTS = 4
+
+    def __init__(self, direc: Path, max_bytes: int):
+        self._direc = Path(direc)
+        self._direc.mkdir(parents=True, exist_ok=True)
+        self._max_bytes = max_bytes
+        self._segment_bytes = max(max_bytes // self.SEGMENTS, 1)
+        self._maps = {}
+        self._hits = 0
+        self._misses = 0
+        self._connection = sqlite3.connect(self._direc / 'planes.sqlite', timeout=30, isolation_level=None,
+                                           check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS planes (path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, '
+                                 'segment INTEGER, offset INTEGER, nbytes INTEGER, dtype TEXT, height INTEGER, '
+                                 'width INTEGER, scaling REAL, white_point INTEGER, used INTEGER)')
+        #AUTOINCREMENT so a deleted segment's number, and any map of it still held, is never reused
+        self._connection.execute('CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY AUTOINCREMENT, length INTEGER)')
+        self._clock = self._latest()
+        with self._transaction():
+            self._sweep()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def stored_bytes(self) -> int:
+        return self._connection.execute('SELECT COALESCE(SUM(nbytes), 0) FROM planes').fetchone()[0]
+
+    def get(self, img_path: Path) -> tuple[np.ndarray, tuple[float, int] | None] | None:
+        #A read-only view of the plane and the metadata stored with it (the file's own, for CZI), or None when missing or stale
+        key = str(Path(img_path).resolve())
+        try:
+            stat = img_path.stat()
+        except FileNotFoundError:
+            self._misses += 1
+            return None
+        with self._transaction():
+            row = self._connection.execute('SELECT size, mtime, segment, offset, nbytes, dtype, height, width, scaling, '
+                                           'white_point FROM planes WHERE path=?', (key,)).fetchone()
+            if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+                self._misses += 1
+                return None
+            size, mtime, segment, offset, nbytes, dtype, height, width, scaling, white_point = row
+            plane = self._view(segment, offset, nbytes, np.dtype(dtype), (height, width))
+            self._clock = max(self._clock, self._latest()) + 1
+            self._connection.execute('UPDATE planes SET used=? WHERE path=?', (self._clock, key))
+        self._hits += 1
+        return plane, (scaling, white_point) if scaling is not None else None
+
+    def put(self, img_path: Path, array: np.ndarray, metadata: tuple[float, int]=None) -> bool:
+        #Only store metadata that comes from the file itself; settings from options.ini may change between runs
+        array = np.ascontiguousarray(array)
+        if array.ndim != 2 or array.nbytes > self._max_bytes:
+            return False
+        key = str(Path(img_path).resolve())
+        stat = img_path.stat()
+        scaling, white_point = (float(metadata[0]), int(metadata[1])) if metadata is not None else (None, None)
+        with self._transaction():
+            self._connection.execute('DELETE FROM planes WHERE path=?', (key,))
+            self._evict(self._max_bytes - array.nbytes)
+            segment, offset = self._append(array)
+            self._clock = max(self._clock, self._latest()) + 1
+            self._connection.execute('INSERT INTO planes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                     (key, stat.st_size, stat.st_mtime_ns, segment, offset, array.nbytes, array.dtype.str,
+                                      array.shape[0], array.shape[1], scaling, white_point, self._clock))
+            self._compact()
+        return True
+
+    def report(self) -> str:
+        total = self._hits + self._misses
+        rate = self._hits / total * 100 if total > 0 else 0.0
+        return f'Decode cache: {self._hits} hits, {self._misses} misses ({rate:.1f}% hit rate), ' \
+               f'{self.stored_bytes / 2 ** 20:.1f} MB stored'
+
+    def close(self) -> None:
+        #Maps are only dropped, not closed: planes handed out keep theirs alive until they are released
+        self._connection.close()
+        self._maps.clear()
+
+    @contextmanager
+    def _transaction(self):
+        #BEGIN IMMEDIATE takes the write lock up front, so no other session can evict or compact mid-operation
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _latest(self) -> int:
+        return self._connection.execute('SELECT COALESCE(MAX(used), 0) FROM planes').fetchone()[0]
+
+    def _segment_path(self, segment: int) -> Path:
+        return self._direc / f'segment-{segment:08d}.dat'
+
+    def _evict(self, budget: int) -> None:
+        stored = self.stored_bytes
+        for path, nbytes in self._connection.execute('SELECT path, nbytes FROM planes ORDER BY used').fetchall():
+            if stored <= budget:
+                break
+            self._connection.execute('DELETE FROM planes WHERE path=?', (path,))
+            stored -= nbytes
+
+    def _append(self, array: np.ndarray) -> tuple[int, int]:
+        #After the last plane of the newest segment, or at the start of a new one once it is full
+        row = self._connection.execute('SELECT id, length FROM segments ORDER BY id DESC LIMIT 1').fetchone()
+        if row is None or (row[1] > 0 and self._align(row[1]) + array.nbytes > self._segment_bytes):
+            segment = self._connection.execute('INSERT INTO segments (length) VALUES (0)').lastrowid
+            offset = 0
+        else:
+            segment, offset = row[0], self._align(row[1])
+        path = self._segment_path(segment)
+        #Bytes past the recorded length belong to no plane, so a write interrupted by a crash is simply overwritten
+        with open(path, 'r+b' if path.exists() else 'w+b') as file:
+            file.seek(offset)
+            file.write(memoryview(array).cast('B'))
+        self._connection.execute('UPDATE segments SET length=? WHERE id=?', (offset + array.nbytes, segment))
+        return segment, offset
+
+    def _compact(self) -> None:
+        #Older segments less than half live have their planes moved to the newest one and are then deleted
+        newest = self._connection.execute('SELECT MAX(id) FROM segments').fetchone()[0]
+        sparse = self._connection.execute('SELECT segments.id, segments.length, COALESCE(SUM(planes.nbytes), 0) '
+                                          'FROM segments LEFT JOIN planes ON planes.segment = segments.id '
+                                          'WHERE segments.id < ? GROUP BY segments.id', (newest,)).fetchall()
+        removed = False
+        for segment, length, live in sparse:
+            if live * 2 >= length:
+                continue
+            for path, offset, nbytes, dtype, height, width in self._connection.execute(
+                    'SELECT path, offset, nbytes, dtype, height, width FROM planes WHERE segment=?', (segment,)).fetchall():
+                moved_segment, moved_offset = self._append(self._view(segment, offset, nbytes, np.dtype(dtype), (height, width)))
+                self._connection.execute('UPDATE planes SET segment=?, offset=? WHERE path=?', (moved_segment, moved_offset, path))
+            self._connection.execute('DELETE FROM segments WHERE id=?', (segment,))
+            removed = True
+        if removed:
+            self._sweep()
+
+    def _sweep(self) -> None:
+        #Files without a segment row; POSIX keeps an unlinked file mapped for planes still held, while Windows
+        #refuses to delete a file another session maps and it is retried on a later sweep
+        segments = {row[0] for row in self._connection.execute('SELECT id FROM segments')}
+        for segment in [segment for segment in self._maps if segment not in segments]:
+            del self._maps[segment]
+        for path in self._direc.glob('segment-*.dat'):
+            if int(path.stem.split('-')[1]) not in segments:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
+
+    def _align(self, offset: int) -> int:
+        return -(-offset // self.ALIGNMENT) * self.ALIGNMENT
+
+    def _view(self, segment: int, offset: int, nbytes: int, dtype: np.dtype, shape: tuple[int, int]) -> np.ndarray:
+        #Remap only when the segment has grown past the current map; planes handed out keep the old map alive
+        mapped = self._maps.get(segment)
+        if mapped is None or len(mapped) < offset + nbytes:
+            with open(self._segment_path(segment), 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = mapped
+        return np.frombuffer(mapped, dtype=dtype, count=shape[0] * shape[1], offset=offset).reshape(shape)
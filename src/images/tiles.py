@@ -0,0 +1,107 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import czifile
+import tifffile as tf
+
+class TileSource(ABC):
+    @property
+    @abstractmethod
+    def shape(self) -> tuple[int, int]:
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def dtype(self) -> np.dtype:
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class ArrayTileSource(TileSource):
+    def __init__(self, array: np.ndarray):
+        self._array = array
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self._array.shape[:2]
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._array.dtype
+
+    def read(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        return self._array[top:bottom, left:right]
+
+class CziTileSource(TileSource):
+    def __init__(self, full_path: Path, cached_subblocks: int=8):
+        self._czi = czifile.CziFile(full_path)
+        axes = self._czi.axes
+        start = self._czi.start
+        self._y, self._x = axes.index('Y'), axes.index('X')
+        self._shape = (self._czi.shape[self._y], self._czi.shape[self._x])
+        self._dtype = self._czi.dtype
+        self._entries = []
+        self._boxes = []
+        #Keep only full-resolution subblocks of the first plane (first channel, Z, T, ...)
+        for entry in self._czi.filtered_subblock_directory:
+            if any(entry.start[i] != start[i] for i in range(len(axes)) if i not in (self._y, self._x)):
+                continue
+            if entry.stored_shape[self._y] != entry.shape[self._y] or entry.stored_shape[self._x] != entry.shape[self._x]:
+                continue
+            top, left = entry.start[self._y] - start[self._y], entry.start[self._x] - start[self._x]
+            self._entries.append(entry)
+            self._boxes.append((top, top + entry.shape[self._y], left, left + entry.shape[self._x]))
+        self._cache = OrderedDict()
+        self._cached_subblocks = cached_subblocks
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self._shape
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._dtype
+
+    def read(self, top: int, bottom: int, left: int, right: int) -> np.ndarray:
+        out = np.zeros((bottom - top, right - left), dtype=self._dtype)
+        for index, (box_top, box_bottom, box_left, box_right) in enumerate(self._boxes):
+            y0, y1 = max(top, box_top), min(bottom, box_bottom)
+            x0, x1 = max(left, box_left), min(right, box_right)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            tile = self._subblock(index)
+            out[y0 - top:y1 - top, x0 - left:x1 - left] = tile[y0 - box_top:y1 - box_top, x0 - box_left:x1 - box_left]
+        return out
+
+    def close(self) -> None:
+        self._cache.clear()
+        self._czi.close()
+
+    def _subblock(self, index: int) -> np.ndarray:
+        if index in self._cache:
+            self._cache.move_to_end(index)
+            return self._cache[index]
+        data = self._entries[index].data_segment().data()
+        plane = data[tuple(slice(None) if i in (self._y, self._x) else 0 for i in range(data.ndim))]
+        self._cache[index] = plane
+        if len(self._cache) > self._cached_subblocks:
+            self._cache.popitem(last=False)
+        return plane
+
+def open_czi_tiles(full_path: Path) -> TileSource:
+    return CziTileSource(full_path)
+
+def open_tiff_tiles(full_path: Path) -> TileSource:
+    try:
+        array = tf.memmap(full_path, mode='r')
+    except ValueError:
+        #Compressed or tiled layouts are decoded once into a temporary file-backed array
+        with tf.TiffFile(full_path) as tiff:
+            array = tiff.pages[0].asarray(out='memmap')
+    return ArrayTileSource(np.squeeze(array))
@@ -0,0 +1,57 @@
+from collections import namedtuple
+from pathlib import Path
+import numpy as np
+import tifffile as tf
+from src.processing.processing_functions import Circle
+
+BackgroundModel = namedtuple('BackgroundModel', ['dark', 'gain'])
+
+def load_background(path: Path) -> BackgroundModel:
+    #An .npz may hold 'dark' and/or 'flat' frames; a TIFF is read as a flat field
+    if path.suffix.lower() == '.npz':
+        with np.load(path) as model:
+            dark = model['dark'].astype(np.float32) if 'dark' in model else None
+            flat = model['flat'].astype(np.float32) if 'flat' in model else None
+    else:
+        dark, flat = None, np.squeeze(tf.imread(path)).astype(np.float32)
+    if dark is None and flat is None:
+        raise ValueError(f'Background model {path} has neither a dark nor a flat frame.')
+    if dark is None:
+        dark = np.zeros_like(flat)
+    if flat is None:
+        return BackgroundModel(dark=dark, gain=np.ones_like(dark))
+    #Gain keeps the corrected image at the flat field's mean response
+    response = np.maximum(flat - dark, np.finfo(np.float32).eps)
+    return BackgroundModel(dark=dark, gain=(response.mean() / response).astype(np.float32))
+
+def annulus_background(img_array: np.ndarray, mask: np.ndarray, roi: Circle, inner: float=1.2, outer: float=1.6) -> float:
+    #Median of the non-foreground pixels in a ring around the ROI; maskers mark background 0
+    top, left = max(int(roi.center_y - roi.radius * outer), 0), max(int(roi.center_x - roi.radius * outer), 0)
+    bottom = min(int(roi.center_y + roi.radius * outer) + 1, img_array.shape[0])
+    right = min(int(roi.center_x + roi.radius * outer) + 1, img_array.shape[1])
+    y_coords, x_coords = np.ogrid[top:bottom, left:right]
+    dist_squared = (y_coords - roi.center_y) ** 2 + (x_coords - roi.center_x) ** 2
+    ring = (dist_squared > (roi.radius * inner) ** 2) & (dist_squared <= (roi.radius * outer) ** 2)
+    if mask is not None:
+        ring &= mask[top:bottom, left:right] == 0
+    selected_pixels = img_array[top:bottom, left:right][ring]
+    if selected_pixels.size == 0:
+        raise ValueError('Background annulus around the ROI has no background pixels; lower the Background radii.')
+    return float(np.median(selected_pixels))
+
+def annulus_correction(pixels: np.ndarray, img_array: np.ndarray, mask: np.ndarray, roi: Circle,
+                       inner: float=1.2, outer: float=1.6, **kwargs) -> np.ndarray:
+    corrected = pixels.astype(np.float32)
+    corrected -= annulus_background(img_array, mask, roi, inner, outer)
+    return corrected
+
+def flat_field_correction(pixels: np.ndarray, img_array: np.ndarray, window: tuple, model: BackgroundModel,
+                          **kwargs) -> np.ndarray:
+    if model.dark.shape != img_array.shape[:2]:
+        raise ValueError(f'Background model shape {model.dark.shape} does not match image shape {img_array.shape[:2]}.')
+    #Only the gathered ROI pixels are corrected, in place on their own buffer
+    box, disc = window
+    corrected = pixels.astype(np.float32)
+    corrected -= model.dark[box][disc]
+    corrected *= model.gain[box][disc]
+    return corrected
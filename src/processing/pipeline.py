@@ -0,0 +1,199 @@
+from collections import namedtuple
+from functools import partial
+from time import perf_counter
+from typing import Callable
+import numpy as np
+import cv2 as cv
+import src.processing.processing_functions as pf
+from src.images.bayesian import load_model
+
+#One entry of the configured graph: a unique name, a registered stage type and its [stage:<name>] options
+PipelineStage = namedtuple('PipelineStage', ['name', 'type', 'options'])
+StageType = namedtuple('StageType', ['kind', 'factory', 'histogram', 'rounding'])
+Plan = namedtuple('Plan', ['normalizer', 'masker', 'morphology', 'fitter', 'histogram', 'dtype'])
+
+#Stages run in this kind order: at most one normalize, exactly one mask, any morphology, exactly one fit
+KINDS = ('normalize', 'mask', 'morphology', 'fit')
+STAGE_TYPES: dict[str, StageType] = {}
+
+def register_stage(name: str, kind: str, histogram: bool=False, rounding: str='floor') -> Callable:
+    #Factories take (config, options, percentile=, rounding=) and return the stage callable, or None when it would do nothing.
+    #A mask's rounding is how native-precision levels must round for its comparison to match float64
+    if kind not in KINDS:
+        raise ValueError(f'Unknown stage kind {kind}.')
+    def register(factory: Callable) -> Callable:
+        STAGE_TYPES[name] = StageType(kind, factory, histogram, rounding)
+        return factory
+    return register
+
+def validate_stages(stages: list[PipelineStage]) -> None:
+    if not stages:
+        raise ValueError('Pipeline has no stages.')
+    names = set()
+    for stage in stages:
+        if stage.name in names:
+            raise ValueError(f'Pipeline stage {stage.name} is listed twice.')
+        names.add(stage.name)
+        if stage.type not in STAGE_TYPES:
+            raise ValueError(f'Pipeline stage {stage.name} has unknown type {stage.type}. '
+                             f'Available types: {", ".join(sorted(STAGE_TYPES))}.')
+    kinds = [STAGE_TYPES[stage.type].kind for stage in stages]
+    if [KINDS.index(kind) for kind in kinds] != sorted(KINDS.index(kind) for kind in kinds):
+        raise ValueError('Pipeline stages must run normalize, mask, morphology, then fit.')
+    if kinds.count('normalize') > 1:
+        raise ValueError('Pipeline may have at most one normalize stage.')
+    if kinds.count('mask') != 1:
+        raise ValueError('Pipeline must have exactly one mask stage.')
+    if kinds.count('fit') != 1:
+        raise ValueError('Pipeline must end with exactly one fit stage.')
+
+def compile_plan(stages: list[PipelineStage], config, observe: Callable=None) -> Plan:
+    #observe(stage_name, seconds) times every compiled stage; without it the stages run unwrapped
+    validate_stages(stages)
+    normalize = next((stage for stage in stages if STAGE_TYPES[stage.type].kind == 'normalize'), None)
+    percentile = float(normalize.options.get('percentile', config.normalization_percentile)) if normalize is not None else None
+    precision = normalize.options.get('precision', config.precision).lower() if normalize is not None else None
+    rounding = next(STAGE_TYPES[stage.type].rounding for stage in stages if STAGE_TYPES[stage.type].kind == 'mask')
+    built = {kind: [] for kind in KINDS}
+    histogram = False
+    for stage in stages:
+        stage_type = STAGE_TYPES[stage.type]
+        function = stage_type.factory(config, stage.options, percentile=percentile, rounding=rounding)
+        #No-op stages are dropped here so they cost nothing per image
+        if function is None:
+            continue
+        if observe is not None:
+            function = _timed(function, stage.name, observe)
+        built[stage_type.kind].append(function)
+        histogram = histogram or stage_type.histogram
+    return Plan(normalizer=built['normalize'][0] if built['normalize'] else None, masker=built['mask'][0],
+                morphology=tuple(built['morphology']), fitter=built['fit'][0], histogram=histogram,
+                dtype=pf.PRECISIONS[precision] if precision is not None else None)
+
+def _timed(function: Callable, name: str, observe: Callable) -> Callable:
+    def timed(*args, **kwargs):
+        started = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            observe(name, perf_counter() - started)
+    return timed
+
+def default_morphology() -> tuple[Callable, ...]:
+    #Scale the mask to 0/255, then a 5x5 open and close
+    return tuple(STAGE_TYPES[name].factory(None, {}) for name in ('scale', 'open', 'close'))
+
+def default_stages(config) -> list[PipelineStage]:
+    #The graph the individual [processing] and [roi] settings describe when no Stages are configured
+    stages = [PipelineStage('normalize', 'normalize', {})] if config.normalization else []
+    masking_method = config.masking_method.lower()
+    if masking_method == 'thresholding':
+        stages.append(PipelineStage('mask', 'threshold', {}))
+    elif masking_method == 'histogram k-means' or (masking_method == 'k-means' and config.tiled):
+        stages.append(PipelineStage('mask', 'histogram-k-means', {}))
+    elif masking_method in ('otsu', 'bayesian'):
+        stages.append(PipelineStage('mask', masking_method, {}))
+    else:
+        stages.append(PipelineStage('mask', 'k-means', {}))
+    stages += [PipelineStage('scale', 'scale', {}), PipelineStage('open', 'open', {}), PipelineStage('close', 'close', {})]
+    radius_method = config.radius_method.lower()
+    fitter = 'regions' if config.max_rois > 1 else radius_method if radius_method in ('contour', 'components') else 'eigenvalue'
+    if fitter != 'eigenvalue':
+        stages += [PipelineStage('distance', 'distance', {}), PipelineStage('eye_open', 'open', {}),
+                   PipelineStage('eye_close', 'close', {})]
+    stages.append(PipelineStage('fit', fitter, {'separate': 'False'} if fitter != 'eigenvalue' else {}))
+    return stages
+
+def _kernel(options: dict) -> np.ndarray | None:
+    size = int(options.get('kernel', 5))
+    return np.ones((size, size), np.uint8) if size > 1 else None
+
+@register_stage('normalize', 'normalize', histogram=True)
+def _normalize_stage(config, options: dict, percentile: float=None, rounding: str='floor', **kwargs) -> Callable:
+    precision = options.get('precision', config.precision).lower()
+    if precision not in pf.PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}.')
+    if precision == 'native':
+        return partial(pf.normalize_levels, percentile=percentile, rounding=rounding)
+    return partial(pf.normalize, percentile=percentile, dtype=pf.PRECISIONS[precision])
+
+#threshold_image keeps pixels strictly above an integer level; the histogram masks keep pixels at or above one
+@register_stage('threshold', 'mask', rounding='ceil')
+def _threshold_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.threshold_image, threshold=int(options.get('threshold', config.threshold_level)))
+
+@register_stage('k-means', 'mask')
+def _kmeans_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return pf.kmeans
+
+@register_stage('histogram-k-means', 'mask', histogram=True)
+def _kmeans_histogram_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.kmeans_histogram, percentile=percentile)
+
+@register_stage('otsu', 'mask', histogram=True)
+def _otsu_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.otsu_mask, percentile=percentile)
+
+@register_stage('bayesian', 'mask', histogram=True)
+def _bayesian_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    model = load_model(options.get('model_file', config.model_file))
+    return partial(pf.bayesian_mask, likelihood_true=model.likelihood_true, likelihood_false=model.likelihood_false,
+                   prior=model.prior, percentile=percentile)
+
+#Morphology stages write into the caller's preallocated uint8 buffer
+@register_stage('scale', 'morphology')
+def _scale_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    def scale(img_array: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+        return cv.normalize(img_array, dst=out, alpha=0, beta=255, norm_type=cv.NORM_MINMAX, dtype=cv.CV_8U)
+    return scale
+
+def _morphology_stage(operation: int, options: dict) -> Callable | None:
+    kernel = _kernel(options)
+    if kernel is None:
+        return None
+    iterations = int(options.get('iterations', 1))
+    def morphology(img_array: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+        return cv.morphologyEx(img_array, operation, kernel, dst=out, iterations=iterations)
+    return morphology
+
+@register_stage('open', 'morphology')
+def _open_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable | None:
+    return _morphology_stage(cv.MORPH_OPEN, options)
+
+@register_stage('close', 'morphology')
+def _close_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable | None:
+    return _morphology_stage(cv.MORPH_CLOSE, options)
+
+@register_stage('distance', 'morphology')
+def _distance_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    #Keeps pixels further than Distance from the background, separating the eye from thin attached structures
+    threshold = float(options.get('distance', 7))
+    buffers = {}
+    def distance(img_array: np.ndarray, out: np.ndarray=None) -> np.ndarray:
+        if buffers.get('shape') != img_array.shape:
+            buffers['shape'] = img_array.shape
+            buffers['distance'] = np.empty(img_array.shape, np.float32)
+        transformed = cv.distanceTransform(img_array, cv.DIST_L2, 5, dst=buffers['distance'])
+        cv.threshold(transformed, threshold, 1, cv.THRESH_BINARY, dst=transformed)
+        return cv.normalize(transformed, dst=out, alpha=0, beta=255, norm_type=cv.NORM_MINMAX, dtype=cv.CV_8U)
+    return distance
+
+def _separate(options: dict) -> bool:
+    return options.get('separate', 'True').lower() not in ('false', 'no', '0', 'off')
+
+@register_stage('contour', 'fit')
+def _contour_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.circle_params_contour, max_radius=config.max_radius, separate=_separate(options))
+
+@register_stage('components', 'fit')
+def _components_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.circle_params_components, max_radius=config.max_radius, separate=_separate(options))
+
+@register_stage('regions', 'fit')
+def _regions_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.circle_params_regions, max_radius=config.max_radius, separate=_separate(options),
+                   count=int(options.get('count', config.max_rois)), min_area=int(options.get('min_area', config.min_roi_area)))
+
+@register_stage('eigenvalue', 'fit')
+def _eigenvalue_stage(config, options: dict, percentile: float=None, **kwargs) -> Callable:
+    return partial(pf.circle_params_eigenvalue, max_radius=config.max_radius, center=options.get('center', config.center_method))
@@ -5,27 +5,252 @@ from collections import namedtuple
 
 Circle = namedtuple('Circle', ['center_y', 'center_x', 'radius'])
 
-def normalize(img_array, white_point:int, percentile: float, **kwargs) -> np.ndarray:
-    ubound = np.percentile(img_array, percentile)
-    return np.clip(img_array * (white_point / ubound), None, white_point)
+_KERNEL = np.ones((5, 5), np.uint8)
+
+#Per-ROI statistics beyond the mean; 'p<number>' selects any percentile.
+#With background correction every statistic except 'saturated' is taken on the corrected pixels
+ROI_STATISTICS = ('median', 'std', 'min', 'max', 'integrated_density', 'area', 'saturated')
+
+#Normalized intensity types: float64 (reference), float32, or integer levels from a lookup table
+PRECISIONS = {'float64': np.float64, 'float32': np.float32, 'native': np.uint16}
+
+def normalize(img_array, white_point:int, percentile: float, histogram: np.ndarray=None, out: np.ndarray=None,
+              dtype: np.dtype=np.float64, batch: bool=False, **kwargs) -> np.ndarray:
+    #batch marks a stack of frames from Processor.process_batch; any other array, 3-D included, is one image
+    if batch:
+        #One white point, histogram and upper bound per frame, scaled in one broadcast pass
+        if histogram is not None:
+            ubound = np.array([histogram_percentile(frame_histogram, percentile) for frame_histogram in histogram])
+        else:
+            ubound = np.percentile(img_array, percentile, axis=(1, 2))
+        white_point = np.asarray(white_point, dtype=np.float64).reshape(-1, 1, 1)
+        scale = white_point / ubound.reshape(-1, 1, 1)
+    else:
+        ubound = histogram_percentile(histogram, percentile) if histogram is not None else np.percentile(img_array, percentile)
+        scale = white_point / ubound
+    out = np.multiply(img_array, scale, out=out, dtype=dtype, casting='same_kind')
+    return np.clip(out, None, white_point, out=out)
+
+def normalize_levels(img_array, white_point: int, percentile: float, histogram: np.ndarray=None, out: np.ndarray=None,
+                     rounding: str='floor', batch: bool=False, **kwargs) -> np.ndarray:
+    #uint16 levels through a lookup table built with the float64 scale. Floor keeps '>= level' masks exact and ceil
+    #keeps '> level' masks exact, as thresholds are integer levels of the same floor-binned histogram
+    if img_array.dtype not in (np.uint8, np.uint16):
+        return normalize(img_array, white_point, percentile, histogram, out, dtype=np.float32, batch=batch)
+    if batch:
+        out = np.empty(img_array.shape, np.uint16) if out is None else out
+        white_points = np.broadcast_to(np.asarray(white_point), len(img_array))
+        for index, frame in enumerate(img_array):
+            normalize_levels(frame, int(white_points[index]), percentile, histogram[index] if histogram is not None else None,
+                             out[index], rounding)
+        return out
+    if histogram is None:
+        histogram = intensity_histogram(img_array)
+    scale = white_point / histogram_percentile(histogram, percentile)
+    levels = np.arange(histogram.size, dtype=np.float64) * scale
+    levels = np.floor(levels, out=levels) if rounding == 'floor' else np.ceil(levels, out=levels)
+    table = np.minimum(levels, white_point).astype(np.uint16)
+    #np.take widens its indices to intp, so map in row blocks to keep that copy small and in cache
+    out = np.empty(img_array.shape, np.uint16) if out is None else out
+    rows = max(1, (1 << 18) // max(img_array.shape[1], 1))
+    for top in range(0, img_array.shape[0], rows):
+        np.take(table, img_array[top:top + rows], out=out[top:top + rows], mode='clip')
+    return out
+
+def intensity_histogram(img_array: np.ndarray, **kwargs) -> np.ndarray | None:
+    if img_array.dtype not in (np.uint8, np.uint16):
+        return None
+    levels = np.iinfo(img_array.dtype).max + 1
+    if img_array.size >= 1 << 24 or img_array.ndim != 2:
+        return np.bincount(img_array.ravel(), minlength=levels)
+    #calcHist counts 2-D arrays in float32, which is exact below 2^24 pixels
+    return cv.calcHist([img_array], [0], None, [levels], [0, levels]).ravel().astype(np.int64)
+
+def histogram_percentile(histogram: np.ndarray, percentile: float) -> float:
+    #Matches np.percentile's linear interpolation between the two nearest ranks
+    cumulative = np.cumsum(histogram)
+    rank = (cumulative[-1] - 1) * percentile / 100
+    lower = math.floor(rank)
+    lower_value = np.searchsorted(cumulative, lower, side='right')
+    upper_value = np.searchsorted(cumulative, min(lower + 1, cumulative[-1] - 1), side='right')
+    return lower_value + (upper_value - lower_value) * (rank - lower)
+
+def normalized_histogram(histogram: np.ndarray, white_point: int, percentile: float) -> np.ndarray:
+    scale = white_point / histogram_percentile(histogram, percentile)
+    levels = np.minimum(np.arange(histogram.size) * scale, white_point).astype(np.intp)
+    return np.bincount(levels, weights=histogram, minlength=white_point + 1)
+
+def exact_mean(pixels: np.ndarray) -> float:
+    #Integer pixels are summed exactly in uint64, which equals the float64 mean without widening every element to 8 bytes
+    if pixels.size == 0:
+        return 0.0
+    if pixels.dtype.kind in 'ui':
+        return float(np.add.reduce(pixels, axis=None, dtype=np.uint64 if pixels.dtype.kind == 'u' else np.int64)) / pixels.size
+    return float(np.mean(pixels, dtype=np.float64))
+
+def is_roi_statistic(name: str) -> bool:
+    if name in ROI_STATISTICS:
+        return True
+    try:
+        return name.startswith('p') and 0 <= float(name[1:]) <= 100
+    except ValueError:
+        return False
+
+def histogram_statistics(histogram: np.ndarray, statistics: tuple[str, ...], white_point: int) -> dict[str, float]:
+    area = int(histogram.sum())
+    if area == 0:
+        return {name: 0.0 for name in statistics}
+    levels = np.arange(histogram.size, dtype=np.float64)
+    present = np.flatnonzero(histogram)
+    total = float(histogram @ levels)
+    values = {}
+    for name in statistics:
+        if name == 'median':
+            values[name] = histogram_percentile(histogram, 50)
+        elif name == 'std':
+            values[name] = math.sqrt(float(histogram @ (levels - total / area) ** 2) / area)
+        elif name == 'min':
+            values[name] = int(present[0])
+        elif name == 'max':
+            values[name] = int(present[-1])
+        elif name == 'integrated_density':
+            values[name] = total
+        elif name == 'area':
+            values[name] = area
+        elif name == 'saturated':
+            values[name] = int(histogram[white_point:].sum())
+        else:
+            values[name] = histogram_percentile(histogram, float(name[1:]))
+    return values
+
+def pixel_statistics(pixels: np.ndarray, statistics: tuple[str, ...], white_point: int) -> dict[str, float]:
+    #Integer pixels go through one bincount so every order statistic is a cumulative-sum lookup
+    if pixels.dtype in (np.uint8, np.uint16):
+        return histogram_statistics(np.bincount(pixels.ravel(), minlength=np.iinfo(pixels.dtype).max + 1),
+                                    statistics, white_point)
+    if pixels.size == 0:
+        return {name: 0.0 for name in statistics}
+    values = {}
+    for name in statistics:
+        if name == 'median':
+            values[name] = float(np.median(pixels))
+        elif name == 'std':
+            values[name] = float(np.std(pixels))
+        elif name == 'min':
+            values[name] = float(np.min(pixels))
+        elif name == 'max':
+            values[name] = float(np.max(pixels))
+        elif name == 'integrated_density':
+            values[name] = float(np.sum(pixels, dtype=np.float64))
+        elif name == 'area':
+            values[name] = pixels.size
+        elif name == 'saturated':
+            values[name] = int(np.count_nonzero(pixels >= white_point))
+        else:
+            values[name] = float(np.percentile(pixels, float(name[1:])))
+    return values
+
+def _masking_histogram(img_array: np.ndarray, white_point: int, histogram: np.ndarray, percentile: float) -> np.ndarray:
+    if histogram is None:
+        histogram = intensity_histogram(img_array)
+        if histogram is None:
+            histogram, _ = np.histogram(img_array, bins=white_point + 1, range=(0, white_point + 1))
+    elif percentile is not None:
+        histogram = normalized_histogram(histogram, white_point, percentile)
+    return histogram
+
+def otsu_threshold(histogram: np.ndarray) -> int:
+    levels = np.arange(histogram.size)
+    lower_weight = np.cumsum(histogram, dtype=np.float64)
+    upper_weight = lower_weight[-1] - lower_weight
+    lower_sum = np.cumsum(histogram * levels, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = lower_weight * upper_weight * (lower_sum / lower_weight - (lower_sum[-1] - lower_sum) / upper_weight) ** 2
+    #Lowest intensity of the foreground class
+    return int(np.argmax(np.nan_to_num(between))) + 1
+
+def bayesian_threshold(histogram: np.ndarray, likelihood_true: np.ndarray, likelihood_false: np.ndarray,
+                       prior: float, iterations: int=10) -> int:
+    bins = min(histogram.size, likelihood_true.size)
+    histogram = histogram[:bins]
+    likelihood_true, likelihood_false = likelihood_true[:bins], likelihood_false[:bins]
+    total = histogram.sum()
+    #Re-estimate the foreground prior for this image from its own histogram
+    for _ in range(iterations):
+        joint_true = prior * likelihood_true
+        evidence = joint_true + (1 - prior) * likelihood_false
+        posterior = np.divide(joint_true, evidence, out=np.zeros(bins), where=evidence > 0)
+        prior = float((histogram * posterior).sum() / total) if total > 0 else prior
+    background_peak = int(np.argmax((1 - prior) * likelihood_false))
+    foreground = np.flatnonzero(prior * likelihood_true[background_peak:] > (1 - prior) * likelihood_false[background_peak:])
+    return background_peak + int(foreground[0]) if foreground.size else bins
+
+def otsu_mask(img_array: np.ndarray, white_point: int, histogram: np.ndarray=None, percentile: float=None, **kwargs) -> np.ndarray:
+    histogram = _masking_histogram(img_array, white_point, histogram, percentile)
+    return (img_array >= otsu_threshold(histogram)).view(np.uint8)
+
+def bayesian_mask(img_array: np.ndarray, white_point: int, likelihood_true: np.ndarray, likelihood_false: np.ndarray,
+                  prior: float, histogram: np.ndarray=None, percentile: float=None, **kwargs) -> np.ndarray:
+    histogram = _masking_histogram(img_array, white_point, histogram, percentile)
+    threshold = bayesian_threshold(histogram, likelihood_true, likelihood_false, prior)
+    return (img_array >= threshold).view(np.uint8)
 
 def kmeans(img_array: np.ndarray, **kwargs) -> np.ndarray:
     flattened = np.float32(img_array.flatten())
     criteria = (cv.TERM_CRITERIA_EPS + cv.TERM_CRITERIA_MAX_ITER, 10, 1.0)
     ret, label, center = cv.kmeans(flattened, 2, None, criteria, 15, cv.KMEANS_RANDOM_CENTERS)
-    return center[label.flatten()].reshape(img_array.shape)
+    #Foreground is the brighter cluster, as a 0/1 mask like every other masker
+    return (label.ravel() == int(np.argmax(center))).view(np.uint8).reshape(img_array.shape)
+
+def kmeans_histogram(img_array: np.ndarray, white_point: int=None, histogram: np.ndarray=None, percentile: float=None,
+                     bins: int=4096, max_iter: int=100, **kwargs) -> np.ndarray:
+    if histogram is not None and white_point is not None:
+        hist = _masking_histogram(img_array, white_point, histogram, percentile)
+        #Raw levels sit on their bin; normalized intensities are floor-binned, so they average to the bin middle
+        centers = np.arange(hist.size) + (0.5 if percentile is not None else 0.0)
+    else:
+        low, high = float(np.min(img_array)), float(np.max(img_array))
+        if high <= low:
+            return np.zeros(img_array.shape, np.uint8)
+        hist, edges = np.histogram(img_array, bins=bins, range=(low, high))
+        centers = (edges[:-1] + edges[1:]) / 2
+    return (img_array > _kmeans_threshold(hist, centers, max_iter)).view(np.uint8)
+
+def _kmeans_threshold(hist: np.ndarray, centers: np.ndarray, max_iter: int) -> float:
+    weighted = np.cumsum(hist * centers)
+    counts = np.cumsum(hist)
+    #Deterministic initialisation at the lowest and highest occupied bins; a 16-bit histogram is mostly empty
+    occupied = np.flatnonzero(hist)
+    if occupied.size == 0:
+        return centers[-1]
+    low_center, high_center = centers[occupied[0]], centers[occupied[-1]]
+    for _ in range(max_iter):
+        split = np.searchsorted(centers, (low_center + high_center) / 2, side='right') - 1
+        low_count, high_count = counts[split], counts[-1] - counts[split]
+        if low_count == 0 or high_count == 0:
+            break
+        new_low = weighted[split] / low_count
+        new_high = (weighted[-1] - weighted[split]) / high_count
+        if new_low == low_center and new_high == high_center:
+            break
+        low_center, high_center = new_low, new_high
+    return (low_center + high_center) / 2
 
 def threshold_image(img_array: np.ndarray, threshold: int, **kwargs) -> np.ndarray:
-    return np.where(img_array > threshold, 1, 0)
+    return (img_array > threshold).view(np.uint8)
 
-def circle_params_contour(img_array: np.ndarray, img_scaling: float, max_radius: int, **kwargs) -> Circle:
+def separate_eye(img_array: np.ndarray) -> np.ndarray:
     #Distance Transform
     img_array = cv.distanceTransform(img_array, cv.DIST_L2, 5)
     img_array = np.where(img_array > 7, 1, 0)
     img_array = cv.normalize(img_array, dst = None, alpha = 0, beta = 255,
                                  norm_type = cv.NORM_MINMAX, dtype = cv.CV_8U)
-    img_array = cv.morphologyEx(img_array, cv.MORPH_OPEN, np.ones((5, 5), np.uint8))
-    img_array = cv.morphologyEx(img_array, cv.MORPH_CLOSE, np.ones((5, 5), np.uint8))
+    img_array = cv.morphologyEx(img_array, cv.MORPH_OPEN, _KERNEL)
+    return cv.morphologyEx(img_array, cv.MORPH_CLOSE, _KERNEL)
+
+def circle_params_contour(img_array: np.ndarray, img_scaling: float, max_radius: int, separate: bool=True, **kwargs) -> Circle:
+    if separate:
+        img_array = separate_eye(img_array)
 
     #Contour Fitting
     contours, _ = cv.findContours(img_array, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
@@ -51,21 +276,76 @@ def circle_params_contour(img_array: np.ndarray, img_scaling: float, max_radius:
     radius = min(minor // 2, max_radius // img_scaling)
     return Circle(center_y, center_x, radius)
 
-def circle_params_eigenvalue(img_array: np.ndarray, img_scaling: float, max_radius: int, **kwargs) -> Circle:
-    y_coords, x_coords = np.where(img_array > 0)
-    #Estimate center with median
-    center_y = np.partition(y_coords, y_coords.size // 2)[y_coords.size // 2]
-    center_x = np.partition(x_coords, x_coords.size // 2)[x_coords.size // 2]
-
-    #Recenter data to (0,0)
-    recentered_y = y_coords - center_y
-    recentered_x = x_coords - center_x
-
-    #Covariance matrix and eigenvalues to estimate radius
-    covar_matrix = np.cov(np.vstack((recentered_y, recentered_x)))
-    eigenvalues = np.linalg.eigvals(covar_matrix)
-    min_eigenvalue = min(eigenvalues[0], eigenvalues[1])
-    est_radius =  2 * math.sqrt(min_eigenvalue)
+def circle_params_components(img_array: np.ndarray, img_scaling: float, max_radius: int, separate: bool=True,
+                             **kwargs) -> Circle:
+    return circle_params_regions(img_array, img_scaling, max_radius, count=1, min_area=0, separate=separate)[0]
+
+def circle_params_regions(img_array: np.ndarray, img_scaling: float, max_radius: int, count: int=1,
+                          min_area: int=0, separate: bool=True, **kwargs) -> list[Circle]:
+    if separate:
+        img_array = separate_eye(img_array)
+
+    #Largest Components, sharing one mask and one labelling pass
+    total, labels, stats, _ = cv.connectedComponentsWithStats(img_array, connectivity=8)
+    areas = stats[1:, cv.CC_STAT_AREA]
+    circles = []
+    for index in 1 + np.argsort(-areas, kind='stable'):
+        if len(circles) >= count or stats[index, cv.CC_STAT_AREA] < min_area:
+            break
+        circle = _component_circle(labels, stats, int(index), img_scaling, max_radius)
+        if circle is not None:
+            circles.append(circle)
+    if not circles:
+        return [Circle(center_y=img_array.shape[0] // 2,
+                       center_x=img_array.shape[1] // 2,
+                       radius=1)]
+    return circles
+
+def _component_circle(labels: np.ndarray, stats: np.ndarray, index: int, img_scaling: float, max_radius: int) -> Circle | None:
+    x, y, width, height = stats[index, :4]
+
+    #Boundary of this component only
+    component = (labels[y:y + height, x:x + width] == index).view(np.uint8)
+    contours, _ = cv.findContours(component, cv.RETR_EXTERNAL, cv.CHAIN_APPROX_NONE)
+    boundary = max(contours, key=len)
+    if len(boundary) < 5:
+        return None
+
+    #Ellipse Fitting (calculate center)
+    ellipse = cv.fitEllipse(boundary)
+    center_x, center_y = ellipse[0]
+    major, minor = ellipse[1]
+
+    #Calculate Radius
+    radius = min(minor // 2, max_radius // img_scaling)
+    return Circle(float(center_y + y), float(center_x + x), radius)
+
+def _projected_median(counts: np.ndarray) -> int:
+    #Index of the middle foreground pixel along one axis, from per-row/column counts
+    cumulative = np.cumsum(counts)
+    return int(np.searchsorted(cumulative, cumulative[-1] // 2, side='right'))
+
+def circle_params_eigenvalue(img_array: np.ndarray, img_scaling: float, max_radius: int, center: str='median', **kwargs) -> Circle:
+    moments = cv.moments(img_array, binaryImage=True)
+    count = moments['m00']
+    if count < 2:
+        return Circle(center_y=img_array.shape[0] // 2,
+                      center_x=img_array.shape[1] // 2,
+                      radius=1)
+
+    #Estimate center with median (projected histograms) or mean (first moments)
+    if center.lower() == 'median':
+        center_y = _projected_median(np.count_nonzero(img_array, axis=1))
+        center_x = _projected_median(np.count_nonzero(img_array, axis=0))
+    else:
+        center_y = moments['m01'] / count
+        center_x = moments['m10'] / count
+
+    #Covariance matrix from central moments and its smaller eigenvalue to estimate radius
+    var_y = moments['mu02'] / (count - 1)
+    var_x = moments['mu20'] / (count - 1)
+    covar = moments['mu11'] / (count - 1)
+    min_eigenvalue = (var_y + var_x) / 2 - math.sqrt(((var_y - var_x) / 2) ** 2 + covar ** 2)
+    est_radius = 2 * math.sqrt(max(min_eigenvalue, 0.0))
     radius = min(est_radius, max_radius // img_scaling)
     return Circle(center_y, center_x, radius)
-
@@ -1,5 +1,13 @@
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+
+@dataclass
+class RoiResult:
+    center: tuple[int, int]
+    radius: int
+    mean_fluorescence: float
+    statistics: dict[str, float] = field(default_factory=dict)
+    background: float = 0.0
 
 @dataclass
 class FluorescenceResult:
@@ -8,4 +16,6 @@ class FluorescenceResult:
     binary_img: np.ndarray
     center: tuple[int, int]
     radius: int
-    mean_fluorescence: float
\ No newline at end of file
+    mean_fluorescence: float
+    confidence: float = 1.0
+    rois: list[RoiResult] = field(default_factory=list)
@@ -1,15 +1,32 @@
 import numpy as np
-import cv2 as cv
 from src.processing.processing_functions import Circle
-from src.processing.processing_result import FluorescenceResult
+import src.processing.processing_functions as pf
+from src.processing.pipeline import default_morphology
+from src.processing.processing_result import FluorescenceResult, RoiResult
 from src.images.image import BaseImage
 from typing import Callable
 
 class Processor:
-    def __init__(self, normalizer: Callable, masker: Callable, fitter: Callable):
+    def __init__(self, normalizer: Callable, masker: Callable, fitter: Callable, shared_histogram: bool=False,
+                 tracking: bool=False, tracking_margin: float=1.5, min_confidence: float=0.8,
+                 statistics: tuple[str, ...]=(), background: Callable=None, morphology: tuple[Callable, ...]=None,
+                 normalized_dtype: np.dtype=np.float64):
+        #Fitters may return a single Circle or a list of Circles ordered largest first
         self._normalizer = normalizer
         self._masker = masker
         self._fitter = fitter
+        self._morphology = morphology if morphology is not None else default_morphology()
+        self._normalized_dtype = normalized_dtype
+        self._shared_histogram = shared_histogram
+        self._tracking = tracking
+        self._tracking_margin = tracking_margin
+        self._min_confidence = min_confidence
+        self._statistics = statistics
+        self._background = background
+        self._previous = None
+        self._stack = None
+        self._normalized = None
+        self._fitting = [None, None]
 
     def circular_mean_fluorescence(self, img_array: np.ndarray, scaling: float, white_point: int) -> (float, Circle):
         processed_img = self.process(img_array, white_point)
@@ -17,23 +34,130 @@ class Processor:
         return mean_intensity(img_array, params), params
 
     def process(self, img: BaseImage) -> FluorescenceResult:
-        processed_img = np.copy(img.array)
-        binary_img = self.binary_mask(img)
-        fitting_img = cv.normalize(binary_img, dst=None, alpha=0, beta=255,
-                                     norm_type=cv.NORM_MINMAX, dtype=cv.CV_8U)
-        fitting_img = cv.morphologyEx(fitting_img, cv.MORPH_OPEN, np.ones((5, 5), np.uint8))
-        fitting_img = cv.morphologyEx(fitting_img, cv.MORPH_CLOSE, np.ones((5, 5), np.uint8))
-        params = self._fitter(fitting_img, white_point=img.white_point, img_scaling=img.scaling)
-        mean_fluorescence = mean_intensity(img.array, params)
+        circles = None
+        histogram = pf.intensity_histogram(img.array) if self._shared_histogram else None
+        if self._tracking and self._previous is not None:
+            params, confidence, binary_img = self._track(img, self._previous, histogram)
+            circles = [params] if params is not None else None
+        if circles is None:
+            binary_img = self._mask_array(img.array, img.white_point, img.scaling, histogram)
+            circles, fitting_img = self._fit(binary_img, img.white_point, img.scaling)
+            confidence = roi_coverage(fitting_img, circles[0])
+        if self._tracking:
+            self._previous = circles[0] if confidence >= self._min_confidence else None
+        return self._result(img, circles, binary_img, confidence)
+
+    def process_batch(self, images: list[BaseImage]) -> list[FluorescenceResult]:
+        #Tracking chains each frame to the previous result, and only same-shaped frames can share a stack
+        if len(images) <= 1 or self._tracking or images[0].array.ndim != 2 or \
+                len({(img.array.shape, img.array.dtype) for img in images}) > 1:
+            return [self.process(img) for img in images]
+        histograms = [pf.intensity_histogram(img.array) for img in images] if self._shared_histogram else None
+        if histograms is not None and any(histogram is None for histogram in histograms):
+            histograms = None
+        processed = [img.array for img in images]
+        if self._normalizer is not None:
+            #Normalization runs once over the whole stack with per-frame bounds
+            stack = self._batch_buffer('_stack', (len(images),) + images[0].array.shape, images[0].array.dtype)
+            for index, img in enumerate(images):
+                stack[index] = img.array
+            normalized = self._batch_buffer('_normalized', stack.shape, self._normalized_dtype)
+            processed = self._normalizer(stack, white_point=[img.white_point for img in images],
+                                         scaling=[img.scaling for img in images], histogram=histograms, out=normalized,
+                                         batch=True)
+        results = []
+        for index, img in enumerate(images):
+            binary_img = self._masker(processed[index], white_point=img.white_point, img_scaling=img.scaling,
+                                      histogram=histograms[index] if histograms is not None else None)
+            circles, fitting_img = self._fit(binary_img, img.white_point, img.scaling)
+            results.append(self._result(img, circles, binary_img, roi_coverage(fitting_img, circles[0])))
+        return results
+
+    def _batch_buffer(self, name: str, shape: tuple, dtype: np.dtype) -> np.ndarray:
+        #Stacks are reused between batches of the same shape instead of being reallocated
+        buffer = getattr(self, name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = np.empty(shape, dtype=dtype)
+            setattr(self, name, buffer)
+        return buffer
+
+    def _fitting_buffer(self, index: int, shape: tuple) -> np.ndarray:
+        buffer = self._fitting[index]
+        if buffer is None or buffer.shape != shape:
+            buffer = self._fitting[index] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def _result(self, img: BaseImage, circles: list[Circle], binary_img: np.ndarray, confidence: float) -> FluorescenceResult:
+        rois = [self._measure(img, params, binary_img) for params in circles]
         return FluorescenceResult(normalized=True if self._normalizer is not None else False,
-                                writeable_img=processed_img, binary_img=binary_img, center=(params.center_y, params.center_x),
-                                radius=params.radius, mean_fluorescence=mean_fluorescence)
+                                writeable_img=img.array, binary_img=binary_img, center=rois[0].center,
+                                radius=rois[0].radius, mean_fluorescence=rois[0].mean_fluorescence,
+                                confidence=confidence, rois=rois)
+
+    def _measure(self, img: BaseImage, params: Circle, binary_img: np.ndarray) -> RoiResult:
+        #The ROI pixels are gathered once for the mean, the background correction and every extra statistic
+        window = roi_window(img.array.shape, params)
+        raw_pixels = selected_pixels = img.array[window[0]][window[1]]
+        background = 0.0
+        if self._background is not None and selected_pixels.size != 0:
+            raw_mean = pf.exact_mean(selected_pixels)
+            selected_pixels = self._background(selected_pixels, img_array=img.array, mask=binary_img, window=window, roi=params)
+            background = raw_mean - pf.exact_mean(selected_pixels)
+        mean_fluorescence = pf.exact_mean(selected_pixels)
+        statistics = {}
+        if self._statistics:
+            #Saturation describes the sensor, so it is counted on the raw pixels; the rest follow the corrected mean
+            sensor = ('saturated',) if 'saturated' in self._statistics and raw_pixels is not selected_pixels else ()
+            values = pf.pixel_statistics(selected_pixels, tuple(name for name in self._statistics if name not in sensor),
+                                         img.white_point)
+            if sensor:
+                values.update(pf.pixel_statistics(raw_pixels, sensor, img.white_point))
+            statistics = {name: values[name] for name in self._statistics}
+        return RoiResult(center=(params.center_y, params.center_x), radius=params.radius,
+                         mean_fluorescence=mean_fluorescence, statistics=statistics, background=background)
 
     def binary_mask(self, img: BaseImage):
-        processed_img = np.copy(img.array)
+        return self._mask_array(img.array, img.white_point, img.scaling)
+
+    def reset_tracking(self) -> None:
+        self._previous = None
+
+    def _mask_array(self, img_array: np.ndarray, white_point: int, scaling: float, histogram: np.ndarray=None) -> np.ndarray:
+        processed_img = img_array
+        if histogram is None and self._shared_histogram:
+            histogram = pf.intensity_histogram(img_array)
         if self._normalizer is not None:
-            processed_img = self._normalizer(processed_img, white_point=img.white_point, scaling=img.scaling)
-        return self._masker(processed_img, white_point=img.white_point, img_scaling=img.scaling)
+            processed_img = self._normalizer(processed_img, white_point=white_point, scaling=scaling, histogram=histogram)
+        return self._masker(processed_img, white_point=white_point, img_scaling=scaling, histogram=histogram)
+
+    def _fit(self, binary_img: np.ndarray, white_point: int, scaling: float) -> (list[Circle], np.ndarray):
+        #Morphology stages alternate between two reused buffers; the fitting image is only valid until the next fit
+        fitting_img = binary_img
+        for index, stage in enumerate(self._morphology):
+            fitting_img = stage(fitting_img, out=self._fitting_buffer(index % 2, binary_img.shape[:2]))
+        params = self._fitter(fitting_img, white_point=white_point, img_scaling=scaling)
+        return (params if isinstance(params, list) else [params]), fitting_img
+
+    def _track(self, img: BaseImage, previous: Circle, histogram: np.ndarray=None) -> (Circle | None, float, np.ndarray | None):
+        #Search a window around the previous ROI; returning no circle falls back to a full-frame fit.
+        #The window is normalized and masked with the full frame's histogram, so levels match a full-frame fit
+        height, width = img.array.shape[:2]
+        half = int(previous.radius * self._tracking_margin) + 1
+        top, left = max(int(previous.center_y) - half, 0), max(int(previous.center_x) - half, 0)
+        bottom, right = min(int(previous.center_y) + half + 1, height), min(int(previous.center_x) + half + 1, width)
+        binary_window = self._mask_array(img.array[top:bottom, left:right], img.white_point, img.scaling, histogram)
+        circles, fitting_window = self._fit(binary_window, img.white_point, img.scaling)
+        params = circles[0]
+        inside = (params.center_y - params.radius >= 0 or top == 0) and \
+                 (params.center_y + params.radius <= bottom - top or bottom == height) and \
+                 (params.center_x - params.radius >= 0 or left == 0) and \
+                 (params.center_x + params.radius <= right - left or right == width)
+        confidence = roi_coverage(fitting_window, params) if inside else 0.0
+        if confidence < self._min_confidence:
+            return None, confidence, None
+        binary_img = np.zeros((height, width), dtype=binary_window.dtype)
+        binary_img[top:bottom, left:right] = binary_window
+        return Circle(params.center_y + top, params.center_x + left, params.radius), confidence, binary_img
 
     def circular_roi(self, img: BaseImage):
         results = self.process(img)
@@ -43,9 +167,25 @@ class Processor:
         mask = dist_squared <= results.radius ** 2
         return np.where(mask, 255, 0)
 
-def mean_intensity(img_array: np.ndarray, roi: Circle) -> float:
-    y_coords, x_coords = np.ogrid[:img_array.shape[0], :img_array.shape[1]]
+def roi_window(shape: tuple, roi: Circle) -> ((slice, slice), np.ndarray):
+    #Bounding box of the disc and the disc mask within it, so several ROIs per image stay cheap
+    top, left = max(int(roi.center_y - roi.radius), 0), max(int(roi.center_x - roi.radius), 0)
+    bottom = min(int(roi.center_y + roi.radius) + 1, shape[0])
+    right = min(int(roi.center_x + roi.radius) + 1, shape[1])
+    y_coords, x_coords = np.ogrid[top:bottom, left:right]
     dist_squared = (y_coords - roi.center_y) ** 2 + (x_coords - roi.center_x) ** 2
-    mask = dist_squared <= roi.radius ** 2
-    selected_pixels = img_array[mask]
+    return (slice(top, bottom), slice(left, right)), dist_squared <= roi.radius ** 2
+
+def roi_coverage(mask: np.ndarray, roi: Circle) -> float:
+    #Fraction of the ROI disc that lies on foreground in the fitting mask
+    box, disc = roi_window(mask.shape, roi)
+    total = np.count_nonzero(disc)
+    return float(np.count_nonzero(mask[box][disc]) / total) if total > 0 else 0.0
+
+def roi_pixels(img_array: np.ndarray, roi: Circle) -> np.ndarray:
+    box, disc = roi_window(img_array.shape, roi)
+    return img_array[box][disc]
+
+def mean_intensity(img_array: np.ndarray, roi: Circle) -> float:
+    selected_pixels = roi_pixels(img_array, roi)
     return np.mean(selected_pixels) if selected_pixels.size != 0 else 0.0
\ No newline at end of file
@@ -0,0 +1,76 @@
+import pickle
+import sqlite3
+from dataclasses import replace
+from hashlib import blake2b
+from pathlib import Path
+from src.processing.processing_result import FluorescenceResult
+
+class ResultCache:
+    def __init__(self, path: Path, fingerprint: str, fast_hash: bool=False, hash_bytes: int=1 << 20):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._fingerprint = fingerprint
+        self._fast_hash = fast_hash
+        self._hash_bytes = hash_bytes
+        self._hits = 0
+        self._misses = 0
+        self._connection = sqlite3.connect(path)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS results (path TEXT, fingerprint TEXT, size INTEGER, '
+                                 'mtime INTEGER, digest TEXT, result BLOB, PRIMARY KEY (path, fingerprint))')
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    @property
+    def hit_rate(self) -> float:
+        total = self._hits + self._misses
+        return self._hits / total if total > 0 else 0.0
+
+    def get(self, img_path: Path) -> FluorescenceResult | None:
+        stat = img_path.stat()
+        row = self._connection.execute('SELECT size, mtime, digest, result FROM results WHERE path=? AND fingerprint=?',
+                                       (str(img_path.resolve()), self._fingerprint)).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns or \
+                (self._fast_hash and row[2] != self._digest(img_path, stat.st_size)):
+            self._misses += 1
+            return None
+        self._hits += 1
+        return pickle.loads(row[3])
+
+    def put(self, img_path: Path, result: FluorescenceResult) -> None:
+        stat = img_path.stat()
+        digest = self._digest(img_path, stat.st_size) if self._fast_hash else ''
+        stored = replace(result, writeable_img=None, binary_img=None)
+        self._connection.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                                 (str(img_path.resolve()), self._fingerprint, stat.st_size, stat.st_mtime_ns,
+                                  digest, pickle.dumps(stored, protocol=pickle.HIGHEST_PROTOCOL)))
+        self._connection.commit()
+
+    def report(self) -> str:
+        return f'Result cache: {self._hits} hits, {self._misses} misses ({self.hit_rate * 100:.1f}% hit rate)'
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _digest(self, img_path: Path, size: int) -> str:
+        hasher = blake2b(digest_size=16)
+        with open(img_path, 'rb') as file:
+            hasher.update(file.read(self._hash_bytes))
+            if size > self._hash_bytes:
+                file.seek(max(size - self._hash_bytes, self._hash_bytes))
+                hasher.update(file.read(self._hash_bytes))
+        return hasher.hexdigest()
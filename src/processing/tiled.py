@@ -0,0 +1,186 @@
+import math
+import numpy as np
+import cv2 as cv
+from typing import Callable
+from src.images.image import BaseImage
+from src.images.tiles import TileSource
+from src.processing.processing_functions import Circle
+from src.processing.processing_result import FluorescenceResult, RoiResult
+import src.processing.processing_functions as pf
+
+#Two 5x5 open/close passes around an 8px distance threshold need 24px of context; round up
+HALO = 32
+
+class ComponentTable:
+    def __init__(self):
+        self._parent = []
+        self._moments = []
+
+    def add(self, moments: np.ndarray) -> int:
+        offset = len(self._parent)
+        self._parent.extend(range(offset, offset + len(moments)))
+        self._moments.append(moments)
+        return offset
+
+    def find(self, label: int) -> int:
+        root = label
+        while self._parent[root] != root:
+            root = self._parent[root]
+        while self._parent[label] != root:
+            self._parent[label], label = root, self._parent[label]
+        return root
+
+    def union(self, first: int, second: int) -> None:
+        first, second = self.find(first), self.find(second)
+        if first != second:
+            self._parent[max(first, second)] = min(first, second)
+
+    def largest(self, count: int=1) -> np.ndarray:
+        if not self._parent:
+            return np.zeros((0, 6))
+        roots = np.array([self.find(label) for label in range(len(self._parent))])
+        totals = np.zeros((len(self._parent), 6))
+        np.add.at(totals, roots, np.concatenate(self._moments))
+        return totals[np.argsort(-totals[:, 0], kind='stable')[:count]]
+
+class TiledProcessor:
+    def __init__(self, normalizer: Callable, masker: Callable, max_radius: int, tile_size: int=2048, halo: int=HALO,
+                 max_rois: int=1, min_roi_area: int=0, statistics: tuple[str, ...]=()):
+        self._normalizer = normalizer
+        self._masker = masker
+        self._max_radius = max_radius
+        self._max_rois = max_rois
+        self._min_roi_area = min_roi_area
+        self._statistics = statistics
+        self._tile_size = tile_size
+        self._halo = halo
+        self._kernel = np.ones((5, 5), np.uint8)
+
+    def process(self, img: BaseImage) -> FluorescenceResult:
+        tiles = img.array
+        try:
+            histogram = self._histogram(tiles)
+            circles = self._fit(tiles, histogram, img.white_point, img.scaling)
+            rois = [self._measure(tiles, params, img.white_point) for params in circles]
+        finally:
+            tiles.close()
+        return FluorescenceResult(normalized=True if self._normalizer is not None else False,
+                                  writeable_img=None, binary_img=None, center=rois[0].center,
+                                  radius=rois[0].radius, mean_fluorescence=rois[0].mean_fluorescence, rois=rois)
+
+    def _regions(self, tiles: TileSource, halo: int=0):
+        height, width = tiles.shape
+        for top in range(0, height, self._tile_size):
+            for left in range(0, width, self._tile_size):
+                bottom, right = min(top + self._tile_size, height), min(left + self._tile_size, width)
+                yield (top, bottom, left, right), (max(top - halo, 0), min(bottom + halo, height),
+                                                   max(left - halo, 0), min(right + halo, width))
+
+    def _histogram(self, tiles: TileSource) -> np.ndarray | None:
+        histogram = None
+        for _, (top, bottom, left, right) in self._regions(tiles):
+            tile_histogram = pf.intensity_histogram(np.ascontiguousarray(tiles.read(top, bottom, left, right)))
+            if tile_histogram is None:
+                return None
+            histogram = tile_histogram if histogram is None else histogram + tile_histogram
+        return histogram
+
+    def _eye_mask(self, tile: np.ndarray, histogram: np.ndarray, white_point: int, scaling: float) -> np.ndarray:
+        processed = tile
+        if self._normalizer is not None:
+            processed = self._normalizer(tile, white_point=white_point, scaling=scaling, histogram=histogram)
+        binary = self._masker(processed, white_point=white_point, img_scaling=scaling, histogram=histogram)
+        #Per-tile min/max normalization would be wrong for uniform tiles, so scale the 0/1 mask directly
+        fitting = (binary > 0).astype(np.uint8) * 255
+        fitting = cv.morphologyEx(fitting, cv.MORPH_OPEN, self._kernel)
+        fitting = cv.morphologyEx(fitting, cv.MORPH_CLOSE, self._kernel)
+        distance = cv.distanceTransform(fitting, cv.DIST_L2, 5)
+        eye = (distance > 7).astype(np.uint8) * 255
+        eye = cv.morphologyEx(eye, cv.MORPH_OPEN, self._kernel)
+        return cv.morphologyEx(eye, cv.MORPH_CLOSE, self._kernel)
+
+    def _fit(self, tiles: TileSource, histogram: np.ndarray, white_point: int, scaling: float) -> list[Circle]:
+        height, width = tiles.shape
+        table = ComponentTable()
+        above = np.full(width, -1, dtype=np.int64)
+        below = np.full(width, -1, dtype=np.int64)
+        left_edge = None
+        for (top, bottom, left, right), (halo_top, halo_bottom, halo_left, halo_right) in self._regions(tiles, self._halo):
+            if left == 0 and top > 0:
+                above, below = below, above
+            tile = np.ascontiguousarray(tiles.read(halo_top, halo_bottom, halo_left, halo_right))
+            eye = self._eye_mask(tile, histogram, white_point, scaling)
+            core = np.ascontiguousarray(eye[top - halo_top:bottom - halo_top, left - halo_left:right - halo_left])
+            count, labels = cv.connectedComponents(core, connectivity=8)
+            y_coords, x_coords = np.indices(core.shape, dtype=np.float64)
+            y_coords += top
+            x_coords += left
+            flat = labels.ravel()
+            moments = np.stack([np.bincount(flat, weights=weights, minlength=count)
+                                for weights in (None, x_coords.ravel(), y_coords.ravel(), (x_coords ** 2).ravel(),
+                                                (y_coords ** 2).ravel(), (x_coords * y_coords).ravel())], axis=1)[1:]
+            offset = table.add(moments) - 1
+            global_labels = np.where(labels > 0, labels.astype(np.int64) + offset, -1)
+            #Merge with components touching this tile from above (including diagonals) and from the left
+            for shift in (-1, 0, 1):
+                if top > 0:
+                    start, stop = max(-(left + shift), 0), min(right - left, width - (left + shift))
+                    self._merge(table, global_labels[0, start:stop], above[left + shift + start:left + shift + stop])
+                if left > 0:
+                    start, stop = max(-shift, 0), min(bottom - top, bottom - top - shift)
+                    self._merge(table, global_labels[start:stop, 0], left_edge[start + shift:stop + shift])
+            below[left:right] = global_labels[-1]
+            left_edge = global_labels[:, -1].copy()
+        circles = [self._moment_circle(totals, scaling) for totals in table.largest(self._max_rois)
+                   if totals[0] >= max(self._min_roi_area, 5)]
+        if not circles:
+            return [Circle(center_y=height // 2, center_x=width // 2, radius=1)]
+        return circles
+
+    def _moment_circle(self, totals: np.ndarray, scaling: float) -> Circle:
+        #Ellipse of a component from its accumulated moments
+        area, sum_x, sum_y, sum_xx, sum_yy, sum_xy = totals
+        center_x, center_y = sum_x / area, sum_y / area
+        var_x = sum_xx / area - center_x ** 2
+        var_y = sum_yy / area - center_y ** 2
+        covar = sum_xy / area - center_x * center_y
+        min_eigenvalue = (var_x + var_y) / 2 - math.sqrt(((var_x - var_y) / 2) ** 2 + covar ** 2)
+        radius = min(2 * math.sqrt(max(min_eigenvalue, 0.0)), self._max_radius // scaling)
+        return Circle(center_y, center_x, radius)
+
+    @staticmethod
+    def _merge(table: ComponentTable, current: np.ndarray, neighbour: np.ndarray) -> None:
+        touching = (current >= 0) & (neighbour >= 0)
+        for first, second in set(zip(current[touching].tolist(), neighbour[touching].tolist())):
+            table.union(first, second)
+
+    def _measure(self, tiles: TileSource, roi: Circle, white_point: int) -> RoiResult:
+        #Integer tiles accumulate one histogram for the statistics; other dtypes keep the ROI pixels
+        height, width = tiles.shape
+        top, bottom = max(int(roi.center_y - roi.radius), 0), min(int(roi.center_y + roi.radius) + 1, height)
+        left, right = max(int(roi.center_x - roi.radius), 0), min(int(roi.center_x + roi.radius) + 1, width)
+        total, count = 0.0, 0
+        integer = tiles.dtype in (np.uint8, np.uint16)
+        histogram = np.zeros(np.iinfo(tiles.dtype).max + 1, dtype=np.int64) if self._statistics and integer else None
+        pixels = []
+        for row in range(top, bottom, self._tile_size):
+            row_end = min(row + self._tile_size, bottom)
+            for column in range(left, right, self._tile_size):
+                column_end = min(column + self._tile_size, right)
+                y_coords, x_coords = np.ogrid[row:row_end, column:column_end]
+                disc = (y_coords - roi.center_y) ** 2 + (x_coords - roi.center_x) ** 2 <= roi.radius ** 2
+                selected = tiles.read(row, row_end, column, column_end)[disc]
+                total += float(np.sum(selected, dtype=np.float64))
+                count += selected.size
+                if histogram is not None:
+                    histogram += np.bincount(selected, minlength=histogram.size)
+                elif self._statistics:
+                    pixels.append(selected)
+        if histogram is not None:
+            statistics = pf.histogram_statistics(histogram, self._statistics, white_point)
+        elif self._statistics:
+            statistics = pf.pixel_statistics(np.concatenate(pixels) if pixels else np.zeros(0), self._statistics, white_point)
+        else:
+            statistics = {}
+        return RoiResult(center=(roi.center_y, roi.center_x), radius=roi.radius,
+                         mean_fluorescence=total / count if count > 0 else 0.0, statistics=statistics)
@@ -0,0 +1,38 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from src.engine.config import Config
+from src.images.image import TiffImage
+from src.processing.background import annulus_background
+from src.processing.processing_functions import Circle
+
+WHITE_POINT = 4095
+
+def _image() -> np.ndarray:
+    img = np.full((512, 512), 300, np.uint16)
+    y_coords, x_coords = np.ogrid[:512, :512]
+    img[(y_coords - 256) ** 2 + (x_coords - 256) ** 2 < 80 ** 2] = 2500
+    img[250:270, 250:270] = WHITE_POINT
+    return img
+
+def _process(masking_method: str):
+    config = Config.from_dict({'images': {'White_Point': str(WHITE_POINT), 'Scaling': '1'},
+                               'processing': {'Masking_Method': masking_method, 'Background': 'Annulus',
+                                              'ROI_Statistics': 'saturated, max', 'Radius_Method': 'Components'}})
+    image = TiffImage(Path('synthetic.tif'), scaling=1, white_point=WHITE_POINT, reader=lambda _: _image())
+    return config.create_processor().process(image)
+
+def test_annulus_background_is_the_same_for_every_masker():
+    for masking_method in ('Thresholding', 'Otsu', 'K-Means', 'Histogram K-Means'):
+        roi = _process(masking_method).rois[0]
+        assert roi.background == pytest.approx(300.0), masking_method
+
+def test_saturation_is_counted_before_correction():
+    roi = _process('Thresholding').rois[0]
+    assert roi.statistics['saturated'] == 400
+    assert roi.statistics['max'] == pytest.approx(WHITE_POINT - 300.0)
+
+def test_empty_annulus_raises():
+    img = np.full((64, 64), 500, np.uint16)
+    with pytest.raises(ValueError):
+        annulus_background(img, np.ones(img.shape, np.uint8), Circle(32, 32, 10))
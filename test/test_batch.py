@@ -0,0 +1,37 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from src.engine.config import Config
+from src.images.image import TiffImage
+import src.processing.processing_functions as pf
+
+WHITE_POINT = 4095
+
+def _image(seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    img = rng.normal(300, 60, (384, 384)).clip(0, WHITE_POINT).astype(np.uint16)
+    y_coords, x_coords = np.ogrid[:384, :384]
+    img[(y_coords - 180 - 10 * seed) ** 2 + (x_coords - 200) ** 2 < (90 + 5 * seed) ** 2] += 1800 + 200 * seed
+    return img
+
+@pytest.mark.parametrize('precision', ['Float64', 'Float32', 'Native'])
+@pytest.mark.parametrize('masking_method', ['Thresholding', 'Otsu', 'Histogram K-Means'])
+def test_batch_matches_single_images(precision, masking_method):
+    config = Config.from_dict({'images': {'White_Point': str(WHITE_POINT), 'Scaling': '1'},
+                               'processing': {'Precision': precision, 'Masking_Method': masking_method}})
+    images = [TiffImage(Path(f'frame{seed}.tif'), scaling=1, white_point=WHITE_POINT, reader=lambda _, seed=seed: _image(seed))
+              for seed in range(3)]
+    processor = config.create_processor(tracking=False)
+    batch = processor.process_batch(images)
+    for image, result in zip(images, batch):
+        single = processor.process(image)
+        assert result.center == single.center and result.radius == single.radius
+        assert result.mean_fluorescence == single.mean_fluorescence
+
+def test_three_dimensional_image_is_normalized_as_one():
+    #e.g. a single RGB or multi-plane TIFF: one upper bound for the whole array, not one per row
+    img = np.stack([_image(0), _image(1) // 2])
+    expected = np.minimum(img * (WHITE_POINT / np.percentile(img, 99.5)), WHITE_POINT)
+    assert np.allclose(pf.normalize(img, WHITE_POINT, 99.5), expected)
+    levels = pf.normalize_levels(img, WHITE_POINT, 99.5)
+    assert levels.shape == img.shape and np.abs(levels - expected).max() <= 1
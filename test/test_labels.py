@@ -0,0 +1,30 @@
+import csv
+import numpy as np
+import tifffile as tf
+from src.engine.config import Config
+from src.engine.main import ProcessingWorker
+from src.processing.processor import Processor
+
+def test_row_keeps_the_label_in_effect_when_its_image_was_dequeued(tmp_path, monkeypatch):
+    directory, output = tmp_path / 'images', tmp_path / 'output'
+    directory.mkdir()
+    img = np.full((128, 128), 200, np.uint16)
+    img[32:96, 32:96] = 3000
+    for index in range(4):
+        tf.imwrite(directory / f'img{index}.tiff', img)
+    config = Config.from_dict({'files': {'Directory': str(directory), 'Output_Directory': str(output), 'Write_Labels': 'True'},
+                               'images': {'Image_Format': 'TIFF', 'White_Point': '4095', 'Scaling': '1'},
+                               'processing': {'Check_Delay': '0'}})
+    worker = ProcessingWorker(config, live=False)
+    process = Processor.process
+    def relabel_while_processing(self, image):
+        #The user picks a new label while this image is still being processed
+        worker.set_label(f'after {image.name}')
+        return process(self, image)
+    monkeypatch.setattr(Processor, 'process', relabel_while_processing)
+    worker.run()
+    session, = output.glob('*.csv')
+    with open(session, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert len(rows) == 4
+    assert [row['label'] for row in rows] == [''] + [f'after {row["filename"]}' for row in rows[:-1]]
@@ -0,0 +1,81 @@
+import os
+from pathlib import Path
+import numpy as np
+import tifffile as tf
+from src.engine.config import Config
+from src.images.plane_cache import PlaneCache
+
+SHAPE = (64, 64)
+PLANE_BYTES = SHAPE[0] * SHAPE[1] * 2
+
+def _write(path: Path, value: int) -> Path:
+    tf.imwrite(path, np.full(SHAPE, value, np.uint16))
+    return path
+
+def _config(white_point: int) -> Config:
+    return Config.from_dict({'images': {'Image_Format': 'TIFF', 'White_Point': str(white_point), 'Scaling': '2.5'}})
+
+def test_hits_are_independent_of_later_evictions(tmp_path):
+    paths = [_write(tmp_path / f'{name}.tiff', value) for value, name in enumerate('abc', start=1)]
+    with PlaneCache(tmp_path / 'cache', max_bytes=2 * PLANE_BYTES + 100) as cache:
+        for path in paths[:2]:
+            cache.put(path, tf.imread(path))
+        held, metadata = cache.get(paths[0])
+        assert metadata is None and held[0, 0] == 1
+        #b is now the least recently used, so c takes its space
+        cache.put(paths[2], tf.imread(paths[2]))
+        assert cache.get(paths[1]) is None
+        assert cache.get(paths[0])[0][0, 0] == 1 and cache.get(paths[2])[0][0, 0] == 3
+        #a is evicted next and c's neighbour reuses its space; the plane handed out earlier keeps its pixels
+        cache.put(paths[1], tf.imread(paths[1]))
+        assert cache.get(paths[0]) is None
+        assert held[0, 0] == 1
+        assert cache.stored_bytes <= 2 * PLANE_BYTES
+        assert sum(path.stat().st_size for path in (tmp_path / 'cache').glob('segment-*.dat')) <= 2 * PLANE_BYTES
+
+def test_hits_are_read_only_views_of_the_map(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 9)
+    with PlaneCache(tmp_path / 'cache', max_bytes=2 ** 20) as cache:
+        cache.put(path, tf.imread(path))
+        first, second = cache.get(path)[0], cache.get(path)[0]
+        assert np.shares_memory(first, second) and not first.flags.owndata
+        assert not first.flags.writeable and first[0, 0] == 9
+
+def test_sparse_segments_are_compacted(tmp_path):
+    paths = [_write(tmp_path / f'{index}.tiff', index) for index in range(12)]
+    with PlaneCache(tmp_path / 'cache', max_bytes=4 * PLANE_BYTES) as cache:
+        for path in paths:
+            cache.put(path, tf.imread(path))
+        assert [cache.get(path)[0][0, 0] for path in paths[-4:]] == [8, 9, 10, 11]
+        stored = sum(path.stat().st_size for path in (tmp_path / 'cache').glob('segment-*.dat'))
+        assert stored <= 2 * 4 * PLANE_BYTES + PLANE_BYTES
+
+def test_changed_file_misses(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 1)
+    with PlaneCache(tmp_path / 'cache', max_bytes=2 ** 20) as cache:
+        cache.put(path, tf.imread(path))
+        assert cache.get(path) is not None
+        _write(path, 7)
+        stat = path.stat()
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        assert cache.get(path) is None
+        assert cache.hits == 1 and cache.misses == 1
+
+def test_hits_use_current_settings_and_cached_file_metadata(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 5)
+    with PlaneCache(tmp_path / 'cache', max_bytes=2 ** 20) as cache:
+        first = _config(4095).create_image(path, reader=tf.imread, plane_cache=cache)
+        second = _config(1000).create_image(path, reader=tf.imread, plane_cache=cache)
+        assert cache.hits == 1
+        assert first.white_point == 4095 and second.white_point == 1000 and second.scaling == 2.5
+        assert np.array_equal(first.array, second.array) and not second.array.flags.writeable
+        cache.put(path, first.array, (0.5, 16383))
+        plane, metadata = cache.get(path)
+        assert metadata == (0.5, 16383)
+
+def test_sessions_share_a_directory(tmp_path):
+    paths = [_write(tmp_path / f'{name}.tiff', value) for value, name in enumerate('ab', start=1)]
+    with PlaneCache(tmp_path / 'cache', max_bytes=2 ** 20) as first, PlaneCache(tmp_path / 'cache', max_bytes=2 ** 20) as second:
+        first.put(paths[0], tf.imread(paths[0]))
+        second.put(paths[1], tf.imread(paths[1]))
+        assert first.get(paths[1])[0][0, 0] == 2 and second.get(paths[0])[0][0, 0] == 1
@@ -0,0 +1,74 @@
+from pathlib import Path
+import numpy as np
+from src.engine.config import Config
+from src.images.image import TiffImage
+import src.processing.processing_functions as pf
+
+WHITE_POINT = 4095
+PERCENTILE = 99.5
+
+def _image(seed: int=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    img = rng.normal(300, 60, (768, 768)).clip(0, WHITE_POINT).astype(np.uint16)
+    y_coords, x_coords = np.ogrid[:768, :768]
+    img[(y_coords - 400) ** 2 + (x_coords - 350) ** 2 < 200 ** 2] += 2200
+    img[(y_coords - 120) ** 2 + (x_coords - 620) ** 2 < 60 ** 2] += 1500
+    return img
+
+def _config(precision: str, masking_method: str='Thresholding', max_rois: int=1) -> Config:
+    return Config.from_dict({'images': {'White_Point': str(WHITE_POINT), 'Scaling': '1'},
+                             'processing': {'Precision': precision, 'Masking_Method': masking_method,
+                                            'Normalization_Percentile': str(PERCENTILE),
+                                            'Max_ROIs': str(max_rois), 'Min_ROI_Area': '100'}})
+
+def test_exact_mean_matches_float64():
+    img = _image()
+    assert pf.exact_mean(img.ravel()) == np.mean(img, dtype=np.float64)
+    assert pf.exact_mean(img[:0].ravel()) == 0.0
+
+def test_native_levels_keep_masks_exact():
+    for seed in range(3):
+        img = _image(seed)
+        histogram = pf.intensity_histogram(img)
+        reference = pf.normalize(img, WHITE_POINT, PERCENTILE, histogram)
+        above = pf.normalize_levels(img, WHITE_POINT, PERCENTILE, histogram, rounding='ceil')
+        at_or_above = pf.normalize_levels(img, WHITE_POINT, PERCENTILE, histogram, rounding='floor')
+        assert above.dtype == np.uint16 and at_or_above.dtype == np.uint16
+        for level in (1, 1526, 2047, WHITE_POINT - 1, WHITE_POINT):
+            assert np.array_equal(reference > level, above > level)
+            assert np.array_equal(reference >= level, at_or_above >= level)
+
+def test_float32_normalize_close_to_float64():
+    img = _image()
+    histogram = pf.intensity_histogram(img)
+    reference = pf.normalize(img, WHITE_POINT, PERCENTILE, histogram)
+    single = pf.normalize(img, WHITE_POINT, PERCENTILE, histogram, dtype=np.float32)
+    assert single.dtype == np.float32
+    assert np.allclose(single, reference, rtol=1e-6, atol=1e-3)
+
+def test_processor_results_match_float64():
+    img = _image()
+    for masking_method in ('Thresholding', 'Otsu', 'Histogram K-Means'):
+        for max_rois in (1, 2):
+            results = {}
+            for precision in ('Float64', 'Float32', 'Native'):
+                processor = _config(precision, masking_method, max_rois).create_processor()
+                image = TiffImage(Path('synthetic.tif'), scaling=1, white_point=WHITE_POINT, reader=lambda _: img)
+                results[precision] = processor.process(image)
+            reference = results['Float64']
+            for precision in ('Float32', 'Native'):
+                assert len(results[precision].rois) == len(reference.rois)
+                for roi, expected in zip(results[precision].rois, reference.rois):
+                    assert np.allclose(roi.center, expected.center, atol=1e-6)
+                    assert roi.radius == expected.radius
+                    assert roi.mean_fluorescence == expected.mean_fluorescence
+
+def test_native_batch_matches_single_images():
+    images = [TiffImage(Path(f'frame{seed}.tif'), scaling=1, white_point=WHITE_POINT, reader=lambda _, seed=seed: _image(seed))
+              for seed in range(3)]
+    processor = _config('Native').create_processor()
+    batch = processor.process_batch(images)
+    for image, result in zip(images, batch):
+        single = processor.process(image)
+        assert result.center == single.center and result.radius == single.radius
+        assert result.mean_fluorescence == single.mean_fluorescence
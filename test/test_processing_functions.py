@@ -0,0 +1,100 @@
+import math
+from pathlib import Path
+import numpy as np
+import cv2 as cv
+import pytest
+from src.images.bayesian import Trainer
+from src.images.image import TiffImage
+import src.processing.processing_functions as pf
+
+WHITE_POINT = 4095
+
+def _eye(seed: int, shape: tuple[int, int]=(512, 512)) -> tuple[np.ndarray, np.ndarray]:
+    #Noisy background with a bright disc; returns the image and the disc
+    rng = np.random.default_rng(seed)
+    y_coords, x_coords = np.ogrid[:shape[0], :shape[1]]
+    disc = (y_coords - 250 - seed) ** 2 + (x_coords - 230 + 2 * seed) ** 2 < (120 + seed) ** 2
+    img = rng.normal(400, 80, shape)
+    img[disc] = rng.normal(2400, 300, np.count_nonzero(disc))
+    return img.clip(0, WHITE_POINT).astype(np.uint16), disc
+
+@pytest.mark.parametrize('seed', range(3))
+def test_histogram_kmeans_matches_cv_kmeans(seed):
+    img, _ = _eye(seed)
+    cv.setRNGSeed(seed)
+    expected = pf.kmeans(img)
+    assert np.array_equal(pf.kmeans_histogram(img), expected)
+    assert np.array_equal(pf.kmeans_histogram(img, WHITE_POINT, pf.intensity_histogram(img)), expected)
+
+def test_normalized_histogram_kmeans_matches_cv_kmeans():
+    img, _ = _eye(0)
+    histogram = pf.intensity_histogram(img)
+    normalized = pf.normalize(img, WHITE_POINT, 99.5, histogram)
+    cv.setRNGSeed(0)
+    expected = pf.kmeans(normalized)
+    mask = pf.kmeans_histogram(normalized, WHITE_POINT, histogram, percentile=99.5)
+    #Normalized intensities are binned to whole levels, so only pixels within a level of the split may differ
+    assert np.count_nonzero(mask != expected) <= img.size * 1e-4
+
+@pytest.mark.parametrize('seed', range(3))
+def test_otsu_mask_matches_cv_otsu(seed):
+    img = (_eye(seed)[0] >> 4).astype(np.uint8)
+    _, expected = cv.threshold(img, 0, 1, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    assert np.array_equal(pf.otsu_mask(img, 255), expected)
+    assert np.array_equal(pf.otsu_mask(img, 255, pf.intensity_histogram(img)), expected)
+
+def test_bayesian_mask_matches_per_pixel_decision():
+    trainer = Trainer()
+    for seed in range(2):
+        img, disc = _eye(seed)
+        trainer.update(TiffImage(Path('raw.tif'), 1, WHITE_POINT, reader=lambda _, img=img: img),
+                       TiffImage(Path('truth.tif'), 1, WHITE_POINT, reader=lambda _, disc=disc: disc.astype(np.uint8) * 255))
+    model = trainer.model()
+    img, disc = _eye(2)
+    mask = pf.bayesian_mask(img, WHITE_POINT, model.likelihood_true, model.likelihood_false, model.prior,
+                            histogram=pf.intensity_histogram(img))
+    #The maximum a posteriori class of each pixel under the trained prior
+    decided = (model.prior * model.likelihood_true[img] > (1 - model.prior) * model.likelihood_false[img])
+    assert np.count_nonzero(mask != decided) <= img.size * 1e-3
+    assert np.count_nonzero(mask != disc) <= img.size * 1e-3
+
+def _blobs(seed: int) -> np.ndarray:
+    #A large eye, a smaller one and scattered specks, as a 0/255 mask
+    rng = np.random.default_rng(seed)
+    y_coords, x_coords = np.ogrid[:512, :512]
+    mask = (y_coords - 260) ** 2 / 110 ** 2 + (x_coords - 240 - seed) ** 2 / 95 ** 2 < 1
+    mask |= (y_coords - 80) ** 2 + (x_coords - 420) ** 2 < 45 ** 2
+    mask |= rng.random((512, 512)) > 0.995
+    return mask.astype(np.uint8) * 255
+
+@pytest.mark.parametrize('seed', range(3))
+def test_components_fit_matches_contour_fit(seed):
+    mask = _blobs(seed)
+    expected = pf.circle_params_contour(mask, 1, 2500)
+    result = pf.circle_params_components(mask, 1, 2500)
+    assert result.center_y == pytest.approx(expected.center_y, abs=1e-3)
+    assert result.center_x == pytest.approx(expected.center_x, abs=1e-3)
+    assert result.radius == expected.radius
+    first, second = pf.circle_params_regions(mask, 1, 2500, count=2)
+    assert first == result and second.radius < first.radius
+    assert (second.center_y, second.center_x) == pytest.approx((80, 420), abs=1.0)
+
+def _coordinate_eigenvalue(mask: np.ndarray, img_scaling: float, max_radius: int) -> pf.Circle:
+    #The original fitter: median center and covariance from the full coordinate arrays
+    y_coords, x_coords = np.where(mask > 0)
+    center_y = np.partition(y_coords, y_coords.size // 2)[y_coords.size // 2]
+    center_x = np.partition(x_coords, x_coords.size // 2)[x_coords.size // 2]
+    eigenvalues = np.linalg.eigvals(np.cov(np.vstack((y_coords - center_y, x_coords - center_x))))
+    return pf.Circle(center_y, center_x, min(2 * math.sqrt(min(eigenvalues)), max_radius // img_scaling))
+
+@pytest.mark.parametrize('seed', range(3))
+def test_moment_eigenvalue_fit_matches_coordinate_fit(seed):
+    mask = _blobs(seed)
+    expected = _coordinate_eigenvalue(mask, 1, 2500)
+    result = pf.circle_params_eigenvalue(mask, 1, 2500)
+    assert (result.center_y, result.center_x) == (expected.center_y, expected.center_x)
+    assert result.radius == pytest.approx(expected.radius, rel=1e-9)
+    y_coords, x_coords = np.where(mask > 0)
+    mean = pf.circle_params_eigenvalue(mask, 1, 2500, center='mean')
+    assert (mean.center_y, mean.center_x) == pytest.approx((y_coords.mean(), x_coords.mean()), rel=1e-9)
+    assert pf.circle_params_eigenvalue(mask, 2, 100).radius == 50
@@ -0,0 +1,76 @@
+import csv
+import os
+from pathlib import Path
+import numpy as np
+import pytest
+import tifffile as tf
+from src.engine.config import Config
+from src.engine.images_queue import LazyQueue, MultiSourceQueue, PriorityQueue
+from src.engine.main import ProcessingWorker
+
+def _drain(queue) -> list[str]:
+    names = []
+    while not queue.is_empty():
+        names.append(queue.front_path().name)
+        queue.dequeue()
+    return names
+
+@pytest.mark.parametrize('order, expected', [('FIFO', ['b', 'c', 'a']), ('Newest', ['a', 'c', 'b']),
+                                             ('Mtime', ['b', 'c', 'a']), ('newest', ['a', 'c', 'b'])])
+def test_priority_queue_order(tmp_path, order, expected):
+    queue = PriorityQueue(tmp_path, image_factory=lambda path: path, file_format='tiff', order=order)
+    #Discovered as b, c, a; a was modified last and b first
+    for name, mtime in (('b', 1), ('c', 2), ('a', 3)):
+        path = tmp_path / f'{name}.tiff'
+        path.write_bytes(b'data')
+        os.utime(path, ns=(mtime * 10 ** 9, mtime * 10 ** 9))
+        queue.update()
+    assert [Path(name).stem for name in _drain(queue)] == expected
+
+def test_sources_take_turns(tmp_path):
+    queues = {}
+    for name, files in (('default', 4), ('b', 2), ('c', 1)):
+        directory = tmp_path / name
+        directory.mkdir()
+        for index in range(files):
+            (directory / f'{index}.tiff').write_bytes(b'data')
+        queues[name] = LazyQueue(directory, image_factory=lambda path: path, file_format='tiff', enqueue_existing=True)
+    queue = MultiSourceQueue(queues)
+    order = []
+    while not queue.is_empty():
+        path = queue.front_path()
+        order.append(queue.source)
+        assert queue.key(queue.source, path) == (path.name if queue.source == 'default' else f'{queue.source}/{path.name}')
+        queue.dequeue()
+    assert order == ['default', 'b', 'c', 'default', 'b', 'default', 'default']
+
+def test_sources_sharing_a_file_name_keep_separate_outputs(tmp_path):
+    img = np.full((128, 128), 200, np.uint16)
+    img[32:96, 32:96] = 3000
+    for name in ('default', 'b'):
+        (tmp_path / name).mkdir()
+        tf.imwrite(tmp_path / name / 'x.tiff', img)
+    output = tmp_path / 'output'
+    output.mkdir()
+    config = Config.from_dict({'files': {'Directory': str(tmp_path / 'default'), 'Output_Directory': str(output),
+                                         'Write_ROI': 'True'},
+                               'source:b': {'Directory': str(tmp_path / 'b')},
+                               'images': {'Image_Format': 'TIFF', 'White_Point': '4095', 'Scaling': '1'},
+                               'processing': {'Check_Delay': '0'}})
+    ProcessingWorker(config, live=False).run()
+    assert (output / 'roi_drawn' / 'x.tiff').exists() and (output / 'roi_drawn' / 'b' / 'x.tiff').exists()
+    session, = output.glob('*.csv')
+    with open(session, newline='') as file:
+        assert sorted((row['source'], row['filename']) for row in csv.DictReader(file)) == [('b', 'x'), ('default', 'x')]
+    with open(session.with_suffix('.manifest')) as file:
+        assert sorted(file.read().splitlines()[1:]) == ['b/x.tiff', 'x.tiff']
+
+def test_queue_order_is_case_insensitive(tmp_path, monkeypatch):
+    #Config() writes its defaults to options.ini in the working directory
+    monkeypatch.chdir(tmp_path)
+    config = Config()
+    config.override('files', Queue_Order='newest')
+    config.validate()
+    config.override('files', Queue_Order='random')
+    with pytest.raises(ValueError, match='Queue Order'):
+        config.validate()
@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+import numpy as np
+import tifffile as tf
+from src.engine.config import Config
+from src.processing.processing_result import FluorescenceResult
+from src.processing.result_cache import ResultCache
+
+RESULT = FluorescenceResult(normalized=False, writeable_img=None, binary_img=None, center=(10.0, 12.0), radius=5.0,
+                            mean_fluorescence=123.0)
+
+def _write(path: Path, value: int, size: int=64) -> Path:
+    tf.imwrite(path, np.full((size, size), value, np.uint16))
+    return path
+
+def _set_mtime(path: Path, mtime_ns: int) -> None:
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+def test_hit_needs_the_same_fingerprint(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 1)
+    with ResultCache(tmp_path / 'cache.sqlite', fingerprint='first') as cache:
+        cache.put(path, RESULT)
+        assert cache.get(path).mean_fluorescence == 123.0
+    with ResultCache(tmp_path / 'cache.sqlite', fingerprint='second') as cache:
+        assert cache.get(path) is None
+
+def test_changed_size_or_mtime_misses(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 1)
+    with ResultCache(tmp_path / 'cache.sqlite', fingerprint='fingerprint') as cache:
+        cache.put(path, RESULT)
+        mtime_ns = path.stat().st_mtime_ns
+        _set_mtime(path, mtime_ns + 1_000_000_000)
+        assert cache.get(path) is None
+        _write(path, 1, size=65)
+        _set_mtime(path, mtime_ns)
+        assert cache.get(path) is None
+        assert cache.hits == 0 and cache.misses == 2
+
+def test_digest_catches_rewrites_that_keep_size_and_mtime(tmp_path):
+    path = _write(tmp_path / 'a.tiff', 1)
+    with ResultCache(tmp_path / 'plain.sqlite', fingerprint='fingerprint') as plain, \
+            ResultCache(tmp_path / 'hashed.sqlite', fingerprint='fingerprint', fast_hash=True) as hashed:
+        plain.put(path, RESULT)
+        hashed.put(path, RESULT)
+        mtime_ns = path.stat().st_mtime_ns
+        _write(path, 2)
+        _set_mtime(path, mtime_ns)
+        assert plain.get(path) is not None
+        assert hashed.get(path) is None
+
+def test_fingerprint_covers_tiled_settings():
+    def fingerprint(processing: dict) -> str:
+        return Config.from_dict({'processing': processing}).processor_fingerprint()
+    assert fingerprint({'Tiled': 'False'}) != fingerprint({'Tiled': 'True'})
+    assert fingerprint({'Tiled': 'True', 'Tile_Size': '1024'}) != fingerprint({'Tiled': 'True', 'Tile_Size': '2048'})
+    assert fingerprint({'Tiled': 'False', 'Tile_Size': '1024'}) == fingerprint({'Tiled': 'False', 'Tile_Size': '2048'})
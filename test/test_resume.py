@@ -0,0 +1,102 @@
+import csv
+import re
+import time
+from pathlib import Path
+import numpy as np
+import tifffile as tf
+from src.engine.config import Config
+from src.engine.main import ProcessingWorker
+
+NAMES = [f'img{index}' for index in range(6)]
+
+def _write_images(directory: Path) -> Path:
+    directory.mkdir()
+    for index, name in enumerate(NAMES):
+        img = np.full((128, 128), 200, np.uint16)
+        img[32 + index:96, 32:96] = 3000
+        tf.imwrite(directory / f'{name}.tiff', img)
+    return directory
+
+def _run(directory: Path, output: Path, stop_after: int=None, statistics: str='') -> list[str]:
+    config = Config.from_dict({'files': {'Directory': str(directory), 'Output_Directory': str(output), 'Resume_Batch': 'True'},
+                               'images': {'Image_Format': 'TIFF', 'White_Point': '4095', 'Scaling': '1'},
+                               'processing': {'ROI_Statistics': statistics, 'Check_Delay': '0'}})
+    worker = ProcessingWorker(config, live=False)
+    processed, messages = [], []
+    def on_output(message: str) -> None:
+        messages.append(message)
+        if re.match(r'\d+/\d+ - ', message):
+            processed.append(message)
+            if len(processed) == stop_after:
+                worker.stop()
+    worker.output.connect(on_output)
+    worker.run()
+    return messages
+
+def _rows(path: Path) -> list[str]:
+    with open(path, newline='') as file:
+        return [row['filename'] for row in csv.DictReader(file)]
+
+def _sessions(output: Path) -> list[Path]:
+    return sorted(output.glob('*.csv'))
+
+def test_interrupted_session_resumes_without_duplicates(tmp_path):
+    directory, output = _write_images(tmp_path / 'images'), tmp_path / 'output'
+    _run(directory, output, stop_after=2)
+    session, = _sessions(output)
+    assert len(_rows(session)) == 2
+    messages = _run(directory, output)
+    assert 'Resuming' in ' '.join(messages)
+    assert _sessions(output) == [session]
+    assert sorted(_rows(session)) == NAMES
+
+def test_rows_without_a_manifest_entry_are_dropped(tmp_path):
+    directory, output = _write_images(tmp_path / 'images'), tmp_path / 'output'
+    _run(directory, output, stop_after=2)
+    session, = _sessions(output)
+    done = _rows(session)
+    #A crash between writing an image's row and its manifest entry
+    missing = next(name for name in NAMES if name not in done)
+    with open(session, 'a', newline='') as file:
+        csv.writer(file).writerow([missing, '1.000'])
+    messages = _run(directory, output)
+    assert 'Removed 1 rows of an interrupted image' in messages
+    assert sorted(_rows(session)) == NAMES
+
+def test_changed_columns_start_a_new_session(tmp_path):
+    directory, output = _write_images(tmp_path / 'images'), tmp_path / 'output'
+    _run(directory, output, stop_after=2)
+    first, = _sessions(output)
+    #Session names have one-second resolution
+    time.sleep(1.1)
+    messages = _run(directory, output, statistics='max')
+    assert any(message.startswith(f'Not resuming {first.stem}') for message in messages)
+    assert len(_rows(first)) == 2
+    second, = [path for path in _sessions(output) if path != first]
+    assert sorted(_rows(second)) == NAMES
+
+def test_manifest_is_chosen_by_source_directory(tmp_path):
+    first_directory, output = _write_images(tmp_path / 'first'), tmp_path / 'output'
+    second_directory = _write_images(tmp_path / 'second')
+    _run(first_directory, output, stop_after=2)
+    first, = _sessions(output)
+    time.sleep(1.1)
+    _run(second_directory, output, stop_after=3)
+    second, = [path for path in _sessions(output) if path != first]
+    _run(first_directory, output)
+    assert sorted(_rows(first)) == NAMES
+    assert len(_rows(second)) == 3
+
+def test_images_that_never_read_count_as_errors(tmp_path):
+    directory, output = _write_images(tmp_path / 'images'), tmp_path / 'output'
+    #A file still changing after Max_Checks is given up on, here every one of them
+    config = Config.from_dict({'files': {'Directory': str(directory), 'Output_Directory': str(output)},
+                               'images': {'Image_Format': 'TIFF', 'White_Point': '4095', 'Scaling': '1'},
+                               'processing': {'Check_Delay': '0', 'Max_Checks': '1', 'Required_Stable': '3'}})
+    worker = ProcessingWorker(config, live=False)
+    errors = []
+    worker.error.connect(errors.append)
+    worker.run()
+    stats = worker.stats.snapshot()
+    assert stats.errors == len(NAMES) and stats.processed == 0
+    assert len(errors) == 1 and errors[0].endswith(f'({len(NAMES) - 1} more unreadable images skipped)')
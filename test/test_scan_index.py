@@ -0,0 +1,90 @@
+import os
+from pathlib import Path
+import numpy as np
+from src.engine.images_queue import LazyQueue, ScanIndex
+
+def _touch(path: Path, data: bytes=b'data') -> Path:
+    path.write_bytes(data)
+    return path
+
+def _queue(directory: Path, enqueue_existing: bool=False, index_path: Path=None) -> LazyQueue:
+    return LazyQueue(directory, image_factory=lambda path: path, file_format='tiff', enqueue_existing=enqueue_existing,
+                     index_path=index_path)
+
+def _names(queue: LazyQueue) -> list[str]:
+    names = []
+    while not queue.is_empty():
+        names.append(queue.front_path().name)
+        queue.dequeue()
+    return names
+
+def test_existing_files_are_skipped_even_when_still_being_written(tmp_path):
+    for index in range(3):
+        _touch(tmp_path / f'a{index}.tiff')
+    queue = _queue(tmp_path)
+    with open(tmp_path / 'a2.tiff', 'ab') as file:
+        file.write(b'more')
+    queue.update()
+    assert _names(queue) == []
+    _touch(tmp_path / 'b.tiff')
+    queue.update()
+    assert _names(queue) == ['b.tiff']
+
+def test_enqueue_existing_lists_matching_files(tmp_path):
+    for name in ('a.tiff', 'b.tiff', 'c.czi', 'live.tiff', 'preview_a.tiff'):
+        _touch(tmp_path / name)
+    (tmp_path / 'd.tiff').mkdir()
+    assert sorted(_names(_queue(tmp_path, enqueue_existing=True))) == ['a.tiff', 'b.tiff']
+
+def test_saved_index_picks_up_files_that_arrived_while_closed(tmp_path):
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    index_path = tmp_path / 'index' / 'default.npz'
+    _touch(directory / 'a.tiff')
+    queue = _queue(directory, index_path=index_path)
+    _touch(directory / 'b.tiff')
+    queue.update()
+    assert _names(queue) == ['b.tiff']
+    queue.close()
+    _touch(directory / 'c.tiff')
+    restarted = _queue(directory, index_path=index_path)
+    restarted.update()
+    assert _names(restarted) == ['c.tiff']
+
+def test_unchanged_directory_mtime_is_relisted_periodically(tmp_path):
+    _touch(tmp_path / 'a.tiff')
+    index = ScanIndex(tmp_path, 'tiff')
+    index.skip_existing()
+    index.SETTLE_S = 0.0
+    assert index.scan() == []
+    #A share that does not update the directory mtime: the new file is only found by a forced relist
+    stat = os.stat(tmp_path)
+    _touch(tmp_path / 'b.tiff')
+    os.utime(tmp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert index.scan() == []
+    index.RELIST_S = 0.0
+    assert [path.name for _, path in index.scan()] == ['b.tiff']
+
+def test_known_entries_are_pruned_to_the_folder(tmp_path):
+    directory = tmp_path / 'images'
+    directory.mkdir()
+    for name in ('a.tiff', 'b.tiff', 'notes.txt'):
+        _touch(directory / name)
+    index = ScanIndex(directory, 'tiff', tmp_path / 'index.npz')
+    index.skip_existing()
+    (directory / 'a.tiff').unlink()
+    (directory / 'notes.txt').unlink()
+    index.RELIST_S = 0.0
+    assert index.scan() == []
+    index.save()
+    with np.load(tmp_path / 'index.npz') as saved:
+        assert [key.split('/')[0] for key in saved['keys'].tolist()] == ['b.tiff']
+
+def test_unaccepted_files_stay_pending(tmp_path):
+    index = ScanIndex(tmp_path, 'tiff')
+    index.skip_existing()
+    _touch(tmp_path / 'a.tiff')
+    key, path = index.scan()[0]
+    assert [name for _, name in index.scan()] == [path]
+    index.accept(key)
+    assert index.scan() == []
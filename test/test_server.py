@@ -0,0 +1,61 @@
+import io
+import json
+import threading
+import urllib.error
+import urllib.request
+from pathlib import Path
+import numpy as np
+import pytest
+from src.engine.config import Config
+from src.engine.server import create_server
+from src.images.image import TiffImage
+
+CONFIG = {'images': {'White_Point': '4095', 'Scaling': '1'}}
+
+@pytest.fixture
+def server():
+    config = Config.from_dict(CONFIG)
+    server = create_server(config, host='127.0.0.1', port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_address[1]}'
+    server.shutdown()
+    server.close()
+
+def _post(url: str, body: bytes) -> tuple[int, bytes]:
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=body, method='POST'), timeout=30) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+def test_health(server):
+    with urllib.request.urlopen(f'{server}/health', timeout=30) as response:
+        assert json.loads(response.read()) == {'status': 'ok', 'queued': 0}
+
+def test_array_is_processed(server):
+    img = np.full((256, 256), 200, np.uint16)
+    y_coords, x_coords = np.ogrid[:256, :256]
+    img[(y_coords - 128) ** 2 + (x_coords - 100) ** 2 < 50 ** 2] = 3000
+    body = io.BytesIO()
+    np.save(body, img)
+    status, data = _post(f'{server}/arrays?name=eye', body.getvalue())
+    result = json.loads(data)
+    expected = Config.from_dict(CONFIG).create_processor(tracking=False).process(
+        TiffImage(Path('eye'), scaling=1, white_point=4095, reader=lambda _: img))
+    assert status == 200 and result['name'] == 'eye' and len(result['rois']) == 1
+    assert result['center'] == pytest.approx([128, 100], abs=1.0) and result['center'] == pytest.approx(list(expected.center))
+    assert result['radius'] == expected.radius
+    assert result['mean_fluorescence'] == pytest.approx(expected.mean_fluorescence)
+
+def test_missing_path_streams_an_error_line(server, tmp_path):
+    missing = tmp_path / 'missing.tiff'
+    status, data = _post(f'{server}/jobs', json.dumps({'paths': [str(missing)]}).encode())
+    line, = data.decode().splitlines()
+    result = json.loads(line)
+    assert status == 200 and result['name'] == 'missing' and result['error']
+
+@pytest.mark.parametrize('body', [b'[1, 2]', b'{}', b'{"paths": "a.tiff"}', b'{"paths": [1]}'])
+def test_malformed_job_request_is_rejected(server, body):
+    status, data = _post(f'{server}/jobs', body)
+    assert status == 400 and json.loads(data) == {'error': 'Expected a JSON object with a "paths" list of strings.'}
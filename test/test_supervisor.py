@@ -0,0 +1,40 @@
+from time import monotonic
+import numpy as np
+import tifffile as tf
+from src.engine.config import Config
+from src.engine.supervisor import SupervisedPool
+
+def _wait(pool: SupervisedPool, done, timeout_s: float=60.0) -> list:
+    outcomes = []
+    deadline = monotonic() + timeout_s
+    while not done(outcomes) and monotonic() < deadline:
+        outcomes.extend(pool.poll())
+    assert done(outcomes)
+    return outcomes
+
+def test_idle_worker_that_dies_is_restarted(tmp_path):
+    path = tmp_path / 'a.tiff'
+    img = np.full((128, 128), 200, np.uint16)
+    img[32:96, 32:96] = 3000
+    tf.imwrite(path, img)
+    config = Config.from_dict({'images': {'Image_Format': 'TIFF', 'White_Point': '4095', 'Scaling': '1'}})
+    source = config.sources[0].name
+    pool = SupervisedPool(config, workers=1, timeout_s=30, memory_mb=0)
+    try:
+        _wait(pool, lambda _: pool.idle == 1)
+        process = pool._slots[0].process
+        process.kill()
+        process.join()
+        #Submitting to the dead worker restarts it instead of raising
+        assert not pool.submit(path, source)
+        _wait(pool, lambda _: pool.idle == 1)
+        #A death noticed by poll restarts it too
+        pool._slots[0].process.kill()
+        pool._slots[0].process.join()
+        assert pool.poll(timeout=0) == [] and pool.idle == 0
+        _wait(pool, lambda _: pool.idle == 1)
+        assert pool.submit(path, source)
+        outcome, = _wait(pool, lambda outcomes: outcomes)
+        assert outcome.error is None and outcome.name == 'a' and outcome.result.mean_fluorescence > 0
+    finally:
+        pool.close()
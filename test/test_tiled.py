@@ -0,0 +1,59 @@
+from pathlib import Path
+import numpy as np
+import pytest
+import tifffile as tf
+from src.engine.config import Config
+from src.engine.main import ProcessingWorker
+from src.images.tiles import open_tiff_tiles
+from src.processing.tiled import ComponentTable
+
+WHITE_POINT = 4095
+
+def _write(path: Path, shape: tuple[int, int], center: tuple[int, int], radius: int) -> Path:
+    img = np.full(shape, 200, np.uint16)
+    y_coords, x_coords = np.ogrid[:shape[0], :shape[1]]
+    img[(y_coords - center[0]) ** 2 + (x_coords - center[1]) ** 2 < radius ** 2] = 3000
+    tf.imwrite(path, img)
+    return path
+
+def _process(path: Path, tiled: bool, tile_size: int=2048):
+    config = Config.from_dict({'images': {'Image_Format': 'TIFF', 'White_Point': str(WHITE_POINT), 'Scaling': '1'},
+                               'processing': {'Masking_Method': 'Thresholding', 'Radius_Method': 'Components',
+                                              'Tiled': str(tiled), 'Tile_Size': str(tile_size),
+                                              'ROI_Statistics': 'max, saturated'}})
+    reader = open_tiff_tiles if tiled else tf.imread
+    return config.create_processor().process(config.create_image(path, reader=reader))
+
+def _assert_matches(path: Path, tile_size: int):
+    expected = _process(path, tiled=False)
+    result = _process(path, tiled=True, tile_size=tile_size)
+    assert result.center == pytest.approx(expected.center, abs=1.0)
+    assert result.radius == pytest.approx(expected.radius, abs=2.0)
+    assert result.mean_fluorescence == pytest.approx(expected.mean_fluorescence, rel=1e-3)
+    assert result.rois[0].statistics == expected.rois[0].statistics
+
+def test_image_smaller_than_a_tile(tmp_path):
+    _assert_matches(_write(tmp_path / 'small.tiff', (300, 400), center=(140, 210), radius=60), tile_size=512)
+
+def test_eye_straddling_tile_boundaries(tmp_path):
+    #The eye covers the corner where four 128px tiles meet, so its pieces must be merged back into one component
+    path = _write(tmp_path / 'mosaic.tiff', (384, 448), center=(130, 250), radius=90)
+    _assert_matches(path, tile_size=128)
+
+def test_union_sums_component_moments():
+    table = ComponentTable()
+    first = table.add(np.array([[4.0, 0, 0, 0, 0, 0], [1.0, 0, 0, 0, 0, 0]]))
+    second = table.add(np.array([[3.0, 0, 0, 0, 0, 0]]))
+    table.union(first, second)
+    assert table.largest(2)[:, 0].tolist() == [7.0, 1.0]
+
+def test_session_start_notes_the_moment_fit(tmp_path):
+    config = Config.from_dict({'files': {'Directory': str(tmp_path), 'Output_Directory': str(tmp_path / 'output')},
+                               'images': {'Image_Format': 'TIFF', 'White_Point': str(WHITE_POINT), 'Scaling': '1'},
+                               'processing': {'Tiled': 'True', 'Radius_Method': 'Contour'}})
+    worker = ProcessingWorker(config, live=False)
+    messages = []
+    worker.output.connect(messages.append)
+    worker.run()
+    assert 'Tiled processing fits eyes from their moments (Eigenvalue radius, mean center), ' \
+           'not Radius Method Contour with Center Method Median' in messages